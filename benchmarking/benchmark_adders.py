@@ -7,6 +7,7 @@ from qiskit import QuantumCircuit
 from pandora.db.core import PandoraDB
 from pandora.db.repository import GateRepository
 from pandora.db.service import PandoraService
+from pandora.translation.quipper_reader import QuipperReader
 from pandora.translation.translator import PandoraGateTranslator
 from pandora import PandoraOptimiser
 
@@ -71,6 +72,14 @@ def get_adder(n_bits: int):
     return qc
 
 
+def stream_adder(n_bits: int, decompose_toffoli: bool = True) -> QuipperReader:
+    """
+        Same gates as replace_all_toffolis_qiskit(get_adder(n_bits)), but read lazily
+        from the file while the circuit is being built.
+    """
+    return QuipperReader(f"benchmarking/adders/Adder{n_bits}.txt", decompose_toffoli=decompose_toffoli)
+
+
 def decompose_toffoli_qiskit(qc, c0, c1, t):
     qc.h(t)
 
@@ -124,8 +133,7 @@ async def main():
     timeout = 30
     
     for n_bits in [16, 32, 64, 128, 256, 512, 1024, 2048]:
-        adder_circuit = get_adder(n_bits=n_bits)
-        adder_circuit = replace_all_toffolis_qiskit(adder_circuit)
+        adder_circuit = stream_adder(n_bits=n_bits)
         
         db = PandoraDB()
         await db.connect()
@@ -0,0 +1,89 @@
+import asyncio
+import csv
+import random
+import sys
+
+import cirq
+
+from pandora.db.core import PandoraDB
+from pandora.db.repository import GateRepository
+from pandora.db.service import PandoraService
+from pandora.optimisation.optimiser import PandoraOptimiser
+from pandora.translation.translator import PandoraGateTranslator
+
+H = PandoraGateTranslator.HPowGate
+CX = PandoraGateTranslator.CXPowGate
+
+
+def random_cancellation_circuit(n_pairs: int, n_qubits: int = 64) -> tuple[int, cirq.Circuit]:
+    """
+    n_pairs H-H and CX-CX pairs that cancel, separated by T gates that do not.
+    """
+    qubits = cirq.LineQubit.range(n_qubits)
+
+    ops = []
+    for _ in range(n_pairs):
+        if random.random() < 0.3:
+            control, target = random.sample(qubits, 2)
+            ops += [cirq.CX(control, target)] * 2
+        else:
+            ops += [cirq.H(random.choice(qubits))] * 2
+        ops.append(cirq.T(random.choice(qubits)))
+
+    return n_pairs, cirq.Circuit(ops)
+
+
+async def time_rewrites(db: PandoraDB, circuit: cirq.Circuit, nprocs: int, batch_size: int | None) -> float:
+    service = PandoraService(db=db, repo=GateRepository(db))
+    await service.build_circuit(circuit=circuit)
+
+    optimiser = PandoraOptimiser(db=db, pass_count=PandoraOptimiser.LARGE_RUN_NR, timeout=600)
+    optimiser.cancel_single_qubit_gates(gate_types=(H, H), dedicated_nproc=nprocs, batch_size=batch_size)
+    optimiser.cancel_two_qubit_gates(gate_types=(CX, CX), dedicated_nproc=nprocs, batch_size=batch_size)
+    optimiser.add_stopper()
+    await optimiser.start()
+
+    # until the last rewrite, the stopper needs idle_rounds more passes to see the fixed point
+    return optimiser.rewrite_time
+
+
+async def main():
+    """
+    Rewrites/sec of the per-match procedures (batch size 1 in the csv) against the
+    batched ones, usage: benchmark_batched.py <nprocs> [<batch_size> ...]
+    The time is the one until the last rewrite, see PandoraOptimiser.rewrite_time.
+    """
+    if len(sys.argv) < 2:
+        sys.exit(0)
+
+    nprocs = int(sys.argv[1])
+    batch_sizes = [int(arg) for arg in sys.argv[2:]] or [16, 64, 256]
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        for n_pairs in [10_000, 100_000]:
+            rewrites, circuit = random_cancellation_circuit(n_pairs)
+
+            per_match = await time_rewrites(db, circuit, nprocs, batch_size=None)
+            print(f"{n_pairs} pairs, per match: {rewrites / per_match:.0f} rewrites/s")
+
+            results = [(n_pairs, nprocs, 1, per_match, rewrites / per_match, 1.0)]
+            for batch_size in batch_sizes:
+                elapsed = await time_rewrites(db, circuit, nprocs, batch_size=batch_size)
+                print(
+                    f"{n_pairs} pairs, batches of {batch_size}: {rewrites / elapsed:.0f} rewrites/s "
+                    f"({per_match / elapsed:.2f}x)"
+                )
+                results.append((n_pairs, nprocs, batch_size, elapsed, rewrites / elapsed, per_match / elapsed))
+
+            with open(f"pandora_batched_rewrites_{nprocs}.csv", "a", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerows(results)
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
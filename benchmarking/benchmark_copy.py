@@ -0,0 +1,93 @@
+import asyncio
+import csv
+import random
+import sys
+import time
+
+import cirq
+import numpy as np
+
+from pandora.db.core import PandoraDB
+from pandora.db.repository import GateRepository
+from pandora.db.service import PandoraService
+from pandora.translation.circuit_to_dag import (
+    PandoraWindowedBuilder,
+    PandoraColumnarBuilder,
+)
+
+
+def random_clifford_t_ops(n_ops: int, n_qubits: int = 64) -> list[cirq.Operation]:
+    qubits = cirq.LineQubit.range(n_qubits)
+    single = [cirq.H, cirq.T, cirq.T ** -1, cirq.S, cirq.X]
+
+    ops = []
+    for _ in range(n_ops):
+        if random.random() < 0.3:
+            control, target = random.sample(qubits, 2)
+            ops.append(cirq.CX(control, target))
+        else:
+            ops.append(random.choice(single).on(random.choice(qubits)))
+    return ops
+
+
+def build_single_window(builder, ops):
+    """
+    Returns all gates of the op list as one window.
+    """
+    windows = list(builder.consume(ops))
+    windows.append(builder.finalize())
+
+    if isinstance(builder, PandoraColumnarBuilder):
+        return np.concatenate(windows)
+
+    return [g for window in windows for g in window]
+
+
+async def time_insert(service: PandoraService, insert, window) -> float:
+    await service.build_pandora()
+
+    start = time.perf_counter()
+    await insert(window)
+    return time.perf_counter() - start
+
+
+async def main():
+    window_sizes = [10_000, 100_000, 1_000_000]
+    if len(sys.argv) > 1:
+        window_sizes = [int(arg) for arg in sys.argv[1:]]
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo)
+
+        for window_size in window_sizes:
+            ops = random_clifford_t_ops(window_size)
+
+            gates = build_single_window(PandoraWindowedBuilder(window_size=len(ops) + 1), ops)
+            columns = build_single_window(PandoraColumnarBuilder(window_size=len(ops) + 1), ops)
+
+            paths = [
+                ("records_from_gates", repo.insert_copy, gates),
+                ("records_from_columns", repo.insert_columns, columns),
+                ("binary_from_gates", repo.insert_binary, gates),
+                ("binary_from_columns", repo.insert_binary, columns),
+            ]
+
+            for name, insert, window in paths:
+                elapsed = await time_insert(service, insert, window)
+                rows_per_sec = len(window) / elapsed
+
+                print(f"{window_size} {name}: {elapsed:.3f}s, {rows_per_sec:.0f} rows/s")
+
+                with open("pandora_copy_benchmark.csv", "a", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow((window_size, name, elapsed, rows_per_sec))
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -20,18 +20,13 @@ async def count_h_gates(db: PandoraDB) -> int:
         )
 
 
-async def partition_table(db: PandoraDB, nprocs: int):
-    async with db.pool.acquire() as conn:
-        await conn.execute("alter table linked_circuit add column partition_id integer;")
-        await conn.execute("update linked_circuit set partition_id = id % $1;", nprocs)
-
-
 async def rewrite_parallel(
         db: PandoraDB,
+        service: PandoraService,
         nprocs: int,
         nr_passes: int,
 ) -> None:
-    await partition_table(db, nprocs)
+    await service.partition_circuit(n_partitions=nprocs)
 
     optimiser = PandoraOptimiser(
         db=db,
@@ -41,7 +36,7 @@ async def rewrite_parallel(
         max_concurrency=nprocs if nprocs > 0 else 1,
     )
 
-    optimiser.hhcxhh_to_cx(dedicated_nproc=nprocs, run_multiple=True)
+    optimiser.hhcxhh_to_cx(dedicated_nproc=nprocs, partitioned=True)
     await optimiser.start()
 
 
@@ -85,6 +80,7 @@ async def run_single_case(
         if nprocs > 0:
             await rewrite_parallel(
                 db=db,
+                service=service,
                 nprocs=nprocs,
                 nr_passes=nr_passes,
             )
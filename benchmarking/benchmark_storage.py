@@ -0,0 +1,59 @@
+import asyncio
+import csv
+import sys
+
+from pandora.db.core import PandoraDB
+from pandora.db.repository import GateRepository
+from pandora.db.service import PandoraService
+
+from benchmarking.benchmark_adders import stream_adder
+
+
+async def bytes_per_gate(db: PandoraDB, repo: GateRepository) -> tuple[int, float, float]:
+    """
+    Returns the number of gates, and the heap and total (heap + indexes + TOAST) size
+    of the gate tables divided by it.
+    """
+    tables = [repo.table] + ([repo.attribute_table] if repo.compact else [])
+
+    async with db.pool.acquire() as conn:
+        await conn.execute(f"VACUUM ANALYZE {', '.join(tables)}")
+
+        n_gates = await conn.fetchval(f"SELECT count(*) FROM {repo.table}")
+        heap, total = await conn.fetchrow(
+            "SELECT sum(pg_relation_size(t)), sum(pg_total_relation_size(t)) FROM unnest($1::regclass[]) t",
+            tables,
+        )
+
+    return n_gates, heap / n_gates, total / n_gates
+
+
+async def main():
+    n_bits = [8, 64, 512, 2048]
+    if len(sys.argv) > 1:
+        n_bits = [int(arg) for arg in sys.argv[1:]]
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        for n in n_bits:
+            for compact in [False, True]:
+                repo = GateRepository(db, compact=compact)
+                service = PandoraService(db=db, repo=repo)
+
+                await service.build_circuit(circuit=stream_adder(n))
+                n_gates, heap, total = await bytes_per_gate(db, repo)
+
+                layout = "compact" if compact else "default"
+                print(f"Adder{n} {layout}: {n_gates} gates, {heap:.1f} B/gate heap, {total:.1f} B/gate total")
+
+                with open("pandora_storage_benchmark.csv", "a", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow((n, layout, n_gates, heap, total))
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
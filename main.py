@@ -1,7 +1,7 @@
 import asyncio
 import argparse
 
-from benchmarking.benchmark_adders import get_adder, replace_all_toffolis_qiskit
+from benchmarking.benchmark_adders import stream_adder
 from pandora.db.core import PandoraDB
 from pandora.db.repository import GateRepository, GateLayerRepository
 from pandora.db.service import PandoraService
@@ -16,7 +16,7 @@ async def run_rsa(config_file, BIG_N: int, nproc: int, container_id: int):
     repo = GateRepository(db)
     service = PandoraService(db=db, repo=repo)
 
-    await service.build_pandora()
+    await service.build_pandora(bulk_load=True)
 
     await db.close()
 
@@ -29,9 +29,14 @@ async def run_rsa(config_file, BIG_N: int, nproc: int, container_id: int):
         window_size=10000,
     )
 
+    await db.connect()
+    print(f"Bulk load: {await service.finish_bulk_load()}")
+    await service.stitch_shards()
+    await db.close()
+
 
 async def run_adder(config_file, N_BITS: int):
-    adder_circuit = replace_all_toffolis_qiskit(get_adder(n_bits=N_BITS))
+    adder_circuit = stream_adder(n_bits=N_BITS)
 
     db = PandoraDB(config_file)
     await db.connect()
@@ -0,0 +1,211 @@
+"""
+Encoder for the Postgres binary COPY format:
+
+    header  : PGCOPY\\n\\377\\r\\n\\0, int32 flags, int32 header extension length
+    tuple   : int16 field count, then per field an int32 length (-1 for NULL) followed by the value
+    trailer : int16 -1
+
+All integers are big-endian. A NULL field has no value bytes, so rows with different NULL
+patterns have different widths. Rows are therefore grouped by NULL pattern (and label) and
+every group is packed at once through a NumPy structured dtype. COPY does not care about
+row order within the stream.
+
+The other direction, BinaryCopyDecoder, is only for streams without NULLs, whose tuples
+then all have the same width.
+"""
+import struct
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from pandora.translation.gates import (
+    PANDORA_GATE_DTYPE,
+    NULL_LINK,
+    NULLABLE_COLUMNS,
+)
+
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+
+# wire format of the linked_circuit columns, label (char) is encoded separately
+PG_BINARY_TYPES = {
+    "id": ">i8",
+    "prev_q1": ">i8",
+    "prev_q2": ">i8",
+    "prev_q3": ">i8",
+    "type": ">i2",
+    "param": ">f4",
+    "global_shift": ">f4",
+    "switch": "?",
+    "next_q1": ">i8",
+    "next_q2": ">i8",
+    "next_q3": ">i8",
+    "visited": ">i4",
+    "label": None,
+    "cl_ctrl": "?",
+    "meas_key": ">i2",
+}
+
+
+def records_to_columns(records: Iterable[tuple]) -> np.ndarray:
+    """
+    Convert PandoraGate.to_tuple() records to a PANDORA_GATE_DTYPE array.
+    """
+    nulls = tuple("" if name == "label" else NULL_LINK for name in PANDORA_GATE_DTYPE.names)
+
+    rows = [
+        tuple(null if value is None else value for value, null in zip(record, nulls))
+        for record in records
+    ]
+    return np.array(rows, dtype=PANDORA_GATE_DTYPE)
+
+
+def encode_binary_copy(window: np.ndarray, columns: list[str]) -> bytes:
+    """
+    Encode a PANDORA_GATE_DTYPE window as one binary COPY stream for the given columns.
+    """
+    return b"".join(iter_binary_copy(window, columns))
+
+
+def iter_binary_copy(
+    window: np.ndarray,
+    columns: list[str],
+    chunk_rows: int = 65536,
+) -> Iterator[bytes]:
+    """
+    Same as encode_binary_copy(), but yields the stream in chunks of at most chunk_rows
+    rows, so that Postgres can already parse a chunk while the next one is encoded.
+    """
+    yield PGCOPY_HEADER
+
+    for start in range(0, len(window), chunk_rows):
+        yield _encode_rows(window[start:start + chunk_rows], columns)
+
+    yield PGCOPY_TRAILER
+
+
+def _encode_rows(window: np.ndarray, columns: list[str]) -> bytes:
+    nullable = [name for name in columns if name in NULLABLE_COLUMNS or name == "label"]
+
+    pattern = np.zeros(len(window), dtype=np.int64)
+    for bit, name in enumerate(nullable):
+        pattern |= _null_mask(window, name).astype(np.int64) << bit
+
+    labels, label_index = _unique_labels(window["label"])
+    group = pattern * len(labels) + label_index
+
+    parts = []
+
+    for key in np.unique(group):
+        rows = window[group == key]
+        null_columns = {name for bit, name in enumerate(nullable) if (key // len(labels)) >> bit & 1}
+        label = labels[key % len(labels)]
+
+        parts.append(_encode_group(rows, columns, null_columns, str(label).encode()))
+
+    return b"".join(parts)
+
+
+def _unique_labels(labels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # a window almost always carries a single label, skip sorting the strings then
+    if len(labels) == 0 or (labels == labels[0]).all():
+        return labels[:1], np.zeros(len(labels), dtype=np.int64)
+
+    return np.unique(labels, return_inverse=True)
+
+
+def _null_mask(window: np.ndarray, name: str) -> np.ndarray:
+    if name == "label":
+        return window[name] == ""
+    return window[name] == NULL_LINK
+
+
+def _encode_group(
+    rows: np.ndarray,
+    columns: list[str],
+    null_columns: set[str],
+    label: bytes,
+) -> bytes:
+    fields = [("n_fields", ">i2")]
+    for name in columns:
+        fields.append((f"{name}_len", ">i4"))
+
+        if name not in null_columns:
+            fields.append((name, PG_BINARY_TYPES[name] or f"S{len(label)}"))
+
+    packed = np.empty(len(rows), dtype=np.dtype(fields))
+    packed["n_fields"] = len(columns)
+
+    for name in columns:
+        if name in null_columns:
+            packed[f"{name}_len"] = -1
+        elif name == "label":
+            packed[f"{name}_len"] = len(label)
+            packed[name] = label
+        else:
+            packed[f"{name}_len"] = packed.dtype[name].itemsize
+            packed[name] = rows[name]
+
+    return packed.tobytes()
+
+
+class BinaryCopyDecoder:
+    """
+    Decoder for a binary COPY stream (COPY ... TO STDOUT (FORMAT binary)) whose fields are
+    all NOT NULL and of fixed width. Every tuple then has the same size, so the chunks that
+    Postgres sends are read through a NumPy structured dtype without a loop over the rows.
+
+    fields are (name, big-endian NumPy format) in the order of the COPY query.
+    """
+
+    def __init__(self, fields: list[tuple[str, str]]):
+        row = [("n_fields", ">i2")]
+        for name, fmt in fields:
+            row += [(f"{name}_len", ">i4"), (name, fmt)]
+
+        self.dtype = np.dtype(row)
+        self.n_fields = len(fields)
+
+        self._buffer = b""
+        self._header_read = False
+
+    def feed(self, data: bytes) -> np.ndarray:
+        """
+        Returns the tuples completed by data, a tuple split across chunks is kept
+        until the rest of it arrives.
+        """
+        buffer = self._buffer + data
+        start = 0
+
+        if not self._header_read:
+            # signature, flags and header extension length, then the extension itself
+            if len(buffer) < len(PGCOPY_HEADER):
+                self._buffer = buffer
+                return np.empty(0, dtype=self.dtype)
+
+            if buffer[:11] != PGCOPY_HEADER[:11]:
+                raise ValueError("not a binary COPY stream")
+
+            start = len(PGCOPY_HEADER) + struct.unpack(">i", buffer[15:19])[0]
+            if len(buffer) < start:
+                self._buffer = buffer
+                return np.empty(0, dtype=self.dtype)
+
+            self._header_read = True
+
+        # the trailer is shorter than a tuple, it is left in the buffer
+        n_rows = (len(buffer) - start) // self.dtype.itemsize
+        rows = np.frombuffer(buffer, dtype=self.dtype, count=n_rows, offset=start)
+        self._buffer = buffer[start + n_rows * self.dtype.itemsize:]
+
+        if n_rows > 0 and (rows["n_fields"] != self.n_fields).any():
+            raise ValueError("tuples of the COPY stream do not match the fields")
+
+        return rows
+
+    def close(self) -> None:
+        """
+        Check that the stream ended with the trailer and nothing is left over.
+        """
+        if self._buffer != PGCOPY_TRAILER:
+            raise ValueError("binary COPY stream ended in the middle of a tuple")
@@ -1,11 +1,24 @@
 import json
+import re
 
 import asyncpg
 from typing import Optional
 
 
 class PandoraDB:
-    def __init__(self, config: str | dict = None, min_size: int = 1, max_size: int = 32):
+    def __init__(
+            self,
+            config: str | dict = None,
+            min_size: int = 1,
+            max_size: int = 32,
+            namespace: Optional[str] = None,
+    ):
+        """
+        With a namespace (or a "namespace" entry in the config), the circuit lives in the
+        Postgres schema of that name instead of public: the connections put it first on
+        their search_path, so the tables and procedures of several circuits can be built
+        and optimised side by side in one database.
+        """
         self.min_size = min_size
         self.max_size = max_size
         self.pool: Optional[asyncpg.Pool] = None
@@ -17,6 +30,14 @@ class PandoraDB:
         else:
             self.config = config
 
+        if namespace is not None:
+            # the config is what worker processes connect with
+            self.config = {**self.config, "namespace": namespace}
+
+        self.namespace: Optional[str] = self.config.get("namespace")
+        if self.namespace is not None and not re.fullmatch(r"[a-z_][a-z0-9_]*", self.namespace):
+            raise ValueError("namespace must be a lower case identifier")
+
     async def connect(self):
         """
         If anything is missing in configs or the config is not specified, Postgres should use defaults.
@@ -29,6 +50,7 @@ class PandoraDB:
             database=self.config.get("database") or "postgres",
             min_size=self.min_size,
             max_size=self.max_size,
+            server_settings={"search_path": f"{self.namespace}, public"} if self.namespace else None,
         )
 
     async def close(self):
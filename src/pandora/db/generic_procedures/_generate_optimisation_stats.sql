@@ -31,23 +31,37 @@ begin
     select array_agg(id) into s_types from gate_types where name in ('s', 'sdag');
     select array_agg(id) into t_types from gate_types where name in ('t', 'tdag');
 
+    -- the samples read gate_type_counts instead of counting linked_circuit, see gate_histogram.sql
+    call start_gate_histogram();
+    commit;
+
     while true loop
         count := count + 1;
 
-        select count(*) into total from linked_circuit;
-        select count(*) into t_cnt from linked_circuit where type=any(t_types) or type=rz_type and param in (0.25, -0.25);
-        select count(*) into s_cnt from linked_circuit where type=any(s_types) or type=rz_type and param in (0.5, -0.5);
-        select count(*) into h_cnt from linked_circuit where type=h_type;
-        select count(*) into x_cnt from linked_circuit where type=paulix_type;
-        select count(*) into cx_cnt from linked_circuit where type=any(cx_types);
+        call fold_gate_histogram();
+
+        select coalesce(sum(c.count), 0),
+               coalesce(sum(c.count) filter (where type=any(t_types) or type=rz_type and param in (0.25, -0.25)), 0),
+               coalesce(sum(c.count) filter (where type=any(s_types) or type=rz_type and param in (0.5, -0.5)), 0),
+               coalesce(sum(c.count) filter (where type=h_type), 0),
+               coalesce(sum(c.count) filter (where type=paulix_type), 0),
+               coalesce(sum(c.count) filter (where type=any(cx_types)), 0)
+        into total, t_cnt, s_cnt, h_cnt, x_cnt, cx_cnt
+        from gate_type_counts c;
 
         insert into optimization_results(id, logger_id, total_count, t_count, s_count, h_count, cx_count, x_count)
         values (count, logid, total, t_cnt, s_cnt, h_cnt, cx_cnt, x_cnt);
 
-        if extract(epoch from (clock_timestamp() - start_time)) > timeout then
+        commit;
+
+        -- the workers are done once stopper() found the circuit saturated
+        if extract(epoch from (clock_timestamp() - start_time)) > timeout or stop_requested() then
             exit;
         end if;
 
+        perform pg_sleep(sleep_for);
 	end loop;
+
+    call stop_gate_histogram();
     commit;
 end;$$;
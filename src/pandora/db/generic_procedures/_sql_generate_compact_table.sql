@@ -0,0 +1,44 @@
+-- Compact layout of linked_circuit, replaces the table created by _sql_generate_table.sql.
+--
+-- The column names are the same, so the rewrite procedures run unchanged, but:
+--   * the links are grouped per qubit, so that the links of the qubits a gate does not
+--     act on are trailing NULLs (free apart from the null bitmap),
+--   * the columns are ordered by alignment, so there is no padding between them,
+--   * global_shift, visited, cl_ctrl and meas_key only differ from their defaults for
+--     few gates (measurements, classically controlled gates, rotations), they are kept
+--     in linked_circuit_attributes and only for those gates. Its foreign key on
+--     linked_circuit (on delete cascade) is added with the indexes, see _build_indexes().
+--
+-- GateRepository(compact=True) writes and reads this layout.
+DROP TABLE IF EXISTS linked_circuit CASCADE;
+
+create table linked_circuit
+(
+    -- the primary key and the indexes are in _sql_generate_indexes.sql
+    id      bigint default next_gate_id(),
+    prev_q1 bigint,
+    next_q1 bigint,
+    prev_q2 bigint,
+    next_q2 bigint,
+    prev_q3 bigint,
+    next_q3 bigint,
+    next_q1_id   bigint generated always as (get_id_from_link(next_q1)) stored,
+    next_q2_id   bigint generated always as (get_id_from_link(next_q2)) stored,
+    param   real,
+    type    smallint,
+    prev_q1_type smallint generated always as (get_type_from_link(prev_q1)) stored,
+    prev_q2_type smallint generated always as (get_type_from_link(prev_q2)) stored,
+    next_q1_type smallint generated always as (get_type_from_link(next_q1)) stored,
+    next_q2_type smallint generated always as (get_type_from_link(next_q2)) stored,
+    switch  boolean,
+    label   char
+) WITH (FILLFACTOR = 100);
+
+create table IF NOT EXISTS linked_circuit_attributes
+(
+    id           bigint primary key,
+    global_shift real default 0,
+    visited      int default -1,
+    meas_key     smallint,
+    cl_ctrl      boolean default false
+);
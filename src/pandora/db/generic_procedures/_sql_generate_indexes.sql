@@ -0,0 +1,19 @@
+-- Indexes of linked_circuit. After a bulk load every statement is run on its own connection so that the
+-- indexes are built in parallel. The primary key is attached to linked_circuit_pkey afterwards.
+-- Together they cover the candidate queries of all rewrite procedures, through the decoded link
+-- columns (next_q1_id, ..., next_q2_type) of linked_circuit.
+CREATE UNIQUE INDEX linked_circuit_pkey on linked_circuit(id);
+
+-- commute_single_control_left, cx_to_hhcxhh, hhcxhh_to_cx
+CREATE INDEX linked_circuit_neighbour_types_idx on linked_circuit(type, prev_q1_type, prev_q2_type, next_q1_type, next_q2_type);
+
+-- cancel_single_qubit, replace_two_sq_with_one
+CREATE INDEX linked_circuit_next_type_idx on linked_circuit(type, next_q1_type, param);
+
+-- cancel_two_qubit, cancel_two_qubit_equiv
+CREATE INDEX linked_circuit_next_ids_equal_idx on linked_circuit(type, next_q1_type, param)
+where next_q1_id = next_q2_id;
+
+-- linked_toffoli_decomp, its batches walk the Toffolis in id order
+CREATE INDEX linked_circuit_toffoli_idx on linked_circuit(id)
+where type = 23;
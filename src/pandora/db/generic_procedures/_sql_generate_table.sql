@@ -30,9 +30,99 @@ AS $$
     SELECT id * 1000 + port * 100 + type;
 $$;
 
-create table IF NOT EXISTS public.linked_circuit
+-- Gate ids are handed out in blocks of gate_id_block_size() consecutive ids.
+-- Block b covers [b * size, (b + 1) * size). Block 0 is never reserved, it is left to
+-- builders that run without an IdBlockAllocator and therefore count from 0.
+CREATE SEQUENCE IF NOT EXISTS gate_id_block_seq START WITH 1 MINVALUE 1;
+
+CREATE TABLE IF NOT EXISTS id_blocks
 (
-    id      bigserial primary key,
+    block    bigint primary key,
+    first_id bigint not null,
+    last_id  bigint not null,
+    owner    text
+);
+
+CREATE OR REPLACE FUNCTION gate_id_block_size()
+RETURNS bigint
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT 16777216::bigint;
+$$;
+
+CREATE OR REPLACE FUNCTION reserve_id_blocks(n_blocks int, block_owner text default null)
+RETURNS TABLE(first_id bigint, last_id bigint)
+LANGUAGE plpgsql
+AS $$
+declare
+    b bigint;
+begin
+    for i in 1..n_blocks loop
+        -- nextval is not transactional, concurrent callers never wait on each other
+        b := nextval('gate_id_block_seq');
+        first_id := b * gate_id_block_size();
+        last_id := first_id + gate_id_block_size() - 1;
+
+        insert into id_blocks values (b, first_id, last_id, block_owner);
+        return next;
+    end loop;
+end
+$$;
+
+-- Default of linked_circuit.id. Every session keeps its current block in two custom settings,
+-- so a new block is reserved only once per gate_id_block_size() inserted gates.
+CREATE OR REPLACE FUNCTION next_gate_id()
+RETURNS bigint
+LANGUAGE plpgsql
+AS $$
+declare
+    next_id bigint := coalesce(nullif(current_setting('pandora.next_gate_id', true), '')::bigint, 0);
+    id_limit bigint := coalesce(nullif(current_setting('pandora.gate_id_limit', true), '')::bigint, 0);
+begin
+    if next_id >= id_limit then
+        select r.first_id, r.last_id + 1 into next_id, id_limit
+        from reserve_id_blocks(1, 'backend ' || pg_backend_pid()) r;
+
+        perform set_config('pandora.gate_id_limit', id_limit::text, false);
+    end if;
+
+    perform set_config('pandora.next_gate_id', (next_id + 1)::text, false);
+    return next_id;
+end
+$$;
+
+-- First of n consecutive gate ids, for procedures that insert many gates in one statement.
+-- Taken from the same session block as next_gate_id(), a range never spans two blocks: if
+-- the rest of the current block is too short, a new block is reserved and the rest skipped.
+CREATE OR REPLACE FUNCTION next_gate_ids(n bigint)
+RETURNS bigint
+LANGUAGE plpgsql
+AS $$
+declare
+    next_id bigint := coalesce(nullif(current_setting('pandora.next_gate_id', true), '')::bigint, 0);
+    id_limit bigint := coalesce(nullif(current_setting('pandora.gate_id_limit', true), '')::bigint, 0);
+begin
+    if n > gate_id_block_size() then
+        raise exception 'cannot hand out % consecutive gate ids, the blocks have %', n, gate_id_block_size();
+    end if;
+
+    if next_id + n > id_limit then
+        select r.first_id, r.last_id + 1 into next_id, id_limit
+        from reserve_id_blocks(1, 'backend ' || pg_backend_pid()) r;
+
+        perform set_config('pandora.gate_id_limit', id_limit::text, false);
+    end if;
+
+    perform set_config('pandora.next_gate_id', (next_id + n)::text, false);
+    return next_id;
+end
+$$;
+
+create table IF NOT EXISTS linked_circuit
+(
+    -- the primary key and the indexes are in _sql_generate_indexes.sql
+    id      bigint default next_gate_id(),
     prev_q1 bigint,
     prev_q2 bigint,
     prev_q3 bigint,
@@ -47,15 +137,75 @@ create table IF NOT EXISTS public.linked_circuit
     visited int default -1 ,
     label   char,
     cl_ctrl boolean,
-    meas_key smallint
+    meas_key smallint,
+
+    -- decoded links, so that the candidate queries of the procedures can use plain indexes
+    next_q1_id   bigint generated always as (get_id_from_link(next_q1)) stored,
+    next_q2_id   bigint generated always as (get_id_from_link(next_q2)) stored,
+    prev_q1_type smallint generated always as (get_type_from_link(prev_q1)) stored,
+    prev_q2_type smallint generated always as (get_type_from_link(prev_q2)) stored,
+    next_q1_type smallint generated always as (get_type_from_link(next_q1)) stored,
+    next_q2_type smallint generated always as (get_type_from_link(next_q2)) stored
 ) WITH (FILLFACTOR = 100);
 
--- For equivalence benchamrk
-CREATE INDEX linked_circuit_type_idx on linked_circuit(type);
+-- Point the given port of a gate to link, used by the compiled rewrites (see rewrite_compiler.py)
+CREATE OR REPLACE FUNCTION set_next_link(gate_id bigint, port int, link bigint)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+begin
+    if port = 0 then
+        update linked_circuit set next_q1 = link where id = gate_id;
+    elsif port = 1 then
+        update linked_circuit set next_q2 = link where id = gate_id;
+    else
+        update linked_circuit set next_q3 = link where id = gate_id;
+    end if;
+end
+$$;
 
-CREATE INDEX linked_circuit_next_ids_equal_idx on linked_circuit(type, (get_type_from_link(next_q1)))
-where get_id_from_link(next_q1) = get_id_from_link(next_q2);
--- For equivalence benchamrk
+CREATE OR REPLACE FUNCTION set_prev_link(gate_id bigint, port int, link bigint)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+begin
+    if port = 0 then
+        update linked_circuit set prev_q1 = link where id = gate_id;
+    elsif port = 1 then
+        update linked_circuit set prev_q2 = link where id = gate_id;
+    else
+        update linked_circuit set prev_q3 = link where id = gate_id;
+    end if;
+end
+$$;
+
+-- Set-based relinking of the batched rewrites: entry i points port gate_ports[i] of gate gate_ids[i]
+-- to new_links[i], on the next side if next_side[i] and on the prev side otherwise. A gate can take
+-- several entries (a neighbour of a match on two wires), a port only one.
+CREATE OR REPLACE FUNCTION relink_gates(gate_ids bigint[], next_side boolean[], gate_ports int[], new_links bigint[])
+RETURNS void
+LANGUAGE sql
+AS $$
+    UPDATE linked_circuit lc SET
+        prev_q1 = coalesce(r.prev_q1, lc.prev_q1),
+        prev_q2 = coalesce(r.prev_q2, lc.prev_q2),
+        prev_q3 = coalesce(r.prev_q3, lc.prev_q3),
+        next_q1 = coalesce(r.next_q1, lc.next_q1),
+        next_q2 = coalesce(r.next_q2, lc.next_q2),
+        next_q3 = coalesce(r.next_q3, lc.next_q3)
+    FROM (
+        SELECT e.id,
+               max(e.link) FILTER (WHERE NOT e.nxt AND e.port = 0) AS prev_q1,
+               max(e.link) FILTER (WHERE NOT e.nxt AND e.port = 1) AS prev_q2,
+               max(e.link) FILTER (WHERE NOT e.nxt AND e.port = 2) AS prev_q3,
+               max(e.link) FILTER (WHERE e.nxt AND e.port = 0) AS next_q1,
+               max(e.link) FILTER (WHERE e.nxt AND e.port = 1) AS next_q2,
+               max(e.link) FILTER (WHERE e.nxt AND e.port = 2) AS next_q3
+        FROM unnest(gate_ids, next_side, gate_ports, new_links) e(id, nxt, port, link)
+        GROUP BY e.id
+    ) r
+    WHERE lc.id = r.id;
+$$;
 
 CREATE TABLE IF NOT EXISTS gate_types (
     id smallint unique not null,
@@ -96,7 +246,7 @@ INSERT INTO gate_types (id, name) VALUES
 (30, 'tdag'),
 (31, 'swap');
 
-create table IF NOT EXISTS public.optimization_results
+create table IF NOT EXISTS optimization_results
 (
     id int,
     logger_id int,
@@ -108,7 +258,7 @@ create table IF NOT EXISTS public.optimization_results
     x_count int
 );
 
-create table IF NOT EXISTS public.batched_circuit
+create table IF NOT EXISTS batched_circuit
 (
     id int,
     prev_q1 int,
@@ -127,7 +277,7 @@ create table IF NOT EXISTS public.batched_circuit
     meas_key smallint
 );
 
-create table IF NOT EXISTS public.linked_circuit_test
+create table IF NOT EXISTS linked_circuit_test
 (
     id      bigserial primary key,
     prev_q1 bigint,
@@ -147,7 +297,7 @@ create table IF NOT EXISTS public.linked_circuit_test
     qubit_name varchar(50)
 );
 
-create table IF NOT EXISTS public.benchmark_results
+create table IF NOT EXISTS benchmark_results
 (
     id      int primary key,
     pyliqtr_time float,
@@ -160,37 +310,146 @@ create table IF NOT EXISTS public.benchmark_results
     extraction_time float
 );
 
-create extension IF NOT EXISTS tsm_system_rows;
+-- in public, dropping the schema of a namespace must not take the extension along
+create extension IF NOT EXISTS tsm_system_rows schema public;
 
-create table if not exists public.stop_condition
+create table if not exists stop_condition
 (
-    stop boolean default false
+    stop     boolean default false,
+    boundary boolean default false -- the workers run the boundary pass, see next_candidates()
 );
 
-create table if not exists public.max_missed_rounds
+create table if not exists max_missed_rounds
 (
     missed int default 0
 );
 
-create table if not exists public.rewrite_count
+-- One row per running rewrite worker, written at the end of each of its passes, see convergence.sql
+create table if not exists rewrite_count
 (
-    proc_id int primary key,
-    count int default 0
+    proc_id      int primary key, -- backend pid of the worker
+    queue        text,            -- dirty_gates queue of the worker, see dirty_gates.sql
+    count        bigint default 0,
+    last_rewrite timestamp,       -- end of the last pass that rewrote something
+    idle_since   timestamp,       -- start of the current streak of passes without rewrites
+    idle_passes  int default 0,
+    full_scans   int default 0,   -- passes over the whole table, see next_candidates()
+    queue_passes int default 0,   -- passes over the candidates popped from the dirty_gates queue
+    release      boolean default false, -- set by the adaptive scheduler to end this worker only
+    sampled      boolean default false  -- the worker samples the table, see rewrites_converged()
 );
 
-create table if not exists public.edge_list
+-- Last rewrite and pass counts of the workers that already exited, their rewrite_count rows are gone
+create table if not exists finished_passes
+(
+    last_rewrite timestamp,
+    full_scans   bigint default 0,
+    queue_passes bigint default 0
+);
+
+-- Number of gates per (type, param), maintained while generate_optimisation_stats() runs,
+-- see gate_histogram.sql
+create table if not exists gate_type_counts
+(
+    type  smallint,
+    param real,
+    count bigint,
+    primary key (type, param)
+);
+
+-- Changes to gate_type_counts not folded in yet, insert only so that the workers do not
+-- contend for the counter rows
+create table if not exists gate_type_deltas
+(
+    type  smallint,
+    param real,
+    delta int
+);
+
+-- Gates around recent rewrites, per candidate queue, see dirty_gates.sql
+create table if not exists dirty_gates
+(
+    queue text,
+    id    bigint
+);
+
+create index if not exists dirty_gates_queue_idx on dirty_gates (queue);
+
+-- Candidates the partition-pinned workers skipped, their matches reach into other partitions
+create table if not exists boundary_gates
+(
+    id bigint
+);
+
+create table if not exists edge_list
 (
     source bigint,
     target bigint
 );
 
-create table if not exists public.mem_cx
+-- Oldest transaction that was still running when edge_list was last brought up to date,
+-- see update_edge_list()
+create table if not exists edge_list_state
+(
+    snapshot_xmin xid
+);
+
+CREATE OR REPLACE FUNCTION current_snapshot_xmin()
+RETURNS xid
+LANGUAGE sql
+VOLATILE
+AS $$
+    -- the 64 bit txid carries the epoch in its upper half, xmin of a row is the lower half
+    SELECT (txid_snapshot_xmin(txid_current_snapshot()) % 4294967296)::text::xid;
+$$;
+
+create table if not exists mem_cx
 (
     id bigint primary key
 );
 
+-- Id range [lo, hi) of every partition of linked_circuit, written by partition_linked_circuit()
+create table if not exists linked_circuit_partitions
+(
+    part int primary key,
+    lo   bigint,
+    hi   bigint
+);
+
+-- Id range of a partition. A worker without partition (null) covers all ids, the range
+-- of a partition that does not exist is null and matches no gates.
+CREATE OR REPLACE FUNCTION partition_bounds(my_partition int, out lo bigint, out hi bigint)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT CASE WHEN my_partition IS NULL THEN -9223372036854775808 ELSE min(p.lo) END,
+           CASE WHEN my_partition IS NULL THEN 9223372036854775807 ELSE max(p.hi) END
+    FROM linked_circuit_partitions p
+    WHERE p.part = my_partition;
+$$;
+
+-- True if all (non-null) ids are in [lo, hi). Partition-pinned workers skip matches
+-- that touch gates of other partitions, these are left to the boundary pass.
+CREATE OR REPLACE FUNCTION ids_in_range(ids bigint[], lo bigint, hi bigint)
+RETURNS boolean
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT coalesce(bool_and(i >= lo and i < hi), true) FROM unnest(ids) i;
+$$;
+
+-- In and Out gate of every qubit of a circuit shard, written by the parallel_decompose workers
+create table if not exists shard_boundary
+(
+    shard  int,
+    qubit  text,
+    in_id  bigint,
+    out_id bigint,
+    primary key (shard, qubit)
+);
+
 
-create table IF NOT EXISTS public.layered_lscom
+create table IF NOT EXISTS layered_lscom
 (
     id        bigserial primary key, 
     control_q bigint,
@@ -0,0 +1,230 @@
+drop procedure if exists cancel_single_qubit_batched(int, int, float, float, int, int, int, int);
+drop procedure if exists cancel_single_qubit_batched(int, int, float, float, int, int, int, int, int);
+
+-- cancel_single_qubit that rewrites batch_size matches per transaction instead of one: the
+-- matches of a batch are claimed with one skip locked query, relinked with one update and
+-- deleted with one delete. Matches that share a gate with an earlier match of the batch are
+-- left to the next pass.
+--
+-- With sample_rows set, a pass does not scan the table or the dirty_gates queue but looks for
+-- matches in sample_rows rows drawn with tablesample system_rows, which reads whole pages at
+-- random places: the workers start at different gates instead of all at the lowest ids, and
+-- a pass costs the same on any circuit size. Without a full scan no pass knows that the
+-- circuit is saturated, so the stopper never counts a sampling worker as converged and the
+-- run ends after pass_count passes or timeout seconds.
+create or replace procedure cancel_single_qubit_batched(type_1 int, type_2 int, param_1 float, param_2 float, pass_count int, timeout int,
+                                                        batch_size int, sample_rows int, my_partition int default null)
+    language plpgsql
+as
+$$
+declare
+    cand record;
+
+    first_ids bigint[];
+    second_ids bigint[];
+    prev_ids bigint[];
+    next_ids bigint[];
+    claimed bigint[];
+    locked_ids bigint[];
+    deleted_ids bigint[];
+
+    relink_ids bigint[];
+    relink_next boolean[];
+    relink_ports int[];
+    relink_links bigint[];
+
+    last_id bigint;
+    n_found int;
+
+	start_time timestamp;
+    pass_start timestamp;
+    rewrites int;
+    stop boolean := false;
+
+    queue text;
+    candidates bigint[];
+    next_cand int;
+    cand_window bigint[];
+    last_full_scan timestamp;
+
+    part_lo bigint;
+    part_hi bigint;
+
+begin
+    start_time := clock_timestamp();
+    -- the same queue as cancel_single_qubit, both workers look for the same matches
+    queue := format('cancel_single_qubit(%s, %s, %s, %s, %s)', type_1, type_2, param_1, param_2, my_partition);
+    -- the boundary pass has no stopper and only looks at the deferred candidates, see next_candidates()
+    if boundary_pass() then
+        sample_rows := null;
+    end if;
+    -- sampling workers do not take candidates from the dirty_gates queue
+    call start_passes(case when sample_rows is null then queue end, sample_rows is not null);
+
+    select lo, hi into part_lo, part_hi from partition_bounds(my_partition);
+
+	 while pass_count > 0 loop
+        pass_start := clock_timestamp();
+        rewrites := 0;
+        last_id := null;
+        next_cand := 1;
+
+        -- without sampling, the first pass scans the whole table, the later ones only the gates around recent rewrites
+        if sample_rows is null then
+            candidates := next_candidates(queue, last_full_scan);
+            if candidates is null then
+                last_full_scan := pass_start;
+            else
+                candidates := array(select unnest(candidates) order by 1);
+            end if;
+        end if;
+
+        loop -- batch loop
+            first_ids := '{}';
+            second_ids := '{}';
+            prev_ids := '{}';
+            next_ids := '{}';
+            claimed := '{}';
+            n_found := 0;
+
+            -- a queue pass looks at its candidates batch_size at a time, in id order: matching
+            -- all of them in every batch makes a pass quadratic in the size of the queue
+            cand_window := candidates[next_cand:next_cand + batch_size - 1];
+
+            for cand in
+                select f.id as first_id,
+                       s.id as second_id,
+                       get_id_from_link(f.prev_q1) as prev_id,
+                       s.next_q1_id as next_id
+                -- each branch is limited on its own and the full scan continues from last_id with
+                -- an index condition: an order by over the whole union, or a filter on last_id, reads
+                -- all candidates after (or before) it, which makes a full scan quadratic in the circuit size
+                from (
+                    (select * from linked_circuit
+                             where
+                               type = type_1
+                               and param = param_1
+                               and next_q1_type = type_2
+                               and id >= part_lo and id < part_hi
+                               and id >= coalesce(last_id + 1, part_lo)
+                               and candidates is null
+                               and sample_rows is null
+                               order by id
+                               limit batch_size)
+                    union all
+                    (select * from linked_circuit
+                             where
+                               type = type_1
+                               and param = param_1
+                               and next_q1_type = type_2
+                               and id >= part_lo and id < part_hi
+                               and id = any(cand_window)
+                               and sample_rows is null
+                               order by id
+                               limit batch_size)
+                    union all
+                    (select * from linked_circuit tablesample system_rows(coalesce(sample_rows, 0))
+                             where
+                               type = type_1
+                               and param = param_1
+                               and next_q1_type = type_2
+                               and id >= part_lo and id < part_hi
+                               and sample_rows is not null
+                               order by id
+                               limit batch_size)
+                    order by id
+                    limit batch_size
+                ) f
+                join linked_circuit s on s.id = f.next_q1_id
+                order by f.id
+            loop
+                n_found := n_found + 1;
+                last_id := cand.first_id;
+
+                if not ids_in_range(array[cand.second_id, cand.prev_id, cand.next_id], part_lo, part_hi) then
+                    perform defer_to_boundary(array[cand.first_id]);
+                    continue;
+                end if;
+
+                if array[cand.first_id, cand.second_id, cand.prev_id, cand.next_id] && claimed then
+                    continue;
+                end if;
+
+                first_ids := first_ids || cand.first_id;
+                second_ids := second_ids || cand.second_id;
+                prev_ids := prev_ids || cand.prev_id;
+                next_ids := next_ids || cand.next_id;
+                claimed := claimed || array[cand.first_id, cand.second_id, cand.prev_id, cand.next_id];
+            end loop;
+
+            next_cand := next_cand + batch_size;
+
+            -- the pass goes on after a window of the queue without matches
+            if n_found = 0 then
+                exit when candidates is null or next_cand > cardinality(candidates);
+                continue;
+            end if;
+
+            -- in id order, like every worker, so that two batches do not deadlock
+            locked_ids := array(
+                select id from linked_circuit where id = any(claimed) order by id for update skip locked
+            );
+
+            deleted_ids := '{}';
+            relink_ids := '{}';
+            relink_next := '{}';
+            relink_ports := '{}';
+            relink_links := '{}';
+
+            -- the claimed matches that are still matches with all their gates locked
+            for cand in
+                select c.first_id, c.second_id, c.prev_id, c.next_id, f.prev_q1, s.next_q1
+                from unnest(first_ids, second_ids, prev_ids, next_ids) c(first_id, second_id, prev_id, next_id)
+                join linked_circuit f on f.id = c.first_id
+                join linked_circuit s on s.id = c.second_id
+                where array[c.first_id, c.second_id, c.prev_id, c.next_id] <@ locked_ids
+                  and f.type = type_1
+                  and f.param = param_1
+                  and s.type = type_2
+                  and s.param = param_2
+                  and f.next_q1_id = s.id
+                  and get_id_from_link(s.prev_q1) = f.id
+                  and get_id_from_link(f.prev_q1) = c.prev_id
+                  and s.next_q1_id = c.next_id
+            loop
+                deleted_ids := deleted_ids || array[cand.first_id, cand.second_id];
+
+                relink_ids := relink_ids || array[cand.prev_id, cand.next_id];
+                relink_next := relink_next || array[true, false];
+                relink_ports := relink_ports || array[get_port_from_link(cand.prev_q1)::int, get_port_from_link(cand.next_q1)::int];
+                relink_links := relink_links || array[cand.next_q1, cand.prev_q1];
+            end loop;
+
+            if cardinality(deleted_ids) > 0 then
+                perform relink_gates(relink_ids, relink_next, relink_ports, relink_links);
+                delete from linked_circuit where id = any(deleted_ids);
+
+                perform enqueue_dirty_gates(relink_ids);
+                rewrites := rewrites + cardinality(deleted_ids) / 2;
+            end if;
+
+            commit; -- release the locks of the batch
+
+            -- a sampling pass is one sample
+            exit when sample_rows is not null;
+
+        end loop; -- end batch loop
+
+        call report_pass(pass_start, rewrites, stop);
+        exit when stop; -- saturated, see stopper()
+
+	    pass_count = pass_count - 1;
+
+	    if extract(epoch from (clock_timestamp() - start_time)) > timeout then
+            exit;
+        end if;
+
+    end loop; -- end pass loop
+
+    call finish_passes();
+end;$$;
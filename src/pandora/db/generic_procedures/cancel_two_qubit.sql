@@ -1,4 +1,8 @@
-create or replace procedure cancel_two_qubit(type_1 int, type_2 int, param_1 float, param_2 float, pass_count int, timeout int)
+drop procedure if exists cancel_two_qubit(int, int, float, float, int, int);
+
+-- with my_partition set, only matches that lie entirely in that partition of linked_circuit are rewritten
+create or replace procedure cancel_two_qubit(type_1 int, type_2 int, param_1 float, param_2 float, pass_count int, timeout int,
+                                             my_partition int default null)
     language plpgsql
 as
 $$
@@ -20,20 +24,61 @@ declare
     d record;
 
     start_time timestamp with time zone;
+    pass_start timestamp;
+    rewrites int;
+    stop boolean := false;
+
+    queue text;
+    candidates bigint[];
+    last_full_scan timestamp;
+
+    part_lo bigint;
+    part_hi bigint;
 
 begin
     start_time := clock_timestamp();
+    queue := format('cancel_two_qubit(%s, %s, %s, %s, %s)', type_1, type_2, param_1, param_2, my_partition);
+    call start_passes(queue);
+
+    select lo, hi into part_lo, part_hi from partition_bounds(my_partition);
 
 	 while pass_count > 0 loop
+        pass_start := clock_timestamp();
+        rewrites := 0;
+
+        -- the first pass scans the whole table, the later ones only the gates around recent rewrites
+        candidates := next_candidates(queue, last_full_scan);
+        if candidates is null then
+            last_full_scan := pass_start;
+        end if;
+
         for gate in
             select * from linked_circuit
                      where
                      type=type_1
                      and param = param_1
-                     and get_id_from_link(next_q1) = get_id_from_link(next_q2)
-                     and get_type_from_link(next_q1) = type_2
+                     and next_q1_id = next_q2_id
+                     and next_q1_type = type_2
+                     and id >= part_lo and id < part_hi
+                     and candidates is null
+            union all
+            select * from linked_circuit
+                     where
+                     type=type_1
+                     and param = param_1
+                     and next_q1_id = next_q2_id
+                     and next_q1_type = type_2
+                     and id >= part_lo and id < part_hi
+                     and id = any(candidates)
         loop
             select * into first from linked_circuit where id = gate.id for update skip locked;
+
+            if not ids_in_range(array[get_id_from_link(first.next_q1)], part_lo, part_hi) then
+                perform defer_to_boundary(array[gate.id]);
+                commit;
+                continue;
+            end if;
+
             select * into second from linked_circuit where id = get_id_from_link(first.next_q1) for update skip locked;
 
             if first.id is null
@@ -66,6 +111,12 @@ begin
             second_next_q1_id := get_id_from_link(second.next_q1);
             second_next_q2_id := get_id_from_link(second.next_q2);
 
+            if not ids_in_range(array[first_prev_q1_id, first_prev_q2_id, second_next_q1_id, second_next_q2_id], part_lo, part_hi) then
+                perform defer_to_boundary(array[gate.id]);
+                commit;
+                continue;
+            end if;
+
             select * into a from linked_circuit where id = first_prev_q1_id for update skip locked;
             select * into b from linked_circuit where id = first_prev_q2_id for update skip locked;
             select * into c from linked_circuit where id = second_next_q1_id for update skip locked;
@@ -107,10 +158,15 @@ begin
 
             delete from linked_circuit lc where lc.id in (first.id, second.id);
 
+            perform enqueue_dirty_gates(array[first_prev_q1_id, first_prev_q2_id, second_next_q1_id, second_next_q2_id]);
+            rewrites := rewrites + 1;
             commit; -- release locks after applying template
 
         end loop; -- end gate loop
 
+        call report_pass(pass_start, rewrites, stop);
+        exit when stop; -- saturated, see stopper()
+
 	    if extract(epoch from (clock_timestamp() - start_time)) > timeout then
             exit;
         end if;
@@ -119,4 +175,6 @@ begin
 
 	end loop; --end pass loop
 
+    call finish_passes();
+
 end;$$;
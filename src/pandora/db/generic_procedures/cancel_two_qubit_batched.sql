@@ -0,0 +1,239 @@
+drop procedure if exists cancel_two_qubit_batched(int, int, float, float, int, int, int, int);
+drop procedure if exists cancel_two_qubit_batched(int, int, float, float, int, int, int, int, int);
+
+-- cancel_two_qubit with batch_size matches per transaction, see cancel_single_qubit_batched.sql
+create or replace procedure cancel_two_qubit_batched(type_1 int, type_2 int, param_1 float, param_2 float, pass_count int, timeout int,
+                                                     batch_size int, sample_rows int, my_partition int default null)
+    language plpgsql
+as
+$$
+declare
+    cand record;
+
+    first_ids bigint[];
+    second_ids bigint[];
+    prev_q1_ids bigint[];
+    prev_q2_ids bigint[];
+    next_q1_ids bigint[];
+    next_q2_ids bigint[];
+    claimed bigint[];
+    locked_ids bigint[];
+    deleted_ids bigint[];
+
+    relink_ids bigint[];
+    relink_next boolean[];
+    relink_ports int[];
+    relink_links bigint[];
+
+    last_id bigint;
+    n_found int;
+
+    start_time timestamp with time zone;
+    pass_start timestamp;
+    rewrites int;
+    stop boolean := false;
+
+    queue text;
+    candidates bigint[];
+    next_cand int;
+    cand_window bigint[];
+    last_full_scan timestamp;
+
+    part_lo bigint;
+    part_hi bigint;
+
+begin
+    start_time := clock_timestamp();
+    -- the same queue as cancel_two_qubit, both workers look for the same matches
+    queue := format('cancel_two_qubit(%s, %s, %s, %s, %s)', type_1, type_2, param_1, param_2, my_partition);
+    -- the boundary pass has no stopper and only looks at the deferred candidates, see next_candidates()
+    if boundary_pass() then
+        sample_rows := null;
+    end if;
+    -- sampling workers do not take candidates from the dirty_gates queue
+    call start_passes(case when sample_rows is null then queue end, sample_rows is not null);
+
+    select lo, hi into part_lo, part_hi from partition_bounds(my_partition);
+
+	 while pass_count > 0 loop
+        pass_start := clock_timestamp();
+        rewrites := 0;
+        last_id := null;
+        next_cand := 1;
+
+        -- without sampling, the first pass scans the whole table, the later ones only the gates around recent rewrites
+        if sample_rows is null then
+            candidates := next_candidates(queue, last_full_scan);
+            if candidates is null then
+                last_full_scan := pass_start;
+            else
+                candidates := array(select unnest(candidates) order by 1);
+            end if;
+        end if;
+
+        loop -- batch loop
+            first_ids := '{}';
+            second_ids := '{}';
+            prev_q1_ids := '{}';
+            prev_q2_ids := '{}';
+            next_q1_ids := '{}';
+            next_q2_ids := '{}';
+            claimed := '{}';
+            n_found := 0;
+
+            -- a queue pass looks at its candidates batch_size at a time, in id order: matching
+            -- all of them in every batch makes a pass quadratic in the size of the queue
+            cand_window := candidates[next_cand:next_cand + batch_size - 1];
+
+            for cand in
+                select f.id as first_id,
+                       s.id as second_id,
+                       get_id_from_link(f.prev_q1) as prev_q1_id,
+                       get_id_from_link(f.prev_q2) as prev_q2_id,
+                       s.next_q1_id,
+                       s.next_q2_id
+                -- each branch is limited on its own and the full scan continues from last_id with
+                -- an index condition: an order by over the whole union, or a filter on last_id, reads
+                -- all candidates after (or before) it, which makes a full scan quadratic in the circuit size
+                from (
+                    (select * from linked_circuit
+                             where
+                             type=type_1
+                             and param = param_1
+                             and next_q1_id = next_q2_id
+                             and next_q1_type = type_2
+                             and id >= part_lo and id < part_hi
+                             and id >= coalesce(last_id + 1, part_lo)
+                             and candidates is null
+                             and sample_rows is null
+                             order by id
+                             limit batch_size)
+                    union all
+                    (select * from linked_circuit
+                             where
+                             type=type_1
+                             and param = param_1
+                             and next_q1_id = next_q2_id
+                             and next_q1_type = type_2
+                             and id >= part_lo and id < part_hi
+                             and id = any(cand_window)
+                             and sample_rows is null
+                             order by id
+                             limit batch_size)
+                    union all
+                    (select * from linked_circuit tablesample system_rows(coalesce(sample_rows, 0))
+                             where
+                             type=type_1
+                             and param = param_1
+                             and next_q1_id = next_q2_id
+                             and next_q1_type = type_2
+                             and id >= part_lo and id < part_hi
+                             and sample_rows is not null
+                             order by id
+                             limit batch_size)
+                    order by id
+                    limit batch_size
+                ) f
+                join linked_circuit s on s.id = f.next_q1_id
+                order by f.id
+            loop
+                n_found := n_found + 1;
+                last_id := cand.first_id;
+
+                if not ids_in_range(array[cand.second_id, cand.prev_q1_id, cand.prev_q2_id, cand.next_q1_id, cand.next_q2_id], part_lo, part_hi) then
+                    perform defer_to_boundary(array[cand.first_id]);
+                    continue;
+                end if;
+
+                -- the neighbours on both wires can be the same gate, they are claimed once
+                if array[cand.first_id, cand.second_id, cand.prev_q1_id, cand.prev_q2_id, cand.next_q1_id, cand.next_q2_id] && claimed then
+                    continue;
+                end if;
+
+                first_ids := first_ids || cand.first_id;
+                second_ids := second_ids || cand.second_id;
+                prev_q1_ids := prev_q1_ids || cand.prev_q1_id;
+                prev_q2_ids := prev_q2_ids || cand.prev_q2_id;
+                next_q1_ids := next_q1_ids || cand.next_q1_id;
+                next_q2_ids := next_q2_ids || cand.next_q2_id;
+                claimed := claimed || array[cand.first_id, cand.second_id, cand.prev_q1_id, cand.prev_q2_id, cand.next_q1_id, cand.next_q2_id];
+            end loop;
+
+            next_cand := next_cand + batch_size;
+
+            -- the pass goes on after a window of the queue without matches
+            if n_found = 0 then
+                exit when candidates is null or next_cand > cardinality(candidates);
+                continue;
+            end if;
+
+            -- in id order, like every worker, so that two batches do not deadlock
+            locked_ids := array(
+                select id from linked_circuit where id = any(claimed) order by id for update skip locked
+            );
+
+            deleted_ids := '{}';
+            relink_ids := '{}';
+            relink_next := '{}';
+            relink_ports := '{}';
+            relink_links := '{}';
+
+            -- the claimed matches that are still matches with all their gates locked
+            for cand in
+                select c.*, f.prev_q1, f.prev_q2, s.next_q1, s.next_q2
+                from unnest(first_ids, second_ids, prev_q1_ids, prev_q2_ids, next_q1_ids, next_q2_ids)
+                         c(first_id, second_id, prev_q1_id, prev_q2_id, next_q1_id, next_q2_id)
+                join linked_circuit f on f.id = c.first_id
+                join linked_circuit s on s.id = c.second_id
+                where array[c.first_id, c.second_id, c.prev_q1_id, c.prev_q2_id, c.next_q1_id, c.next_q2_id] <@ locked_ids
+                  and f.type = type_1
+                  and f.param = param_1
+                  and s.type = type_2
+                  and s.param = param_2
+                  and s.prev_q1 = create_link(f.id, 0, f.type)
+                  and s.prev_q2 = create_link(f.id, 1, f.type)
+                  and get_id_from_link(f.prev_q1) = c.prev_q1_id
+                  and get_id_from_link(f.prev_q2) = c.prev_q2_id
+                  and s.next_q1_id = c.next_q1_id
+                  and s.next_q2_id = c.next_q2_id
+            loop
+                deleted_ids := deleted_ids || array[cand.first_id, cand.second_id];
+
+                relink_ids := relink_ids || array[cand.prev_q1_id, cand.prev_q2_id, cand.next_q1_id, cand.next_q2_id];
+                relink_next := relink_next || array[true, true, false, false];
+                relink_ports := relink_ports || array[
+                    get_port_from_link(cand.prev_q1)::int, get_port_from_link(cand.prev_q2)::int,
+                    get_port_from_link(cand.next_q1)::int, get_port_from_link(cand.next_q2)::int
+                ];
+                relink_links := relink_links || array[cand.next_q1, cand.next_q2, cand.prev_q1, cand.prev_q2];
+            end loop;
+
+            if cardinality(deleted_ids) > 0 then
+                perform relink_gates(relink_ids, relink_next, relink_ports, relink_links);
+                delete from linked_circuit where id = any(deleted_ids);
+
+                perform enqueue_dirty_gates(relink_ids);
+                rewrites := rewrites + cardinality(deleted_ids) / 2;
+            end if;
+
+            commit; -- release the locks of the batch
+
+            -- a sampling pass is one sample
+            exit when sample_rows is not null;
+
+        end loop; -- end batch loop
+
+        call report_pass(pass_start, rewrites, stop);
+        exit when stop; -- saturated, see stopper()
+
+	    if extract(epoch from (clock_timestamp() - start_time)) > timeout then
+            exit;
+        end if;
+
+        pass_count = pass_count - 1;
+
+	end loop; --end pass loop
+
+    call finish_passes();
+
+end;$$;
@@ -35,8 +35,8 @@ begin
             select * from linked_circuit
                      where
                      type=type_1
-                     and get_id_from_link(next_q1) = get_id_from_link(next_q2)
-                     and get_type_from_link(next_q1) = type_2
+                     and next_q1_id = next_q2_id
+                     and next_q1_type = type_2
         loop
             select * into first from linked_circuit where id = gate.id for update skip locked;
             select * into second from linked_circuit where id = get_id_from_link(first.next_q1) for update skip locked;
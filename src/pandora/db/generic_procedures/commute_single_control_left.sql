@@ -1,4 +1,8 @@
-create or replace procedure commute_single_control_left(single_type int, parameter float, pass_count int, timeout int)
+drop procedure if exists commute_single_control_left(int, float, int, int);
+
+-- with my_partition set, only matches that lie entirely in that partition of linked_circuit are rewritten
+create or replace procedure commute_single_control_left(single_type int, parameter float, pass_count int, timeout int,
+                                                        my_partition int default null)
    language plpgsql
 as
 $$
@@ -19,25 +23,64 @@ declare
     b record;
 
     start_time timestamp with time zone;
+    pass_start timestamp;
+    rewrites int;
+    stop boolean := false;
+
+    queue text;
+    candidates bigint[];
+    last_full_scan timestamp;
 
     h_type smallint;
     controlled_types smallint[];
 
+    part_lo bigint;
+    part_hi bigint;
+
 begin
 
     select id into h_type from gate_types where name = 'h';
     select array_agg(id) into controlled_types from gate_types where name in ('cx', 'cxpow', 'cz', 'czpow');
 
+    select lo, hi into part_lo, part_hi from partition_bounds(my_partition);
+
     start_time := clock_timestamp();
+    queue := format('commute_single_control_left(%s, %s, %s)', single_type, parameter, my_partition);
+    call start_passes(queue);
 
 	while pass_count > 0 loop
+        pass_start := clock_timestamp();
+        rewrites := 0;
+
+        -- the first pass scans the whole table, the later ones only the gates around recent rewrites
+        candidates := next_candidates(queue, last_full_scan);
+        if candidates is null then
+            last_full_scan := pass_start;
+        end if;
+
         for gate in
             select * from linked_circuit
                      where
                      type = any(controlled_types)
-                     and get_type_from_link(prev_q1) = single_type
+                     and prev_q1_type = single_type
+                     and id >= part_lo and id < part_hi
+                     and candidates is null
+            union all
+            select * from linked_circuit
+                     where
+                     type = any(controlled_types)
+                     and prev_q1_type = single_type
+                     and id >= part_lo and id < part_hi
+                     and id = any(candidates)
         loop
             select * into second from linked_circuit where id = gate.id for update skip locked;
+
+            if not ids_in_range(array[get_id_from_link(second.prev_q1)], part_lo, part_hi) then
+                perform defer_to_boundary(array[gate.id]);
+                commit;
+                continue;
+            end if;
+
             select * into first from linked_circuit where id = get_id_from_link(second.prev_q1) for update skip locked;
 
             if first.id is null
@@ -60,6 +103,12 @@ begin
             sg_prev_id := get_id_from_link(first.prev_q1);
             cx_next_q1_id := get_id_from_link(second.next_q1);
 
+            if not ids_in_range(array[sg_prev_id, cx_next_q1_id], part_lo, part_hi) then
+                perform defer_to_boundary(array[gate.id]);
+                commit;
+                continue;
+            end if;
+
             select * into a from linked_circuit where id = sg_prev_id for update skip locked;
             select * into b from linked_circuit where id = cx_next_q1_id for update skip locked;
 
@@ -89,10 +138,15 @@ begin
             update linked_circuit set (next_q1, prev_q1) = (new_prev_for_sq, first.prev_q1) where id = second.id;
             update linked_circuit set (next_q1, prev_q1) = (cx_next_q1, new_next_for_sq) where id = first.id;
 
+            perform enqueue_dirty_gates(array[first.id, second.id, sg_prev_id, cx_next_q1_id]);
+            rewrites := rewrites + 1;
             commit; -- release locks
 
         end loop; -- end gate loop
 
+        call report_pass(pass_start, rewrites, stop);
+        exit when stop; -- saturated, see stopper()
+
 	    if extract(epoch from (clock_timestamp() - start_time)) > timeout then
             exit;
         end if;
@@ -101,4 +155,6 @@ begin
 
     end loop; -- end pass loop
 
+    call finish_passes();
+
 end;$$;
@@ -0,0 +1,164 @@
+-- Fixed point detection for the rewrite procedures. Every worker registers with
+-- start_passes(), reports each pass with report_pass() in its own rewrite_count row (so the
+-- workers never contend for a row) and removes the row with finish_passes() when it exits,
+-- adding the time of its last rewrite and its pass counts to finished_passes.
+-- stopper() sets stop_condition once the circuit is saturated, and report_pass() then tells
+-- the workers to exit after their current pass.
+
+create or replace procedure reset_convergence()
+    language plpgsql
+as
+$$
+begin
+    delete from rewrite_count;
+    delete from finished_passes;
+    insert into finished_passes values (null, 0, 0);
+    delete from dirty_gates;
+    delete from stop_condition;
+    insert into stop_condition values (false);
+    -- a logger that errored or was cancelled did not get to drop its triggers, see gate_histogram.sql
+    call stop_gate_histogram();
+end;
+$$;
+
+create or replace function stop_requested()
+    returns boolean
+    language sql
+    stable
+as
+$$
+    select coalesce((select bool_or(stop) from stop_condition), false);
+$$;
+
+-- The workers run the boundary pass after the partition-pinned ones, see next_candidates()
+create or replace function boundary_pass()
+    returns boolean
+    language sql
+    stable
+as
+$$
+    select coalesce((select bool_or(boundary) from stop_condition), false);
+$$;
+
+-- Last rewrite of any worker, running or exited
+create or replace function last_rewrite_any()
+    returns timestamp
+    language sql
+    stable
+as
+$$
+    select greatest((select max(last_rewrite) from rewrite_count), (select max(last_rewrite) from finished_passes));
+$$;
+
+drop procedure if exists start_passes();
+drop procedure if exists start_passes(text);
+
+-- worker_queue is the dirty_gates queue the worker takes its candidates from, if any,
+-- sampled is set for a worker that looks at random samples instead
+create or replace procedure start_passes(worker_queue text default null, sampled boolean default false)
+    language plpgsql
+as
+$$
+begin
+    insert into rewrite_count (proc_id, queue, count, last_rewrite, idle_since, idle_passes, full_scans, queue_passes, release, sampled)
+    values (pg_backend_pid(), worker_queue, 0, null, null, 0, 0, 0, false, start_passes.sampled)
+    on conflict (proc_id) do update
+        set queue = worker_queue, count = 0, last_rewrite = null, idle_since = null, idle_passes = 0,
+            full_scans = 0, queue_passes = 0, release = false, sampled = start_passes.sampled;
+    commit;
+end;
+$$;
+
+-- A streak of idle passes only counts from the first pass that started after the last
+-- rewrite of any worker, the earlier passes may have missed the gates changed since.
+create or replace procedure report_pass(pass_start timestamp, rewrites int, inout should_stop boolean)
+    language plpgsql
+as
+$$
+declare
+    last_rewrite_before timestamp;
+begin
+    if rewrites > 0 then
+        update rewrite_count
+        set count = count + rewrites, last_rewrite = clock_timestamp(), idle_since = null, idle_passes = 0
+        where proc_id = pg_backend_pid();
+    else
+        last_rewrite_before := last_rewrite_any();
+
+        update rewrite_count
+        set idle_since = case when idle_since is null or idle_since <= last_rewrite_before then pass_start else idle_since end,
+            idle_passes = case when idle_since is null or idle_since <= last_rewrite_before then 1 else idle_passes + 1 end
+        where proc_id = pg_backend_pid();
+    end if;
+
+    -- release: the adaptive scheduler hands the connection of this worker to another rule.
+    -- The boundary pass needs no stopper, its workers only look at the deferred candidates
+    -- and the gates around their own rewrites, and they end once they all ran idle.
+    should_stop := stop_requested()
+                   or coalesce((select release from rewrite_count where proc_id = pg_backend_pid()), false)
+                   or (boundary_pass() and rewrites_converged(2));
+    commit;
+end;
+$$;
+
+create or replace procedure finish_passes()
+    language plpgsql
+as
+$$
+begin
+    -- one update per worker and run, the running workers only write their own rows
+    update finished_passes f
+    set last_rewrite = greatest(f.last_rewrite, w.last_rewrite),
+        full_scans = f.full_scans + w.full_scans,
+        queue_passes = f.queue_passes + w.queue_passes
+    from rewrite_count w
+    where w.proc_id = pg_backend_pid();
+
+    delete from rewrite_count where proc_id = pg_backend_pid();
+    commit;
+end;
+$$;
+
+-- Saturated: every registered worker ran idle_rounds passes without rewrites, and they all
+-- started after the last rewrite of any worker. More than one round, because a pass skips
+-- the candidates that other workers hold locked. A sampling worker never counts as
+-- converged, its idle passes only mean that its samples had no matches.
+create or replace function rewrites_converged(idle_rounds int)
+    returns boolean
+    language sql
+    stable
+as
+$$
+    select count(*) > 0
+               and bool_and(idle_passes >= idle_rounds and not sampled)
+               and min(idle_since) > coalesce(last_rewrite_any(), '-infinity'::timestamp)
+    from rewrite_count;
+$$;
+
+-- Runs next to the workers until they converge (then sets stop_condition), until
+-- stop_condition is set by someone else, or until timeout seconds have passed.
+create or replace procedure stopper(timeout int, idle_rounds int default 2, poll_for float default 0.1)
+    language plpgsql
+as
+$$
+declare
+    start_time timestamp;
+begin
+    start_time := clock_timestamp();
+
+    while not stop_requested() loop
+        if rewrites_converged(idle_rounds) then
+            update stop_condition set stop = true;
+            commit;
+            exit;
+        end if;
+
+        if extract(epoch from (clock_timestamp() - start_time)) > timeout then
+            exit;
+        end if;
+
+        perform pg_sleep(poll_for);
+        commit;
+    end loop;
+end;
+$$;
@@ -1,4 +1,7 @@
-create or replace procedure linked_cx_to_hhcxhh(pass_count int, timeout int)
+drop procedure if exists linked_cx_to_hhcxhh(int, int);
+
+-- with my_partition set, only matches that lie entirely in that partition of linked_circuit are rewritten
+create or replace procedure linked_cx_to_hhcxhh(pass_count int, timeout int, my_partition int default null)
     language plpgsql
 as
 $$
@@ -28,6 +31,9 @@ declare
     cx_id_tgt bigint;
 
     start_time timestamp;
+    pass_start timestamp;
+    rewrites int;
+    stop boolean := false;
 
     a record;
     b record;
@@ -37,19 +43,29 @@ declare
     h_type smallint;
     cx_types smallint[];
 
+    part_lo bigint;
+    part_hi bigint;
+
 begin
     port_nr := 0; -- single qubit gate has a single port with index 0
 
+    select lo, hi into part_lo, part_hi from partition_bounds(my_partition);
+
     select id into h_type from gate_types where name = 'h';
     select array_agg(id) into cx_types from gate_types where name in ('cx', 'cxpow');
 
     start_time := clock_timestamp();
+    call start_passes();
 
     while pass_count > 0 loop
+        pass_start := clock_timestamp();
+        rewrites := 0;
+
         for gate in
             select id from linked_circuit
                  where
                  type = any(cx_types)
+                 and id >= part_lo and id < part_hi
         loop
             select * into cx from linked_circuit where id = gate.id for update skip locked;
 
@@ -65,6 +81,11 @@ begin
             cx_next_q1_id := get_id_from_link(cx.next_q1);
             cx_next_q2_id := get_id_from_link(cx.next_q2);
 
+            if not ids_in_range(array[cx_prev_q1_id, cx_prev_q2_id, cx_next_q1_id, cx_next_q2_id], part_lo, part_hi) then
+                commit;
+                continue;
+            end if;
+
             select * into a from linked_circuit where id = cx_prev_q1_id for update skip locked;
             select * into b from linked_circuit where id = cx_prev_q2_id for update skip locked;
             select * into c from linked_circuit where id = cx_next_q1_id for update skip locked;
@@ -124,10 +145,16 @@ begin
                 update linked_circuit set prev_q2 = right_q2_link where id = cx_next_q2_id;
             end if;
 
+            perform enqueue_dirty_gates(array[cx.id, cx_prev_q1_id, cx_prev_q2_id, cx_next_q1_id, cx_next_q2_id,
+                                              left_h_q1_id, left_h_q2_id, right_h_q1_id, right_h_q2_id]);
+            rewrites := rewrites + 1;
             commit; -- release locks
 
         end loop; -- end gate loop
 
+        call report_pass(pass_start, rewrites, stop);
+        exit when stop; -- saturated, see stopper()
+
 	    if extract(epoch from (clock_timestamp() - start_time)) > timeout then
             exit;
         end if;
@@ -135,5 +162,7 @@ begin
         pass_count = pass_count - 1;
 
     end loop; -- end pass loop
+
+    call finish_passes();
 end;$$;
 
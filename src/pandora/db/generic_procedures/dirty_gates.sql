@@ -0,0 +1,120 @@
+-- Work queue of the rewrite procedures, so that their passes after the first one only look
+-- at the gates around recent rewrites instead of scanning linked_circuit again.
+--
+-- Every worker names a queue in start_passes(), the workers of the same rule (and the same
+-- arguments and partition) share it. A rewrite adds the gates whose links it changed to the
+-- queues of all running workers, and a pass pops its queue with skip locked, so the workers
+-- of a queue split it between them.
+
+drop function if exists pop_dirty_gates(text, int);
+drop function if exists next_candidates(text, timestamp);
+
+-- The gates at most radius links away from ids (deleted gates are dropped)
+create or replace function gate_neighbourhood(ids bigint[], radius int)
+    returns bigint[]
+    language plpgsql
+    stable
+as
+$$
+begin
+    for i in 1 .. radius loop
+        select coalesce(array_agg(distinct n.id), '{}') into ids
+        from linked_circuit l
+        cross join unnest(array[
+            l.id,
+            get_id_from_link(l.prev_q1), get_id_from_link(l.prev_q2), get_id_from_link(l.prev_q3),
+            l.next_q1_id, l.next_q2_id, get_id_from_link(l.next_q3)
+        ]) n(id)
+        where l.id = any(ids) and n.id is not null;
+    end loop;
+
+    return ids;
+end;
+$$;
+
+-- Popped gates and their neighbourhood: a new match has to contain a gate whose links changed,
+-- and the candidate gate of a rule is at most radius links away from any gate of its match
+-- (one for the hand-written rules).
+create or replace function pop_dirty_gates(worker_queue text, max_gates int default 100000, radius int default 1)
+    returns bigint[]
+    language plpgsql
+as
+$$
+declare
+    popped bigint[];
+begin
+    with deleted as (
+        delete from dirty_gates
+        where ctid = any(array(
+            select ctid from dirty_gates where queue = worker_queue limit max_gates for update skip locked
+        ))
+        returning id
+    )
+    select coalesce(array_agg(distinct id), '{}') into popped from deleted;
+
+    return gate_neighbourhood(popped, greatest(radius, 1));
+end;
+$$;
+
+-- Candidates of the next pass of a worker, null for a full scan: the first pass, and a pass
+-- after the queue ran empty while there were rewrites since the last full scan. Candidates
+-- skipped because another worker held them locked are not in the queue anymore, the full
+-- scan picks them up again. The passes of both kinds are counted in rewrite_count.
+--
+-- The boundary pass never scans: the partition-pinned workers converged before it, the only
+-- matches they left are the deferred ones in boundary_gates and those created by the
+-- boundary workers themselves.
+create or replace function next_candidates(worker_queue text, last_full_scan timestamp, radius int default 1)
+    returns bigint[]
+    language plpgsql
+as
+$$
+declare
+    candidates bigint[];
+begin
+    if boundary_pass() then
+        if (select full_scans + queue_passes from rewrite_count where proc_id = pg_backend_pid()) = 0 then
+            select coalesce(array_agg(distinct id), '{}') into candidates from boundary_gates;
+        else
+            candidates := pop_dirty_gates(worker_queue, radius => radius);
+        end if;
+    elsif last_full_scan is not null then
+        candidates := pop_dirty_gates(worker_queue, radius => radius);
+
+        if cardinality(candidates) = 0 and last_full_scan < last_rewrite_any() then
+            candidates := null;
+        end if;
+    end if;
+
+    update rewrite_count
+    set full_scans = full_scans + (candidates is null)::int,
+        queue_passes = queue_passes + (candidates is not null)::int
+    where proc_id = pg_backend_pid();
+
+    return candidates;
+end;
+$$;
+
+-- A partition-pinned worker skips the matches that reach into another partition, their
+-- candidates wait in boundary_gates for the boundary pass
+create or replace function defer_to_boundary(ids bigint[])
+    returns void
+    language sql
+as
+$$
+    insert into boundary_gates (id)
+    select i.id from unnest(ids) i(id)
+    where i.id is not null;
+$$;
+
+create or replace function enqueue_dirty_gates(ids bigint[])
+    returns void
+    language sql
+as
+$$
+    insert into dirty_gates (queue, id)
+    select q.queue, i.id
+    from (select distinct queue from rewrite_count where queue is not null) q
+    cross join unnest(ids) i(id)
+    where i.id is not null;
+$$;
@@ -0,0 +1,78 @@
+-- Gate histogram of linked_circuit, kept up to date by triggers instead of counting the
+-- table for every sample. The triggers only exist between start_gate_histogram() and
+-- stop_gate_histogram() (reset_convergence() drops them as well), so that bulk loads and
+-- runs without a logger do not pay for them.
+-- Every insert, delete or type/param change adds a delta row, fold_gate_histogram() adds
+-- them up into gate_type_counts. A NULL param is counted as 0.
+
+create or replace function gate_histogram_delta()
+    returns trigger
+    language plpgsql
+as
+$$
+begin
+    if tg_op in ('DELETE', 'UPDATE') then
+        insert into gate_type_deltas values (old.type, coalesce(old.param, 0), -1);
+    end if;
+
+    if tg_op in ('INSERT', 'UPDATE') then
+        insert into gate_type_deltas values (new.type, coalesce(new.param, 0), 1);
+    end if;
+
+    return null;
+end;
+$$;
+
+create or replace procedure stop_gate_histogram()
+    language plpgsql
+as
+$$
+begin
+    drop trigger if exists gate_histogram_insert_delete on linked_circuit;
+    drop trigger if exists gate_histogram_update on linked_circuit;
+end;
+$$;
+
+-- Counts the gates once and installs the triggers in the same transaction: creating a
+-- trigger locks out the writers until the commit, so no change is counted twice or lost.
+create or replace procedure start_gate_histogram()
+    language plpgsql
+as
+$$
+begin
+    call stop_gate_histogram();
+
+    create trigger gate_histogram_insert_delete
+        after insert or delete on linked_circuit
+        for each row execute function gate_histogram_delta();
+
+    create trigger gate_histogram_update
+        after update of type, param on linked_circuit
+        for each row
+        when (old.type is distinct from new.type or old.param is distinct from new.param)
+        execute function gate_histogram_delta();
+
+    delete from gate_type_deltas;
+    delete from gate_type_counts;
+
+    insert into gate_type_counts (type, param, count)
+    select type, coalesce(param, 0), count(*) from linked_circuit group by 1, 2;
+end;
+$$;
+
+-- Deltas committed after the delete started are not visible to it and are left for the next fold.
+create or replace procedure fold_gate_histogram()
+    language plpgsql
+as
+$$
+begin
+    with folded as (
+        delete from gate_type_deltas returning type, param, delta
+    )
+    insert into gate_type_counts as c (type, param, count)
+    select type, param, sum(delta) from folded group by type, param
+    on conflict (type, param) do update set count = c.count + excluded.count;
+
+    delete from gate_type_counts where count = 0;
+end;
+$$;
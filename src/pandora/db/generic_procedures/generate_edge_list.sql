@@ -1,40 +1,96 @@
-create or replace procedure generate_edge_list()
+drop procedure if exists generate_edge_list();
+
+-- Edges of linked_circuit: (gate, next gate) for every port, (-1, gate) for In gates and
+-- (gate, -2) for Out gates. Only gates with lo <= id < hi are considered, so that several
+-- connections can fill edge_list at once. edge_list is not cleared first.
+create or replace procedure generate_edge_list(lo bigint default null, hi bigint default null)
+    language plpgsql
+as
+$$
+begin
+    lo := coalesce(lo, -9223372036854775808);
+    hi := coalesce(hi, 9223372036854775807);
+
+    -- one scan per kind of edge is faster than expanding every gate into its edges
+    insert into edge_list (source, target)
+    select -1, id from linked_circuit where type = 0 and id >= lo and id < hi
+    union all
+    select id, -2 from linked_circuit where type = 1 and id >= lo and id < hi
+    union all
+    select id, next_q1_id from linked_circuit where next_q1 is not null and id >= lo and id < hi
+    union all
+    select id, next_q2_id from linked_circuit where next_q2 is not null and id >= lo and id < hi
+    union all
+    select id, get_id_from_link(next_q3) from linked_circuit where next_q3 is not null and id >= lo and id < hi;
+end;
+$$;
+
+-- Brings edge_list up to date with the gates inserted, updated or deleted since the last
+-- generate_edge_list() or update_edge_list() run recorded in edge_list_state.
+--
+-- Touched gates are found through their xmin, so the rewrite procedures (and any other
+-- writer) do not pay for tracking. xmin cannot be indexed, so finding them is still one
+-- sequential scan of linked_circuit, O(gates) and not O(touched gates); what is saved is
+-- regenerating the edges of the untouched gates. Frozen rows keep their xmin (PostgreSQL
+-- 9.4 and later), but comparing ages is only sound while the recorded xid is less than 2^31
+-- transactions old, so after a billion transactions edge_list is rebuilt from scratch.
+create or replace procedure update_edge_list()
     language plpgsql
 as
 $$
 declare
-   t_curs cursor for select * from linked_circuit;
-   t_row linked_circuit%rowtype;
-   source_id bigint;
-   target_q1_id bigint;
-   target_q2_id bigint;
-   global_in bigint;
-   global_out bigint;
+    since    xid;
+    vanished bigint[];
 begin
-    global_in = -1;
-    global_out = -2;
-
-    for t_row in t_curs loop
-        source_id := t_row.id;
-        if t_row.type = 0 then
-            insert into edge_list values (global_in, source_id);
-        end if;
-        if t_row.type = 1 then
-            insert into edge_list values (source_id, global_out);
-        end if;
-        --- single qubit gate
-        if t_row.next_q1 is not null and t_row.next_q2 is null then
-            target_q1_id := get_id_from_link(t_row.next_q1);
-            insert into edge_list values (source_id, target_q1_id);
-        else
-            --- two qubit gate
-            if t_row.next_q1 is not null and t_row.next_q2 is not null and t_row.next_q3 is null then
-                target_q1_id := get_id_from_link(t_row.next_q1);
-                target_q2_id := get_id_from_link(t_row.next_q2);
-                insert into edge_list values (source_id, target_q1_id);
-                insert into edge_list values (source_id, target_q2_id);
-            end if;
-        end if;
+    select snapshot_xmin into since from edge_list_state;
+
+    -- transactions that are still running now are picked up by the next run
+    delete from edge_list_state;
+    insert into edge_list_state values (current_snapshot_xmin());
+
+    if since is null or age(since) > 1000000000 then
+        truncate edge_list;
+        call generate_edge_list();
+        return;
+    end if;
+
+    create temporary table touched_gates on commit drop as
+    select id, type, next_q1_id, next_q2_id, next_q3
+    from linked_circuit
+    where age(xmin) <= age(since);
+
+    -- the edges of a gate are keyed by their source, apart from the (-1, In gate) ones
+    with removed as (
+        delete from edge_list e
+        where case when e.source = -1 then e.target else e.source end in (select id from touched_gates)
+        returning e.target
+    )
+    select array_agg(distinct r.target) into vanished
+    from removed r
+    where r.target <> -2 and not exists (select 1 from linked_circuit g where g.id = r.target);
+
+    -- the gates deleted by the rewrites have no row anymore, they are found by following
+    -- the old edges from the gates that were relinked around them
+    while vanished is not null loop
+        with removed as (
+            delete from edge_list e
+            where e.source in (select unnest(vanished))
+            returning e.target
+        )
+        select array_agg(distinct r.target) into vanished
+        from removed r
+        where r.target <> -2 and not exists (select 1 from linked_circuit g where g.id = r.target);
     end loop;
+
+    insert into edge_list (source, target)
+    select -1, id from touched_gates where type = 0
+    union all
+    select id, -2 from touched_gates where type = 1
+    union all
+    select id, next_q1_id from touched_gates where next_q1_id is not null
+    union all
+    select id, next_q2_id from touched_gates where next_q2_id is not null
+    union all
+    select id, get_id_from_link(next_q3) from touched_gates where next_q3 is not null;
 end;
-$$
\ No newline at end of file
+$$;
@@ -1,5 +1,7 @@
-create or replace procedure linked_hhcxhh_to_cx(pass_count int, timeout int)
--- create or replace procedure linked_hhcxhh_to_cx(my_partition int, pass_count int, timeout int)
+drop procedure if exists linked_hhcxhh_to_cx(int, int);
+
+-- with my_partition set, only matches that lie entirely in that partition of linked_circuit are rewritten
+create or replace procedure linked_hhcxhh_to_cx(pass_count int, timeout int, my_partition int default null)
     language plpgsql
 as
 $$
@@ -29,24 +31,56 @@ declare
     d record;
 
 	start_time timestamp;
+    pass_start timestamp;
+    rewrites int;
+    stop boolean := false;
+
+    queue text;
+    candidates bigint[];
+    last_full_scan timestamp;
 
     h_type smallint;
     cx_types smallint[];
 
+    part_lo bigint;
+    part_hi bigint;
+
 begin
     start_time := clock_timestamp();
+    queue := format('linked_hhcxhh_to_cx(%s)', my_partition);
+    call start_passes(queue);
+
+    select lo, hi into part_lo, part_hi from partition_bounds(my_partition);
 
     select id into h_type from gate_types where name = 'h';
     select array_agg(id) into cx_types from gate_types where name in ('cx', 'cxpow');
 
     while pass_count > 0 loop
+        pass_start := clock_timestamp();
+        rewrites := 0;
+
+        -- the first pass scans the whole table, the later ones only the gates around recent rewrites
+        candidates := next_candidates(queue, last_full_scan);
+        if candidates is null then
+            last_full_scan := pass_start;
+        end if;
+
         for gate in
             select * from linked_circuit
                      where
                        type = any(cx_types)
-                       and get_type_from_link(prev_q1) = h_type and get_type_from_link(prev_q2) = h_type
-                       and get_type_from_link(next_q1) = h_type and get_type_from_link(next_q2) = h_type
-                       -- and partition_id = my_partition
+                       and prev_q1_type = h_type and prev_q2_type = h_type
+                       and next_q1_type = h_type and next_q2_type = h_type
+                       and id >= part_lo and id < part_hi
+                       and candidates is null
+            union all
+            select * from linked_circuit
+                     where
+                       type = any(cx_types)
+                       and prev_q1_type = h_type and prev_q2_type = h_type
+                       and next_q1_type = h_type and next_q2_type = h_type
+                       and id >= part_lo and id < part_hi
+                       and id = any(candidates)
         loop
             select * into cx from linked_circuit where id = gate.id for update skip locked;
 
@@ -63,6 +97,12 @@ begin
             cx_next_q1_id := get_id_from_link(cx.next_q1);
             cx_next_q2_id := get_id_from_link(cx.next_q2);
 
+            if not ids_in_range(array[cx_prev_q1_id, cx_prev_q2_id, cx_next_q1_id, cx_next_q2_id], part_lo, part_hi) then
+                perform defer_to_boundary(array[gate.id]);
+                commit;
+                continue;
+            end if;
+
             -- Select the Hadamards
             select * into left_q1 from linked_circuit where id=cx_prev_q1_id for update skip locked;
             select * into left_q2 from linked_circuit where id=cx_prev_q2_id for update skip locked;
@@ -93,6 +133,12 @@ begin
             right_q1_id := get_id_from_link(right_q1.next_q1);
             right_q2_id := get_id_from_link(right_q2.next_q1);
 
+            if not ids_in_range(array[left_q1_id, left_q2_id, right_q1_id, right_q2_id], part_lo, part_hi) then
+                perform defer_to_boundary(array[gate.id]);
+                commit;
+                continue;
+            end if;
+
             select * into a from linked_circuit where id=left_q1_id for update skip locked;
             select * into b from linked_circuit where id=left_q2_id for update skip locked;
             select * into c from linked_circuit where id=right_q1_id for update skip locked;
@@ -143,10 +189,15 @@ begin
 
             delete from linked_circuit where id in (left_q1.id, left_q2.id, right_q1.id, right_q2.id);
 
+            perform enqueue_dirty_gates(array[cx.id, left_q1_id, left_q2_id, right_q1_id, right_q2_id]);
+            rewrites := rewrites + 1;
             commit; -- release the cx
 
         end loop; -- end gate loop
 
+        call report_pass(pass_start, rewrites, stop);
+        exit when stop; -- saturated, see stopper()
+
 	    if extract(epoch from (clock_timestamp() - start_time)) > timeout then
             exit;
         end if;
@@ -155,6 +206,8 @@ begin
 
     end loop; --end pass loop
 
+    call finish_passes();
+
 end;$$;
 
 
@@ -33,8 +33,8 @@ begin
     while run_nr > 0 loop
         for cx in
             select * from linked_circuit where type = any(cx_types)
-            and get_type_from_link(prev_q1) = h_type and get_type_from_link(prev_q2) = h_type
-            and get_type_from_link(next_q1) = h_type and get_type_from_link(next_q2) = h_type
+            and prev_q1_type = h_type and prev_q2_type = h_type
+            and next_q1_type = h_type and next_q2_type = h_type
         loop
             if cx.id is not null
             then
@@ -0,0 +1,54 @@
+create or replace procedure partition_linked_circuit(n_partitions int)
+    language plpgsql
+as
+$$
+declare
+    bounds bigint[];
+    columns text;
+begin
+    -- split at the id quantiles, so that every partition holds about the same number of gates
+    select percentile_disc(array(select i::float / n_partitions from generate_series(1, n_partitions - 1) i))
+               within group (order by id)
+    into bounds
+    from linked_circuit;
+
+    -- the first and the last partition are open ended, gates inserted later by the
+    -- procedures take their ids from new id blocks and end up in the last partition
+    select array_agg(b order by b) into bounds
+    from (
+        select distinct unnest(
+            array[-9223372036854775808]::bigint[] || coalesce(bounds, '{}') || array[9223372036854775807]::bigint[]
+        ) as b
+    ) it;
+
+    create table linked_circuit_partitioned (like linked_circuit including defaults including generated)
+        partition by range (id);
+
+    delete from linked_circuit_partitions;
+
+    for i in 1 .. array_length(bounds, 1) - 1 loop
+        execute format(
+            'create table linked_circuit_partitioned_p%s partition of linked_circuit_partitioned for values from (%s) to (%s)',
+            i - 1, bounds[i], bounds[i + 1]
+        );
+        insert into linked_circuit_partitions values (i - 1, bounds[i], bounds[i + 1]);
+    end loop;
+
+    -- generated columns are recomputed on insert
+    select string_agg(quote_ident(attname), ', ' order by attnum) into columns
+    from pg_attribute
+    where attrelid = 'linked_circuit'::regclass and attnum > 0 and not attisdropped and attgenerated = '';
+
+    execute format('insert into linked_circuit_partitioned (%s) select %s from linked_circuit', columns, columns);
+
+    -- PandoraService.partition_circuit() adds the foreign key again, with the indexes
+    alter table if exists linked_circuit_attributes drop constraint if exists linked_circuit_attributes_id_fkey;
+
+    -- also drops the partitions if linked_circuit was already partitioned
+    drop table linked_circuit;
+    alter table linked_circuit_partitioned rename to linked_circuit;
+
+    for i in 1 .. array_length(bounds, 1) - 1 loop
+        execute format('alter table linked_circuit_partitioned_p%s rename to linked_circuit_p%s', i - 1, i - 1);
+    end loop;
+end;$$;
@@ -1,5 +1,9 @@
+drop procedure if exists fuse_single_qubit(int, int, int, float, float, float, int, int);
+
 -- does not include the replacement of global_phase
-create or replace procedure fuse_single_qubit(type_1 int, type_2 int, type_replace int, param1 float, param2 float, param_replace float, pass_count int, timeout int)
+-- with my_partition set, only matches that lie entirely in that partition of linked_circuit are rewritten
+create or replace procedure fuse_single_qubit(type_1 int, type_2 int, type_replace int, param1 float, param2 float, param_replace float, pass_count int, timeout int,
+                                              my_partition int default null)
     language plpgsql
 as
 $$
@@ -18,19 +22,59 @@ declare
     new_prev bigint;
 
     start_time timestamp;
+    pass_start timestamp;
+    rewrites int;
+    stop boolean := false;
+
+    queue text;
+    candidates bigint[];
+    last_full_scan timestamp;
+
+    part_lo bigint;
+    part_hi bigint;
 
 begin
     start_time := clock_timestamp();
+    queue := format('fuse_single_qubit(%s, %s, %s, %s, %s, %s, %s)', type_1, type_2, type_replace, param1, param2, param_replace, my_partition);
+    call start_passes(queue);
+
+    select lo, hi into part_lo, part_hi from partition_bounds(my_partition);
 
 	 while pass_count > 0 loop
+        pass_start := clock_timestamp();
+        rewrites := 0;
+
+        -- the first pass scans the whole table, the later ones only the gates around recent rewrites
+        candidates := next_candidates(queue, last_full_scan);
+        if candidates is null then
+            last_full_scan := pass_start;
+        end if;
+
         for gate in
             select * from linked_circuit
             where
             type=type_1
-            and get_type_from_link(next_q1) = type_2
+            and next_q1_type = type_2
+            and param=param1
+            and id >= part_lo and id < part_hi
+            and candidates is null
+            union all
+            select * from linked_circuit
+            where
+            type=type_1
+            and next_q1_type = type_2
             and param=param1
+            and id >= part_lo and id < part_hi
+            and id = any(candidates)
         loop
             select * into first from linked_circuit where id = gate.id for update skip locked;
+
+            if not ids_in_range(array[get_id_from_link(first.next_q1)], part_lo, part_hi) then
+                perform defer_to_boundary(array[gate.id]);
+                commit;
+                continue;
+            end if;
+
             select * into second from linked_circuit where id = get_id_from_link(first.next_q1) for update skip locked;
 
             if first.id is null
@@ -59,6 +103,12 @@ begin
             first_prev_id := get_id_from_link(first.prev_q1);
             second_next_id := get_id_from_link(second.next_q1);
 
+            if not ids_in_range(array[first_prev_id, second_next_id], part_lo, part_hi) then
+                perform defer_to_boundary(array[gate.id]);
+                commit;
+                continue;
+            end if;
+
             select * into a from linked_circuit where id = first_prev_id for update skip locked;
             select * into b from linked_circuit where id = second_next_id for update skip locked;
 
@@ -88,10 +138,15 @@ begin
 
             delete from linked_circuit where id = second.id;
 
+            perform enqueue_dirty_gates(array[first.id, first_prev_id, second_next_id]);
+            rewrites := rewrites + 1;
             commit;
 
         end loop; -- end gate loop
 
+        call report_pass(pass_start, rewrites, stop);
+        exit when stop; -- saturated, see stopper()
+
         pass_count = pass_count - 1;
 
 	    if extract(epoch from (clock_timestamp() - start_time)) > timeout then
@@ -99,4 +154,6 @@ begin
         end if;
 
      end loop; -- end pass loop
+
+    call finish_passes();
 end;$$;
@@ -0,0 +1,51 @@
+create or replace procedure stitch_shards()
+    language plpgsql
+as
+$$
+begin
+    -- every In gate of a shard is matched to the Out gate of the same qubit in the
+    -- closest earlier shard that touched the qubit
+    create temporary table stitch_pairs on commit drop as
+    select out_gate.id      as out_id,
+           in_gate.id       as in_id,
+           out_gate.prev_q1 as prev_link,
+           in_gate.next_q1  as next_link
+    from (
+        select in_id,
+               lag(out_id) over (partition by qubit order by shard) as out_id
+        from shard_boundary
+    ) b
+    join linked_circuit out_gate on out_gate.id = b.out_id
+    join linked_circuit in_gate on in_gate.id = b.in_id;
+
+    -- the gate before the Out gate now points to the gate after the In gate, and vice versa
+    update linked_circuit g set next_q1 = s.next_link
+    from stitch_pairs s
+    where g.id = get_id_from_link(s.prev_link) and get_port_from_link(s.prev_link) = 0;
+
+    update linked_circuit g set next_q2 = s.next_link
+    from stitch_pairs s
+    where g.id = get_id_from_link(s.prev_link) and get_port_from_link(s.prev_link) = 1;
+
+    update linked_circuit g set next_q3 = s.next_link
+    from stitch_pairs s
+    where g.id = get_id_from_link(s.prev_link) and get_port_from_link(s.prev_link) = 2;
+
+    update linked_circuit g set prev_q1 = s.prev_link
+    from stitch_pairs s
+    where g.id = get_id_from_link(s.next_link) and get_port_from_link(s.next_link) = 0;
+
+    update linked_circuit g set prev_q2 = s.prev_link
+    from stitch_pairs s
+    where g.id = get_id_from_link(s.next_link) and get_port_from_link(s.next_link) = 1;
+
+    update linked_circuit g set prev_q3 = s.prev_link
+    from stitch_pairs s
+    where g.id = get_id_from_link(s.next_link) and get_port_from_link(s.next_link) = 2;
+
+    delete from linked_circuit
+    where id in (select out_id from stitch_pairs union all select in_id from stitch_pairs);
+
+    truncate shard_boundary;
+end;
+$$
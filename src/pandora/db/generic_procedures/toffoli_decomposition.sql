@@ -1,136 +1,206 @@
-create or replace procedure linked_toffoli_decomp()
+drop procedure if exists linked_toffoli_decomp();
+drop procedure if exists linked_toffoli_decomp(int, int, int, int);
+
+-- Link to the given port of gate j of an expanded Toffoli whose gates start at id base, or
+-- for j < 0 the link toffoli_links[-j] of the Toffoli itself. The types are the ones of
+-- the gates in linked_toffoli_decomp(): H = 8, CXPowGate = 18, ZPowGate = 7.
+create or replace function toffoli_gate_link(base bigint, j int, port int, toffoli_links bigint[])
+    returns bigint
+    language sql
+    immutable
+as
+$$
+    select case
+        when j is null then null
+        when j < 0 then toffoli_links[-j]
+        else create_link(base + j, port, ((array[8, 18, 7, 18, 7, 18, 7, 18, 18, 7, 18, 7, 7, 7, 8])[j + 1])::smallint)
+    end;
+$$;
+
+-- Replaces every CCX (CCXPowGate with exponent 1) by the 15 gates of its Clifford+T
+-- decomposition, batch_size Toffolis per transaction: the Toffolis of a batch and their
+-- neighbours are locked with one skip locked query, the gates of the whole batch are
+-- inserted with one insert into a range of ids from next_gate_ids() and the neighbours
+-- are relinked with one update. Toffolis that are neighbours of an earlier Toffoli of the
+-- batch are left to the next pass. Reports to rewrite_count, so add_stopper() ends the
+-- workers once there is no Toffoli left.
+create or replace procedure linked_toffoli_decomp(pass_count int, timeout int, batch_size int,
+                                                  my_partition int default null)
     language plpgsql
 as
 $$
 declare
-    toffoli record;
-
-    -- Toffoli neighbours
-    tof_prev_q1_id bigint;
-	tof_prev_q2_id bigint;
-	tof_next_q1_id bigint;
-	tof_next_q2_id bigint;
-    tof_prev_q3_id bigint;
-	tof_next_q3_id bigint;
-
-    -- neighbours modulus
-    conc_modulus_left_q1 varchar(10);
-    conc_modulus_left_q2 varchar(10);
-    conc_modulus_left_q3 varchar(10);
-    conc_modulus_right_q1 varchar(10);
-    conc_modulus_right_q2 varchar(10);
-    conc_modulus_right_q3 varchar(10);
-
-    -- synthesis gates
-	a_id bigint;
-	b_id bigint;
-	c_id bigint;
-	d_id bigint;
-	e_id bigint;
-    f_id bigint;
-	g_id bigint;
-	h_id bigint;
-	i_id bigint;
-	j_id bigint;
-    k_id bigint;
-	l_id bigint;
-	m_id bigint;
-	n_id bigint;
-	o_id bigint;
-
-    -- utility variables
-	found boolean = true;
-	count int = 0;
-    distinct_count int;
-    distinct_existing int;
+    cand record;
+
+    claimed_toffolis bigint[];
+    claimed_neighbours bigint[];
+    locked_ids bigint[];
+    toffoli_ids bigint[];
+    id_base bigint;
+
+    relink_ids bigint[];
+    relink_next boolean[];
+    relink_ports int[];
+    relink_links bigint[];
+
+    last_id bigint;
+    n_found int;
+
+    start_time timestamp with time zone;
+    pass_start timestamp;
+    rewrites int;
+    stop boolean := false;
+
+    part_lo bigint;
+    part_hi bigint;
+
 begin
-	while found = true loop
-		count := count + 1;
-		found := false;
-
-    	select * into toffoli from linked_circuit as it
-    	                      where it.type = 23 for update skip locked limit 1;
-
-    	if toffoli.id is not null then
-    	    tof_prev_q1_id := div(toffoli.prev_q1, 10);
-			tof_prev_q2_id := div(toffoli.prev_q2, 10);
-			tof_prev_q3_id := div(toffoli.prev_q3, 10);
-			tof_next_q1_id := div(toffoli.next_q1, 10);
-			tof_next_q2_id := div(toffoli.next_q2, 10);
-			tof_next_q3_id := div(toffoli.next_q3, 10);
-
-    	    conc_modulus_left_q1 := 'next_q' || mod(toffoli.prev_q1, 10) + 1;
-			conc_modulus_left_q2 := 'next_q' || mod(toffoli.prev_q2, 10) + 1;
-    	    conc_modulus_left_q3 := 'next_q' || mod(toffoli.prev_q3, 10) + 1;
-			conc_modulus_right_q1 := 'prev_q' || mod(toffoli.next_q1, 10) + 1;
-			conc_modulus_right_q2 := 'prev_q' || mod(toffoli.next_q2, 10) + 1;
-			conc_modulus_right_q3 := 'prev_q' || mod(toffoli.next_q3, 10) + 1;
-
-    	    select count(*) into distinct_count from (select distinct unnest(array[tof_prev_q1_id, tof_prev_q2_id, tof_prev_q3_id, tof_next_q1_id, tof_next_q2_id, tof_next_q3_id])) as it;
-			select count(*) into distinct_existing from
-			        (select * from linked_circuit where id in (tof_prev_q1_id, tof_prev_q2_id, tof_prev_q3_id, tof_next_q1_id, tof_next_q2_id, tof_next_q3_id) for update skip locked) as it;
-
-			if distinct_count = distinct_existing then
-                insert into linked_circuit values (default, toffoli.prev_q3, null, null, 8, 1, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into a_id;
-                insert into linked_circuit values (default, toffoli.prev_q2, a_id * 10, null, 18, 1, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into b_id;
-                insert into linked_circuit values (default, b_id * 10 + 1, null, null, 7, -0.25, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into c_id;
-                insert into linked_circuit values (default, toffoli.prev_q1, c_id * 10, null, 18, 1, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into d_id;
-                insert into linked_circuit values (default, d_id * 10 + 1, null, null, 7, 0.25, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into e_id;
-                insert into linked_circuit values (default, b_id * 10, e_id * 10, null, 18, 1, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into f_id;
-                insert into linked_circuit values (default, f_id * 10 + 1, null, null, 7, -0.25, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into g_id;
-                insert into linked_circuit values (default, d_id * 10, g_id * 10, null, 18, 1, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into h_id;
-                insert into linked_circuit values (default, h_id * 10, f_id * 10, null, 18, 1, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into i_id;
-                insert into linked_circuit values (default, i_id * 10 + 1, null, null, 7, -0.25, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into j_id;
-                insert into linked_circuit values (default, i_id * 10, j_id * 10, null, 18, 1, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into k_id;
-                insert into linked_circuit values (default, k_id * 10 , null, null, 7, 0.25, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into l_id;
-                insert into linked_circuit values (default, k_id * 10 + 1, null, null, 7, 0.25, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into m_id;
-                insert into linked_circuit values (default, h_id * 10 + 1, null, null, 7, 0.25, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into n_id;
-                insert into linked_circuit values (default, n_id * 10, null, null, 8, 1, 0, false, null, null, null, false, toffoli.label, false, null)
-                                                      returning id into o_id;
-
-                -- updating remaining next links
-                update linked_circuit set next_q1 = b_id * 10 + 1 where id = a_id;
-                update linked_circuit set (next_q1, next_q2) = (f_id * 10, c_id * 10) where id = b_id;
-                update linked_circuit set next_q1 = d_id * 10 + 1 where id = c_id;
-                update linked_circuit set (next_q1, next_q2) = (h_id * 10, e_id * 10) where id = d_id;
-                update linked_circuit set next_q1 = f_id * 10 where id = e_id;
-                update linked_circuit set (next_q1, next_q2) = (i_id * 10 + 1, g_id * 10) where id = f_id;
-                update linked_circuit set next_q1 = h_id * 10 + 1 where id = g_id;
-                update linked_circuit set (next_q1, next_q2) = (i_id * 10, n_id * 10) where id = h_id;
-                update linked_circuit set (next_q1, next_q2) = (k_id * 10, j_id * 10) where id = i_id;
-                update linked_circuit set next_q1 = k_id * 10 + 1 where id = j_id;
-                update linked_circuit set (next_q1, next_q2) = (l_id * 10, m_id * 10) where id = k_id;
-                update linked_circuit set next_q1 = toffoli.next_q1 where id = l_id;
-                update linked_circuit set next_q1 = toffoli.next_q2 where id = m_id;
-                update linked_circuit set next_q1 = o_id * 10 where id = n_id;
-                update linked_circuit set next_q1 = toffoli.next_q3 where id = o_id;
-
-                execute 'update linked_circuit set ' || conc_modulus_left_q1 || ' = $1 where id = $2' using d_id * 10, tof_prev_q1_id;
-                execute 'update linked_circuit set ' || conc_modulus_left_q2 || ' = $1 where id = $2' using b_id * 10, tof_prev_q2_id;
-                execute 'update linked_circuit set ' || conc_modulus_left_q3 || ' = $1 where id = $2' using a_id * 10, tof_prev_q3_id;
-                execute 'update linked_circuit set ' || conc_modulus_right_q1 || ' = $1 where id = $2' using l_id * 10, tof_next_q1_id;
-                execute 'update linked_circuit set ' || conc_modulus_right_q2 || ' = $1 where id = $2' using m_id * 10, tof_next_q2_id;
-                execute 'update linked_circuit set ' || conc_modulus_right_q3 || ' = $1 where id = $2' using o_id * 10, tof_next_q3_id;
-
-                delete from linked_circuit where id=toffoli.id;
+    start_time := clock_timestamp();
+    call start_passes();
+
+    select lo, hi into part_lo, part_hi from partition_bounds(my_partition);
+
+	 while pass_count > 0 loop
+        pass_start := clock_timestamp();
+        rewrites := 0;
+        last_id := null;
+
+        loop -- batch loop
+            claimed_toffolis := '{}';
+            claimed_neighbours := '{}';
+            n_found := 0;
+
+            for cand in
+                select id,
+                       array[get_id_from_link(prev_q1), get_id_from_link(prev_q2), get_id_from_link(prev_q3),
+                             next_q1_id, next_q2_id, get_id_from_link(next_q3)] as neighbours
+                from linked_circuit
+                where type = 23
+                  and param = 1
+                  and id >= part_lo and id < part_hi
+                  -- an index condition, see cancel_single_qubit_batched.sql
+                  and id >= coalesce(last_id + 1, part_lo)
+                order by id
+                limit batch_size
+            loop
+                n_found := n_found + 1;
+                last_id := cand.id;
+
+                if not ids_in_range(cand.neighbours, part_lo, part_hi)
+                    or cand.id = any(claimed_neighbours)
+                    or cand.neighbours && claimed_toffolis
+                then
+                    continue;
+                end if;
+
+                claimed_toffolis := claimed_toffolis || cand.id;
+                claimed_neighbours := claimed_neighbours || cand.neighbours;
+            end loop;
+
+            exit when n_found = 0;
+
+            -- in id order, like every worker, so that two batches do not deadlock
+            locked_ids := array(
+                select id from linked_circuit where id = any(claimed_toffolis || claimed_neighbours)
+                order by id for update skip locked
+            );
+
+            -- the Toffolis whose neighbours are all locked, and still none of the batch
+            toffoli_ids := array(
+                select id from linked_circuit
+                where id = any(claimed_toffolis)
+                  and id = any(locked_ids)
+                  and type = 23
+                  and param = 1
+                  and array[get_id_from_link(prev_q1), get_id_from_link(prev_q2), get_id_from_link(prev_q3),
+                            next_q1_id, next_q2_id, get_id_from_link(next_q3)] <@ locked_ids
+                  and not array[get_id_from_link(prev_q1), get_id_from_link(prev_q2), get_id_from_link(prev_q3),
+                                next_q1_id, next_q2_id, get_id_from_link(next_q3)] && claimed_toffolis
+                order by id
+            );
+
+            if cardinality(toffoli_ids) > 0 then
+                -- gate j of the k-th Toffoli of the batch gets id id_base + 15 * k + j
+                id_base := next_gate_ids(15 * cardinality(toffoli_ids));
+
+                -- q1, q2 are the controls and q3 the target. Gate j reads its qubits from
+                -- gate p1 (p2) port pp1 (pp2) and passes them on to gate n1 (n2) port np1 (np2),
+                -- a negative gate is the link of the Toffoli on that qubit.
+                insert into linked_circuit (id, prev_q1, prev_q2, type, param, switch, next_q1, next_q2, label)
+                select t.base + g.j,
+                       toffoli_gate_link(t.base, g.p1, g.pp1, array[t.prev_q1, t.prev_q2, t.prev_q3]),
+                       toffoli_gate_link(t.base, g.p2, g.pp2, array[t.prev_q1, t.prev_q2, t.prev_q3]),
+                       g.type,
+                       g.param,
+                       false,
+                       toffoli_gate_link(t.base, g.n1, g.np1, array[t.next_q1, t.next_q2, t.next_q3]),
+                       toffoli_gate_link(t.base, g.n2, g.np2, array[t.next_q1, t.next_q2, t.next_q3]),
+                       t.label
+                from (
+                    select lc.*, id_base + 15 * (row_number() over (order by lc.id) - 1) as base
+                    from linked_circuit lc
+                    where lc.id = any(toffoli_ids)
+                ) t
+                cross join (values
+                    --  j, type,  param,  p1, pp1,  p2, pp2,  n1, np1,  n2, np2
+                    ( 0,    8,      1,    -3, null, null, null,   1,   1, null, null),  -- H q3
+                    ( 1,   18,      1,    -2, null,    0,    0,   5,   0,    2,    0),  -- CX q2 q3
+                    ( 2,    7,  -0.25,     1,    1, null, null,   3,   1, null, null),  -- T^-1 q3
+                    ( 3,   18,      1,    -1, null,    2,    0,   7,   0,    4,    0),  -- CX q1 q3
+                    ( 4,    7,   0.25,     3,    1, null, null,   5,   1, null, null),  -- T q3
+                    ( 5,   18,      1,     1,    0,    4,    0,   8,   1,    6,    0),  -- CX q2 q3
+                    ( 6,    7,  -0.25,     5,    1, null, null,   7,   1, null, null),  -- T^-1 q3
+                    ( 7,   18,      1,     3,    0,    6,    0,   8,   0,   13,    0),  -- CX q1 q3
+                    ( 8,   18,      1,     7,    0,    5,    0,  10,   0,    9,    0),  -- CX q1 q2
+                    ( 9,    7,  -0.25,     8,    1, null, null,  10,   1, null, null),  -- T^-1 q2
+                    (10,   18,      1,     8,    0,    9,    0,  11,   0,   12,    0),  -- CX q1 q2
+                    (11,    7,   0.25,    10,    0, null, null,  -1, null, null, null),  -- T q1
+                    (12,    7,   0.25,    10,    1, null, null,  -2, null, null, null),  -- T q2
+                    (13,    7,   0.25,     7,    1, null, null,  14,   0, null, null),  -- T q3
+                    (14,    8,      1,    13,    0, null, null,  -3, null, null, null)   -- H q3
+                ) g(j, type, param, p1, pp1, p2, pp2, n1, np1, n2, np2);
+
+                -- the neighbours now point to the first and last gate of every qubit
+                select array_agg(e.id), array_agg(e.nxt), array_agg(e.port), array_agg(e.link)
+                into relink_ids, relink_next, relink_ports, relink_links
+                from (
+                    select lc.*, id_base + 15 * (row_number() over (order by lc.id) - 1) as base
+                    from linked_circuit lc
+                    where lc.id = any(toffoli_ids)
+                ) t
+                cross join lateral (values
+                    (get_id_from_link(t.prev_q1), true, get_port_from_link(t.prev_q1)::int, toffoli_gate_link(t.base, 3, 0, null)),
+                    (get_id_from_link(t.prev_q2), true, get_port_from_link(t.prev_q2)::int, toffoli_gate_link(t.base, 1, 0, null)),
+                    (get_id_from_link(t.prev_q3), true, get_port_from_link(t.prev_q3)::int, toffoli_gate_link(t.base, 0, 0, null)),
+                    (get_id_from_link(t.next_q1), false, get_port_from_link(t.next_q1)::int, toffoli_gate_link(t.base, 11, 0, null)),
+                    (get_id_from_link(t.next_q2), false, get_port_from_link(t.next_q2)::int, toffoli_gate_link(t.base, 12, 0, null)),
+                    (get_id_from_link(t.next_q3), false, get_port_from_link(t.next_q3)::int, toffoli_gate_link(t.base, 14, 0, null))
+                ) e(id, nxt, port, link);
+
+                perform relink_gates(relink_ids, relink_next, relink_ports, relink_links);
+                delete from linked_circuit where id = any(toffoli_ids);
+
+                perform enqueue_dirty_gates(relink_ids || array(
+                    select generate_series(id_base, id_base + 15 * cardinality(toffoli_ids) - 1)
+                ));
+                rewrites := rewrites + cardinality(toffoli_ids);
             end if;
-			found := true;
-            commit;
-		end if;
-	end loop;
-end;$$;
 
+            commit; -- release the locks of the batch
+
+        end loop; -- end batch loop
+
+        call report_pass(pass_start, rewrites, stop);
+        exit when stop; -- saturated, see stopper()
+
+	    if extract(epoch from (clock_timestamp() - start_time)) > timeout then
+            exit;
+        end if;
+
+        pass_count = pass_count - 1;
+
+	end loop; --end pass loop
+
+    call finish_passes();
+
+end;$$;
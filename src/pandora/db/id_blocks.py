@@ -0,0 +1,40 @@
+from pandora.db.core import PandoraDB
+from pandora.translation.circuit_to_dag import PandoraWindowedBuilder
+
+
+class IdBlockAllocator:
+    """
+    Reserves blocks of consecutive gate ids through reserve_id_blocks().
+
+    Blocks are carved out of the shared gate_id_block_seq sequence and recorded in
+    id_blocks, so builders in different processes or containers, and the rewrite
+    procedures (through the next_gate_id() default of linked_circuit.id), never
+    hand out the same id. Reserving a block is a single nextval, the id
+    assignment itself happens locally without touching the database.
+    """
+
+    def __init__(self, db: PandoraDB, owner: str | None = None):
+        self.db = db
+        self.owner = owner
+        self.block_size: int | None = None
+
+    async def reserve(self, n_blocks: int = 1) -> list[range]:
+        async with self.db.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "select first_id, last_id from reserve_id_blocks($1, $2)",
+                n_blocks,
+                self.owner,
+            )
+
+        blocks = [range(r["first_id"], r["last_id"] + 1) for r in rows]
+        self.block_size = len(blocks[0])
+        return blocks
+
+    async def top_up(self, builder: PandoraWindowedBuilder) -> None:
+        """
+        Make sure the builder has at least one full spare block, so that it cannot
+        run out of ids before the next call (one call per window is enough).
+        """
+        if self.block_size is None or builder.ids_left() < self.block_size:
+            for block in await self.reserve():
+                builder.add_id_block(block)
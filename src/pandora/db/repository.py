@@ -1,23 +1,82 @@
+import asyncio
 from typing import List, AsyncIterator
 
+import numpy as np
+
+from pandora.db.binary_copy import (
+    BinaryCopyDecoder,
+    PG_BINARY_TYPES,
+    iter_binary_copy,
+    records_to_columns,
+)
 from pandora.db.core import PandoraDB
 from pandora.translation.gates import (
     PandoraGate,
-    PandoraGateLayer
+    PandoraGateLayer,
+    PANDORA_GATE_DTYPE,
+    NULL_LINK,
+    NULLABLE_COLUMNS,
 )
 
 
+# Columns of PandoraGate.to_tuple() and of the default linked_circuit layout.
+GATE_COLUMNS = [
+    "id", "prev_q1", "prev_q2", "prev_q3",
+    "type", "param", "global_shift", "switch",
+    "next_q1", "next_q2", "next_q3",
+    "visited", "label", "cl_ctrl", "meas_key"
+]
+
+# Columns the compact layout keeps in the attributes side table, with their defaults.
+# Gates whose attributes all equal the defaults have no row there.
+ATTRIBUTE_DEFAULTS = {
+    "global_shift": 0.0,
+    "visited": -1,
+    "cl_ctrl": False,
+    "meas_key": None,
+}
+
+
 class GateRepository:
-    def __init__(self, db: PandoraDB, table: str = "linked_circuit"):
+    def __init__(self, db: PandoraDB, table: str = "linked_circuit", compact: bool = False):
+        """
+        With compact=True the gates are stored in the layout of _sql_generate_compact_table.sql,
+        PandoraService.build_pandora() creates that layout for a compact repository.
+        """
         self.db = db
         self.table = table
-
-        self.columns = [
-            "id", "prev_q1", "prev_q2", "prev_q3",
-            "type", "param", "global_shift", "switch",
-            "next_q1", "next_q2", "next_q3",
-            "visited", "label", "cl_ctrl", "meas_key"
-        ]
+        self.compact = compact
+
+        if compact:
+            self.columns = [name for name in GATE_COLUMNS if name not in ATTRIBUTE_DEFAULTS]
+            self.attribute_table = f"{table}_attributes"
+            self.attribute_columns = ["id", *ATTRIBUTE_DEFAULTS]
+
+            defaults = ", ".join(
+                f"l.{name}" if name not in ATTRIBUTE_DEFAULTS
+                else f"a.{name}" if ATTRIBUTE_DEFAULTS[name] is None
+                else f"coalesce(a.{name}, {str(ATTRIBUTE_DEFAULTS[name]).lower()}) as {name}"
+                for name in GATE_COLUMNS
+            )
+            self._select = f"SELECT {defaults} FROM {table} l LEFT JOIN {self.attribute_table} a ON a.id = l.id"
+        else:
+            self.columns = list(GATE_COLUMNS)
+            # not SELECT *, linked_circuit also has the generated link columns
+            self._select = f"SELECT {', '.join(GATE_COLUMNS)} FROM {table} l"
+
+    def _has_attributes(self, record: tuple) -> bool:
+        return any(
+            record[GATE_COLUMNS.index(name)] != default
+            for name, default in ATTRIBUTE_DEFAULTS.items()
+        )
+
+    def _attribute_mask(self, window: np.ndarray) -> np.ndarray:
+        return (
+            (window["global_shift"] != ATTRIBUTE_DEFAULTS["global_shift"])
+            | (window["visited"] != ATTRIBUTE_DEFAULTS["visited"])
+            | window["cl_ctrl"]
+            | (window["meas_key"] != NULL_LINK)
+        )
 
     async def insert_copy(self, gates: List[PandoraGate]):
         if not gates:
@@ -25,6 +84,13 @@ class GateRepository:
 
         records = [g.to_tuple() for g in gates]
 
+        if self.compact:
+            attributes = [
+                tuple(r[GATE_COLUMNS.index(name)] for name in self.attribute_columns)
+                for r in records if self._has_attributes(r)
+            ]
+            records = [tuple(r[GATE_COLUMNS.index(name)] for name in self.columns) for r in records]
+
         async with self.db.pool.acquire() as conn:
             await conn.copy_records_to_table(
                 self.table,
@@ -32,8 +98,95 @@ class GateRepository:
                 columns=self.columns,
             )
 
+        # after their gates, the attribute rows reference them once the indexes are built
+        if self.compact and attributes:
+            async with self.db.pool.acquire() as conn:
+                await conn.copy_records_to_table(
+                    self.attribute_table,
+                    records=attributes,
+                    columns=self.attribute_columns,
+                )
+
+    async def insert_columns(self, window: np.ndarray):
+        """
+        COPY a PANDORA_GATE_DTYPE window, as emitted by PandoraColumnarBuilder.
+        """
+        if len(window) == 0:
+            return
+
+        await self._copy_columns(self.table, window, self.columns)
+
+        if self.compact:
+            attributes = window[self._attribute_mask(window)]
+            if len(attributes) > 0:
+                await self._copy_columns(self.attribute_table, attributes, self.attribute_columns)
+
+    async def _copy_columns(self, table: str, window: np.ndarray, names: List[str]):
+        columns = []
+        for name in names:
+            values = window[name].astype(object)
+
+            if name in NULLABLE_COLUMNS:
+                values[window[name] == NULL_LINK] = None
+            elif name == "label":
+                values[window[name] == ""] = None
+
+            columns.append(values)
+
+        async with self.db.pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                table,
+                records=zip(*columns),
+                columns=names,
+            )
+
+    async def insert_binary(self, gates: np.ndarray | List[PandoraGate]):
+        """
+        COPY gates using the Postgres binary format.
+        Accepts a PANDORA_GATE_DTYPE window or a list of PandoraGate.
+        """
+        if len(gates) == 0:
+            return
+
+        if not isinstance(gates, np.ndarray):
+            gates = records_to_columns(g.to_tuple() for g in gates)
+
+        await self._copy_binary(self.table, gates, self.columns)
+
+        if self.compact:
+            attributes = gates[self._attribute_mask(gates)]
+            if len(attributes) > 0:
+                await self._copy_binary(self.attribute_table, attributes, self.attribute_columns)
+
+    async def _copy_binary(self, table: str, window: np.ndarray, names: List[str]):
+        async def chunks():
+            for chunk in iter_binary_copy(window, names):
+                yield chunk
+
+        async with self.db.pool.acquire() as conn:
+            await conn.copy_to_table(
+                table,
+                source=chunks(),
+                columns=names,
+                format="binary",
+            )
+
+    async def insert_boundary(self, shard: int, boundary: List[tuple[str, int, int]]):
+        """
+        Record the (qubit, In id, Out id) boundary of a shard, see stitch_shards().
+        """
+        if not boundary:
+            return
+
+        async with self.db.pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                "shard_boundary",
+                records=[(shard, *b) for b in boundary],
+                columns=["shard", "qubit", "in_id", "out_id"],
+            )
+
     async def fetch_all(self) -> List[PandoraGate]:
-        query = f"SELECT * FROM {self.table}"
+        query = self._select
 
         async with self.db.acquire() as conn:
             rows = await conn.fetch(query)
@@ -41,7 +194,7 @@ class GateRepository:
         return [PandoraGate.from_db_row(row) for row in rows]
 
     async def fetch_by_label(self, label: int) -> List[PandoraGate]:
-        query = f"SELECT * FROM {self.table} WHERE label = $1"
+        query = f"{self._select} WHERE l.label = $1"
 
         async with self.db.acquire() as conn:
             rows = await conn.fetch(query, label)
@@ -53,7 +206,7 @@ class GateRepository:
         if not ids:
             return []
 
-        query = f"SELECT * FROM {self.table} WHERE id = ANY($1)"
+        query = f"{self._select} WHERE l.id = ANY($1)"
 
         async with self.db.acquire() as conn:
             rows = await conn.fetch(query, ids)
@@ -78,8 +231,83 @@ class GateRepository:
                 if batch:
                     yield batch
 
+    async def stream_columns(self, chunk_rows: int = 1_000_000) -> AsyncIterator[np.ndarray]:
+        """
+        Stream all gates as PANDORA_GATE_DTYPE windows of about chunk_rows gates, read with
+        one binary COPY of the table. The NULLs are replaced by NULL_LINK and the label by
+        its character code in the query, so that the tuples have a fixed width and are
+        decoded by BinaryCopyDecoder.
+        """
+        fields = [
+            (name, ">i4") if name == "label" else (name, PG_BINARY_TYPES[name])
+            for name in GATE_COLUMNS
+        ]
+        # cast back to the column type, coalesce(smallint, 0) is an integer and would be sent as int4
+        sql_types = {">i2": "smallint", ">i4": "integer", ">i8": "bigint", ">f4": "real", "?": "boolean"}
+        values = ", ".join(
+            "ascii(coalesce(label, ''))" if name == "label"
+            else f"coalesce({name}, {NULL_LINK})::{sql_types[PG_BINARY_TYPES[name]]}" if name in NULLABLE_COLUMNS
+            else f"coalesce({name}, false)" if PG_BINARY_TYPES[name] == "?"
+            else f"coalesce({name}, 0)::{sql_types[PG_BINARY_TYPES[name]]}"
+            for name in GATE_COLUMNS
+        )
+        query = f"SELECT {values} FROM ({self._select}) g"
+
+        decoder = BinaryCopyDecoder(fields)
+        windows: asyncio.Queue = asyncio.Queue(maxsize=2)
+        pending: List[np.ndarray] = []
+
+        async def _flush():
+            if pending:
+                await windows.put(self._decoded_to_window(np.concatenate(pending)))
+                pending.clear()
+
+        async def _output(data: bytes):
+            rows = decoder.feed(data)
+            if len(rows) > 0:
+                pending.append(rows)
+            if sum(len(rows) for rows in pending) >= chunk_rows:
+                await _flush()
+
+        async def _copy():
+            try:
+                async with self.db.pool.acquire() as conn:
+                    await conn.copy_from_query(query, output=_output, format="binary")
+                decoder.close()
+                await _flush()
+            except asyncio.CancelledError:
+                # the caller stopped reading, nobody waits for the end of the stream
+                raise
+            except Exception:
+                await windows.put(None)
+                raise
+            await windows.put(None)
+
+        # the COPY keeps reading while the caller works on the previous window
+        task = asyncio.create_task(_copy())
+        try:
+            while (window := await windows.get()) is not None:
+                yield window
+            await task
+        finally:
+            task.cancel()
+
+    @staticmethod
+    def _decoded_to_window(rows: np.ndarray) -> np.ndarray:
+        window = np.empty(len(rows), dtype=PANDORA_GATE_DTYPE)
+
+        for name in GATE_COLUMNS:
+            if name == "label":
+                codes, index = np.unique(rows[name], return_inverse=True)
+                labels = np.array([chr(code) if code else "" for code in codes], dtype=window.dtype[name])
+                window[name] = labels[index]
+            else:
+                window[name] = rows[name]
+
+        return window
+
     async def stream(self, batch_size: int = 1000) -> AsyncIterator[List[PandoraGate]]:
-        query = f"SELECT * FROM {self.table}"
+        query = self._select
 
         async with self.db.acquire() as conn:
             async with conn.transaction():
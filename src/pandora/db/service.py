@@ -1,21 +1,50 @@
+import asyncio
 import time
+from dataclasses import dataclass
 from multiprocessing import Process
 from pathlib import Path
 from typing import Any, List, Optional
 
 from pandora.db.core import PandoraDB
+from pandora.db.id_blocks import IdBlockAllocator
 from pandora.db.repository import (
     GateRepository,
     GateLayerRepository
 )
+from pandora.db.snapshot import SnapshotReader, SnapshotWriter
+from pandora.multithreading.ingestion_pipeline import IngestionPipeline, PipelineStats
+from pandora.multithreading.parallel_build import build_shard_entry, measurement_keys, split_circuit
 from pandora.multithreading.parallel_decompose import worker_entry
-from pandora.translation.circuit_to_dag import PandoraWindowedBuilder
+from pandora.optimisation.rewrite_compiler import RewriteTemplate, compile_rewrite
+from pandora.translation.circuit_to_dag import (
+    PandoraWindowedBuilder,
+    PandoraColumnarBuilder,
+)
 from pandora.translation.translator import GLOBAL_IN_ID
 from pandora.widgetization.union_find import UnionFindWidgetizer
 
 BASE_DIR = Path(__file__).resolve().parent  # pandora/db/
 
 
+@dataclass
+class BulkLoadTimings:
+    schema: float = 0.0
+    load: float = 0.0
+    indexes: float = 0.0
+    set_logged: float = 0.0
+
+    @property
+    def total(self) -> float:
+        return self.schema + self.load + self.indexes + self.set_logged
+
+    def __str__(self):
+        return (
+            f"schema: {self.schema:.2f}s, load: {self.load:.2f}s, "
+            f"indexes: {self.indexes:.2f}s, set logged: {self.set_logged:.2f}s, "
+            f"total: {self.total:.2f}s"
+        )
+
+
 class PandoraService:
     def __init__(
             self,
@@ -23,35 +52,213 @@ class PandoraService:
             repo: GateRepository,
             repo_layered: GateLayerRepository = None,
             decomposition_window_size: int = 1_000_000,
+            rewrites: Optional[List[RewriteTemplate]] = None,
     ):
+        """
+        rewrites are compiled into procedures (and candidate indexes) next to the
+        hand-written ones, see pandora.optimisation.rewrite_compiler.
+        """
         self.db = db
         self.repo = repo
         self.repo_layered = repo_layered
         self.window_size = decomposition_window_size
+        self.rewrites = [compile_rewrite(template) for template in rewrites or []]
+
+        self.bulk_load_timings: Optional[BulkLoadTimings] = None
+        self._load_start = 0.0
+
+    async def build_pandora(self, bulk_load: bool = False, unlogged: bool = False):
+        """
+        With bulk_load=True, linked_circuit is created without its primary key and
+        indexes, so that COPY does not have to maintain them. They are built by
+        finish_bulk_load(), which has to be called once all gates are loaded.
+        With unlogged=True the table additionally stays UNLOGGED until then.
+
+        If the repository is compact, linked_circuit is created in the compact layout.
+
+        If the database has a namespace, only its schema is dropped and recreated, the
+        circuits of the other namespaces are left alone.
+        """
+        if unlogged and not bulk_load:
+            raise ValueError("unlogged requires bulk_load")
+
+        start = time.time()
 
-    async def build_pandora(self):
         await self._drop_tables()
         await self._build_schema()
+        if self.repo.compact:
+            await self._build_compact_schema()
         await self._refresh_procedures()
-        await self._reset_sequence(table_names=['linked_circuit',
-                                                'layered_lscom'])
+        await self._reset_sequence(table_names=['layered_lscom'])
+        await self._reset_id_blocks()
 
-    async def build_circuit(self, circuit: Any):
-        await self.build_pandora()
+        if not bulk_load:
+            await self._build_indexes()
+            self.bulk_load_timings = None
+            return
 
-        builder = PandoraWindowedBuilder(window_size=self.window_size)
+        if unlogged:
+            async with self.db.pool.acquire() as conn:
+                await conn.execute("ALTER TABLE linked_circuit SET UNLOGGED")
+
+        self.bulk_load_timings = BulkLoadTimings(schema=time.time() - start)
+        self._load_start = time.time()
+
+    async def finish_bulk_load(self) -> BulkLoadTimings:
+        """
+        Build the primary key and indexes of linked_circuit in parallel after a
+        bulk load and make the table logged again.
+        """
+        timings = self.bulk_load_timings
+        if timings is None:
+            raise ValueError("build_pandora() was not called with bulk_load=True")
+
+        timings.load = time.time() - self._load_start
+
+        # rewriting the table before the indexes exist avoids rebuilding them
+        start = time.time()
+        async with self.db.pool.acquire() as conn:
+            if await conn.fetchval("SELECT relpersistence = 'u' FROM pg_class WHERE oid = 'linked_circuit'::regclass"):
+                await conn.execute("ALTER TABLE linked_circuit SET LOGGED")
+        timings.set_logged = time.time() - start
+
+        start = time.time()
+        await self._build_indexes(parallel=True)
+        async with self.db.pool.acquire() as conn:
+            await conn.execute("ANALYZE linked_circuit")
+        timings.indexes = time.time() - start
+
+        self.bulk_load_timings = None
+        return timings
+
+    async def build_circuit(
+            self,
+            circuit: Any,
+            columnar: bool = False,
+            bulk_load: bool = False,
+            unlogged: bool = False,
+    ):
+        """
+        With columnar=True, windows are built as structured NumPy arrays
+        instead of PandoraGate objects and inserted with binary COPY.
+        See build_pandora() for bulk_load and unlogged.
+        """
+        await self.build_pandora(bulk_load=bulk_load, unlogged=unlogged)
+
+        if columnar:
+            builder = PandoraColumnarBuilder(window_size=self.window_size)
+            insert = self.repo.insert_binary
+        else:
+            builder = PandoraWindowedBuilder(window_size=self.window_size)
+            insert = self.repo.insert_copy
+
+        id_allocator = IdBlockAllocator(self.db, owner="build_circuit")
+        await id_allocator.top_up(builder)
 
         start = time.time()
 
         for batch in builder.consume(circuit):
-            await self.repo.insert_copy(batch)
+            await insert(batch)
+            await id_allocator.top_up(builder)
 
         final = builder.finalize()
-        if final:
-            await self.repo.insert_copy(final)
+        if len(final) > 0:
+            await insert(final)
 
         print(f"Decomposition took {time.time() - start:.2f}s")
 
+        if bulk_load:
+            print(f"Bulk load: {await self.finish_bulk_load()}")
+
+    async def build_circuit_pipelined(
+            self,
+            circuit: Any,
+            n_writers: int = 4,
+            queue_size: int = 8,
+            columnar: bool = False,
+            bulk_load: bool = False,
+            unlogged: bool = False,
+    ) -> PipelineStats:
+        """
+        Same as build_circuit(), but translation runs in a separate thread while
+        n_writers connections COPY the previous windows. At most queue_size windows
+        are buffered between the two stages.
+        """
+        await self.build_pandora(bulk_load=bulk_load, unlogged=unlogged)
+
+        if columnar:
+            builder = PandoraColumnarBuilder(window_size=self.window_size)
+        else:
+            builder = PandoraWindowedBuilder(window_size=self.window_size)
+
+        pipeline = IngestionPipeline(
+            repo=self.repo,
+            n_writers=n_writers,
+            queue_size=queue_size,
+            id_allocator=IdBlockAllocator(self.db, owner="build_circuit_pipelined"),
+        )
+        stats = await pipeline.run(builder, circuit)
+
+        print(f"Decomposition took {stats.total_time:.2f}s ({stats})")
+
+        if bulk_load:
+            print(f"Bulk load: {await self.finish_bulk_load()}")
+
+        return stats
+
+    async def build_circuit_parallel(
+            self,
+            circuit: Any,
+            nprocs: int,
+            columnar: bool = False,
+            bulk_load: bool = False,
+            unlogged: bool = False,
+    ) -> None:
+        """
+        Same as build_circuit(), but the circuit is split into nprocs contiguous
+        pieces that are built by separate processes. Every process records the
+        In/Out gates of its piece, and stitch_shards() joins the pieces afterwards.
+
+        The measurement keys are numbered over the whole circuit before it is split,
+        the same way build_circuit() numbers them.
+        """
+        if nprocs < 1:
+            raise ValueError("nprocs must be >= 1")
+
+        await self.build_pandora(bulk_load=bulk_load, unlogged=unlogged)
+
+        start = time.time()
+
+        processes: list[Process] = []
+        meas_keys = measurement_keys(circuit)
+
+        for shard, piece in enumerate(split_circuit(circuit, nprocs)):
+            p = Process(
+                target=build_shard_entry,
+                args=(shard, piece, self.window_size, self.db.config, columnar, self.repo.compact, meas_keys),
+            )
+            processes.append(p)
+
+        for p in processes:
+            p.start()
+
+        loop = asyncio.get_running_loop()
+        for p in processes:
+            await loop.run_in_executor(None, p.join)
+
+        failed = [shard for shard, p in enumerate(processes) if p.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Building shards {failed} failed")
+
+        if bulk_load:
+            print(f"Bulk load: {await self.finish_bulk_load()}")
+
+        build_time = time.time() - start
+        await self.stitch_shards()
+
+        print(f"Decomposition took {time.time() - start:.2f}s "
+              f"({build_time:.2f}s build, {time.time() - start - build_time:.2f}s stitch)")
+
     def parallel_decompose(
             self,
             nprocs: int,
@@ -60,6 +267,7 @@ class PandoraService:
             config_file: str = None,
             window_size: Optional[int] = None,
             N: Optional[int] = None,
+            n_writers: int = 0,
     ) -> None:
         """
         Launch parallel decomposition workers.
@@ -68,6 +276,14 @@ class PandoraService:
         - builds its assigned shard of the circuit
         - converts batches to Pandora gates
         - inserts batches into the database via async repository calls
+
+        Gate ids come from blocks reserved through IdBlockAllocator, so the workers
+        of all containers can write into the same linked_circuit without collisions.
+        Every worker records the In/Out gates of its shard, once all containers are
+        done stitch_shards() joins the shards into one circuit.
+
+        With n_writers > 0, every worker pipelines its build and COPY stages
+        (see IngestionPipeline) using n_writers connections.
         """
         if nprocs < 1:
             raise ValueError("nprocs must be >= 1")
@@ -91,6 +307,7 @@ class PandoraService:
                     effective_window_size,
                     N,
                     config_file,
+                    n_writers,
                 ),
             )
             processes.append(p)
@@ -101,6 +318,106 @@ class PandoraService:
         for p in processes:
             p.join()
 
+    async def partition_circuit(self, n_partitions: int) -> None:
+        """
+        Turn linked_circuit into a table range partitioned by id, split at the id
+        quantiles so that all n_partitions partitions hold about the same number
+        of gates. Worker i of a partitioned PandoraOptimiser rule then only rewrites
+        partition i and does not compete with the other workers for rows.
+        Has to be called after the circuit is built (and after finish_bulk_load()).
+        """
+        if n_partitions < 1:
+            raise ValueError("n_partitions must be >= 1")
+
+        start = time.time()
+
+        async with self.db.pool.acquire() as conn:
+            await conn.execute(f"call partition_linked_circuit({n_partitions})")
+
+        # not in parallel, concurrent transactions would pick the same names for
+        # the indexes of the partitions
+        await self._build_indexes()
+
+        async with self.db.pool.acquire() as conn:
+            await conn.execute("ANALYZE linked_circuit")
+
+        print(f"Partitioning took {time.time() - start:.2f}s")
+
+    async def stitch_shards(self) -> None:
+        """
+        Connect the shards written by parallel_decompose() into a single circuit:
+        the Out gates of every shard are matched per qubit to the In gates of the next
+        shard touching that qubit, their neighbours are linked directly and the
+        boundary gates are deleted.
+        """
+        async with self.db.pool.acquire() as conn:
+            await conn.execute("call stitch_shards()")
+
+    async def export_snapshot(self, path: str | Path, chunk_rows: int = 1_000_000) -> int:
+        """
+        Write linked_circuit to a snapshot file (see pandora.db.snapshot), in chunks of
+        about chunk_rows gates. The table is read with one binary COPY, and the chunks are
+        compressed in a thread while the COPY goes on. Returns the number of gates.
+        """
+        start = time.time()
+        loop = asyncio.get_running_loop()
+
+        with SnapshotWriter(path) as writer:
+            async for window in self.repo.stream_columns(chunk_rows=chunk_rows):
+                await loop.run_in_executor(None, writer.write, window)
+
+        print(f"Exporting {writer.n_gates} gates took {time.time() - start:.2f}s")
+        return writer.n_gates
+
+    async def import_snapshot(self, path: str | Path, unlogged: bool = False) -> int:
+        """
+        Replace the circuit with the one of a snapshot file written by export_snapshot().
+        The chunks are loaded with binary COPY into a bulk loaded linked_circuit (see
+        build_pandora()), the next chunk is decompressed while the previous one is copied.
+        Gate ids reserved afterwards start above the ids of the snapshot.
+        Returns the number of gates.
+        """
+        await self.build_pandora(bulk_load=True, unlogged=unlogged)
+
+        start = time.time()
+        loop = asyncio.get_running_loop()
+        n_gates = 0
+
+        with SnapshotReader(path) as reader:
+            if reader.chunks:
+                next_window = loop.run_in_executor(None, reader.read, reader.chunks[0])
+
+            for i in range(len(reader.chunks)):
+                window = await next_window
+                if i + 1 < len(reader.chunks):
+                    next_window = loop.run_in_executor(None, reader.read, reader.chunks[i + 1])
+
+                await self.repo.insert_binary(window)
+                n_gates += len(window)
+
+        print(f"Bulk load: {await self.finish_bulk_load()}")
+
+        async with self.db.pool.acquire() as conn:
+            await conn.execute(
+                "SELECT setval('gate_id_block_seq', coalesce(max(id) / gate_id_block_size(), 0) + 1, false) "
+                "FROM linked_circuit"
+            )
+
+        print(f"Importing {n_gates} gates took {time.time() - start:.2f}s")
+        return n_gates
+
+    async def install_rewrite(self, template: RewriteTemplate) -> None:
+        """
+        Compile a rewrite template and create its procedure and candidate index for the
+        circuit that is already built. It is installed again by every build_pandora().
+        """
+        compiled = compile_rewrite(template)
+        self.rewrites = [r for r in self.rewrites if r.name != compiled.name] + [compiled]
+
+        async with self.db.pool.acquire() as conn:
+            await conn.execute(compiled.procedure)
+            await conn.execute(compiled.index)
+
     async def load_circuit(self, circuit_type, label: int | None = None):
         if label is None:
             gates = await self.repo.fetch_all()
@@ -121,6 +438,50 @@ class PandoraService:
     async def load_circuit_from_layered(self):
         return await self.repo_layered.fetch_all()  # will have to stream these later
 
+    async def build_edge_list(self, nprocs: int = 1, incremental: bool = False) -> None:
+        """
+        Fill edge_list from linked_circuit. The id range of the gates is split evenly
+        across nprocs connections that insert their edges at the same time.
+
+        With incremental=True, only the edges of the gates that were inserted, updated
+        or deleted since the last build_edge_list() are regenerated (everything if
+        there was none). Finding those gates still scans linked_circuit once, see
+        update_edge_list().
+        """
+        if nprocs < 1:
+            raise ValueError("nprocs must be >= 1")
+
+        start = time.time()
+
+        if incremental:
+            async with self.db.pool.acquire() as conn:
+                await conn.execute("call update_edge_list()")
+
+            print(f"Updating the edge list took {time.time() - start:.2f}s")
+            return
+
+        async with self.db.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("TRUNCATE edge_list")
+                await conn.execute("DELETE FROM edge_list_state")
+                await conn.execute("INSERT INTO edge_list_state VALUES (current_snapshot_xmin())")
+
+            min_id, max_id = await conn.fetchrow("SELECT min(id), max(id) FROM linked_circuit")
+
+        if min_id is None:
+            return
+
+        step = (max_id - min_id) // nprocs + 1
+        bounds = [min_id + i * step for i in range(nprocs)] + [max_id + 1]
+
+        async def _generate(lo: int, hi: int):
+            async with self.db.pool.acquire() as conn:
+                await conn.execute("call generate_edge_list($1, $2)", lo, hi)
+
+        await asyncio.gather(*(_generate(bounds[i], bounds[i + 1]) for i in range(nprocs)))
+
+        print(f"Building the edge list took {time.time() - start:.2f}s")
+
     async def get_edge_list(self):
         async with self.db.pool.acquire() as conn:
             return await conn.fetch("SELECT * FROM edge_list")
@@ -166,19 +527,36 @@ class PandoraService:
             i += 1
 
     async def _drop_tables(self):
+        if self.db.namespace is not None:
+            # the procedures are recreated in the schema as well
+            async with self.db.pool.acquire() as conn:
+                await conn.execute(f"DROP SCHEMA IF EXISTS {self.db.namespace} CASCADE")
+                await conn.execute(f"CREATE SCHEMA {self.db.namespace}")
+            return
+
         tables = [
             'linked_circuit',
+            'linked_circuit_attributes',
             'batched_circuit',
             'linked_circuit_test',
             'stop_condition',
             'edge_list',
+            'edge_list_state',
+            'gate_type_counts',
+            'gate_type_deltas',
+            'dirty_gates',
+            'boundary_gates',
             'mem_cx',
             'rewrite_count',
+            'finished_passes',
             'max_missed_rounds',
             'benchmark_results',
             'optimization_results',
             'gate_types',
-            'layered_lscom'
+            'layered_lscom',
+            'id_blocks',
+            'shard_boundary',
+            'linked_circuit_partitions',
         ]
         async with self.db.pool.acquire() as conn:
             for t in tables:
@@ -191,6 +569,51 @@ class PandoraService:
         async with self.db.pool.acquire() as conn:
             await conn.execute(sql)
 
+    async def _build_compact_schema(self):
+        sql = (BASE_DIR / "generic_procedures/_sql_generate_compact_table.sql").read_text()
+        async with self.db.pool.acquire() as conn:
+            await conn.execute(sql)
+
+    async def _build_indexes(self, parallel: bool = False):
+        sql = (BASE_DIR / "generic_procedures/_sql_generate_indexes.sql").read_text()
+
+        if not parallel:
+            # keeps the index creation order (and so the planner's choice between
+            # equally cheap indexes) the same on every run
+            async with self.db.pool.acquire() as conn:
+                await conn.execute(sql)
+        else:
+            statements = [
+                statement for statement in sql.split(";")
+                if any(line.strip() and not line.strip().startswith("--") for line in statement.splitlines())
+            ]
+
+            async def _create(statement: str):
+                async with self.db.pool.acquire() as conn:
+                    await conn.execute(statement)
+
+            # CREATE INDEX only takes a SHARE lock, so all indexes can be built at once
+            await asyncio.gather(*(_create(statement) for statement in statements))
+
+        async with self.db.pool.acquire() as conn:
+            for rewrite in self.rewrites:
+                await conn.execute(rewrite.index)
+
+        async with self.db.pool.acquire() as conn:
+            # partitioned tables cannot take over an index as primary key, the unique index stays
+            if await conn.fetchval("SELECT relkind = 'r' FROM pg_class WHERE oid = 'linked_circuit'::regclass"):
+                await conn.execute(
+                    "ALTER TABLE linked_circuit ADD CONSTRAINT linked_circuit_pkey PRIMARY KEY USING INDEX linked_circuit_pkey"
+                )
+
+            # the attribute rows of the compact layout are deleted with their gates, it needs
+            # the unique index on linked_circuit and so is added after a bulk load as well
+            if await conn.fetchval("SELECT to_regclass('linked_circuit_attributes') IS NOT NULL"):
+                await conn.execute(
+                    "ALTER TABLE linked_circuit_attributes ADD CONSTRAINT linked_circuit_attributes_id_fkey "
+                    "FOREIGN KEY (id) REFERENCES linked_circuit (id) ON DELETE CASCADE"
+                )
+
     async def _refresh_procedures(self):
         procedures: List[str] = [
             # equivalence benchmark
@@ -199,6 +622,8 @@ class PandoraService:
             # sequential
             'generic_procedures/cancel_single_qubit.sql',
             'generic_procedures/cancel_two_qubit.sql',
+            'generic_procedures/cancel_single_qubit_batched.sql',
+            'generic_procedures/cancel_two_qubit_batched.sql',
             'generic_procedures/commute_single_control_left.sql',
             'generic_procedures/replace_two_sq_with_one.sql',
             'generic_procedures/toffoli_decomposition.sql',
@@ -207,6 +632,11 @@ class PandoraService:
 
             # worker procedures
             'generic_procedures/generate_edge_list.sql',
+            'generic_procedures/stitch_shards.sql',
+            'generic_procedures/partition_circuit.sql',
+            'generic_procedures/gate_histogram.sql',
+            'generic_procedures/convergence.sql',
+            'generic_procedures/dirty_gates.sql',
 
             # benchmarking only
             'generic_procedures/hhcxhh_to_cx_seq.sql',
@@ -218,6 +648,9 @@ class PandoraService:
                 sql = full_path.read_text()
                 await conn.execute(sql)
 
+            for rewrite in self.rewrites:
+                await conn.execute(rewrite.procedure)
+
     async def _reset_sequence(
             self,
             table_names: List[str],
@@ -229,6 +662,10 @@ class PandoraService:
             async with self.db.pool.acquire() as conn:
                 await conn.execute(query)
 
+    async def _reset_id_blocks(self):
+        async with self.db.pool.acquire() as conn:
+            await conn.execute("ALTER SEQUENCE gate_id_block_seq RESTART WITH 1")
+
     @staticmethod
     def _add_inputs(edge_records):
         edges_to_append: list[tuple[int, int]] = []
@@ -0,0 +1,68 @@
+"""
+Snapshot file of a circuit: a .npz archive (a zip of .npy files, readable with np.load)
+that holds the gates in chunks of PANDORA_GATE_DTYPE windows. Every column of a chunk is
+its own deflated entry "<chunk>/<column>.npy", links and ids compress much better per
+column than interleaved.
+"""
+import zipfile
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from pandora.translation.gates import PANDORA_GATE_DTYPE
+
+
+class SnapshotWriter:
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.n_chunks = 0
+        self.n_gates = 0
+        self._zip = zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def write(self, window: np.ndarray) -> None:
+        for name in PANDORA_GATE_DTYPE.names:
+            with self._zip.open(f"{self.n_chunks:06d}/{name}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(window[name]), allow_pickle=False)
+
+        self.n_chunks += 1
+        self.n_gates += len(window)
+
+    def close(self) -> None:
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SnapshotReader:
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._npz = np.load(self.path, allow_pickle=False)
+
+        self.chunks = sorted({key.split("/")[0] for key in self._npz.files})
+
+    def read(self, chunk: str) -> np.ndarray:
+        columns = {name: self._npz[f"{chunk}/{name}"] for name in PANDORA_GATE_DTYPE.names}
+
+        window = np.empty(len(columns["id"]), dtype=PANDORA_GATE_DTYPE)
+        for name, values in columns.items():
+            window[name] = values
+
+        return window
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for chunk in self.chunks:
+            yield self.read(chunk)
+
+    def close(self) -> None:
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
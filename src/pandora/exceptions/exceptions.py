@@ -67,3 +67,9 @@ class WrongPandoraBuilderInput(PandoraException):
     """
         Only Cirq and Qiskit circuits are supported for now.
     """
+
+
+class GateIdsExhausted(PandoraException):
+    """
+        The builder used up all its reserved gate id blocks, reserve another one with add_id_block().
+    """
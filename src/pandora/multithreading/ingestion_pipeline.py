@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from pandora.db.id_blocks import IdBlockAllocator
+from pandora.db.repository import GateRepository
+from pandora.translation.circuit_to_dag import (
+    PandoraWindowedBuilder,
+    PandoraColumnarBuilder,
+)
+
+
+@dataclass
+class StageStats:
+    windows: int = 0
+    gates: int = 0
+    busy_time: float = 0.0
+    wait_time: float = 0.0
+
+    @property
+    def gates_per_second(self) -> float:
+        return self.gates / self.busy_time if self.busy_time > 0 else 0.0
+
+
+@dataclass
+class PipelineStats:
+    build: StageStats = field(default_factory=StageStats)
+    insert: StageStats = field(default_factory=StageStats)
+    total_time: float = 0.0
+
+    @property
+    def gates_per_second(self) -> float:
+        return self.insert.gates / self.total_time if self.total_time > 0 else 0.0
+
+    def __str__(self):
+        return (
+            f"build: {self.build.gates} gates in {self.build.windows} windows, "
+            f"{self.build.busy_time:.2f}s busy, {self.build.wait_time:.2f}s blocked on full queue, "
+            f"{self.build.gates_per_second:.0f} gates/s | "
+            f"insert: {self.insert.gates} gates in {self.insert.windows} windows, "
+            f"{self.insert.busy_time:.2f}s in COPY, {self.insert.wait_time:.2f}s idle, "
+            f"{self.insert.gates_per_second:.0f} gates/s per writer | "
+            f"total: {self.total_time:.2f}s, {self.gates_per_second:.0f} gates/s"
+        )
+
+
+class IngestionPipeline:
+    """
+    Overlaps circuit translation with COPY into linked_circuit.
+
+    The builder runs in a separate thread and pushes its windows into a bounded
+    asyncio queue. n_writers tasks pop windows from the queue and COPY them
+    concurrently, each on its own connection from the PandoraDB pool.
+    When the queue is full the builder blocks until a writer catches up.
+
+    With an id_allocator, the builder is topped up with reserved id blocks
+    before every window.
+    """
+
+    def __init__(
+        self,
+        repo: GateRepository,
+        n_writers: int = 4,
+        queue_size: int = 8,
+        id_allocator: IdBlockAllocator | None = None,
+    ):
+        if n_writers < 1:
+            raise ValueError("n_writers must be >= 1")
+        if queue_size < 1:
+            raise ValueError("queue_size must be >= 1")
+
+        self.repo = repo
+        self.n_writers = n_writers
+        self.queue_size = queue_size
+        self.id_allocator = id_allocator
+
+    async def run(self, builder: PandoraWindowedBuilder, data: Any) -> PipelineStats:
+        if isinstance(builder, PandoraColumnarBuilder):
+            insert = self.repo.insert_binary
+        else:
+            insert = self.repo.insert_copy
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        stats = PipelineStats()
+
+        start = time.perf_counter()
+
+        producer = loop.run_in_executor(
+            None,
+            self._produce, loop, queue, builder, data, stop, stats.build,
+        )
+        writers = [
+            asyncio.create_task(self._write(queue, insert, stop, stats.insert))
+            for _ in range(self.n_writers)
+        ]
+
+        results = await asyncio.gather(producer, *writers, return_exceptions=True)
+        stats.total_time = time.perf_counter() - start
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        return stats
+
+    def _produce(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        queue: asyncio.Queue,
+        builder: PandoraWindowedBuilder,
+        data: Any,
+        stop: threading.Event,
+        stats: StageStats,
+    ) -> None:
+        try:
+            windows = builder.consume(data)
+
+            while not stop.is_set():
+                self._top_up(loop, builder)
+
+                t0 = time.perf_counter()
+                window = next(windows, None)
+                stats.busy_time += time.perf_counter() - t0
+
+                if window is None:
+                    break
+
+                self._put(loop, queue, window, stats)
+
+            if not stop.is_set():
+                self._top_up(loop, builder)
+
+                t0 = time.perf_counter()
+                final = builder.finalize()
+                stats.busy_time += time.perf_counter() - t0
+
+                if len(final) > 0:
+                    self._put(loop, queue, final, stats)
+        finally:
+            # the writers keep draining the queue until they see one sentinel each
+            for _ in range(self.n_writers):
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+    def _top_up(self, loop, builder: PandoraWindowedBuilder) -> None:
+        if self.id_allocator is not None:
+            asyncio.run_coroutine_threadsafe(self.id_allocator.top_up(builder), loop).result()
+
+    @staticmethod
+    def _put(loop, queue, window, stats: StageStats) -> None:
+        t0 = time.perf_counter()
+        asyncio.run_coroutine_threadsafe(queue.put(window), loop).result()
+        stats.wait_time += time.perf_counter() - t0
+
+        stats.windows += 1
+        stats.gates += len(window)
+
+    @staticmethod
+    async def _write(queue: asyncio.Queue, insert, stop: threading.Event, stats: StageStats) -> None:
+        error = None
+
+        while True:
+            t0 = time.perf_counter()
+            window = await queue.get()
+            stats.wait_time += time.perf_counter() - t0
+
+            if window is None:
+                break
+
+            if stop.is_set():
+                # another stage failed, drain so that the producer never blocks
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                await insert(window)
+            except Exception as e:
+                error = e
+                stop.set()
+                continue
+            stats.busy_time += time.perf_counter() - t0
+
+            stats.windows += 1
+            stats.gates += len(window)
+
+        if error is not None:
+            raise error
@@ -0,0 +1,132 @@
+import asyncio
+from typing import Any
+
+import cirq
+import numpy as np
+import qiskit
+
+from pandora.db.core import PandoraDB
+from pandora.db.id_blocks import IdBlockAllocator
+from pandora.db.repository import GateRepository
+from pandora.exceptions.exceptions import WrongPandoraBuilderInput
+from pandora.translation.circuit_to_dag import (
+    PandoraWindowedBuilder,
+    PandoraColumnarBuilder,
+)
+from pandora.translation.cirq_translator import CirqToPandoraTranslator
+from pandora.translation.qiskit_translator import QiskitToPandoraTranslator
+
+
+def split_circuit(circuit: Any, n_shards: int) -> list[Any]:
+    """
+    Split a circuit into n_shards contiguous pieces with about the same number of ops.
+    Cirq circuits are split at moment boundaries, Qiskit circuits at instruction boundaries.
+    """
+    if isinstance(circuit, cirq.Circuit):
+        op_counts = np.cumsum([len(moment) for moment in circuit.moments])
+        total = op_counts[-1] if len(op_counts) > 0 else 0
+
+        cuts = np.searchsorted(op_counts, [total * i / n_shards for i in range(1, n_shards)], side="right")
+        bounds = [0, *cuts.tolist(), len(circuit.moments)]
+
+        return [circuit[bounds[i]:bounds[i + 1]] for i in range(n_shards)]
+
+    if isinstance(circuit, qiskit.QuantumCircuit):
+        n_ops = len(circuit.data)
+        shards = []
+
+        for i in range(n_shards):
+            shard = circuit.copy_empty_like()
+            for instruction in circuit.data[n_ops * i // n_shards:n_ops * (i + 1) // n_shards]:
+                shard._append(instruction)
+            shards.append(shard)
+
+        return shards
+
+    raise WrongPandoraBuilderInput
+
+
+def measurement_keys(circuit: Any) -> dict[str, int]:
+    """
+    The numbers that one builder gives to the measurement keys of the whole circuit, in the
+    order in which the keys first appear. The builders of the pieces of split_circuit() start
+    from them, otherwise every piece would number its keys from 0.
+    """
+    if isinstance(circuit, cirq.Circuit):
+        translator, ops = CirqToPandoraTranslator(), circuit.all_operations()
+    elif isinstance(circuit, qiskit.QuantumCircuit):
+        translator, ops = QiskitToPandoraTranslator(), circuit.data
+    else:
+        raise WrongPandoraBuilderInput
+
+    for op in ops:
+        translator.to_fields(op)
+
+    return translator.meas_key_dict
+
+
+def build_shard_entry(
+    shard: int,
+    circuit: Any,
+    window_size: int,
+    config: dict,
+    columnar: bool = False,
+    compact: bool = False,
+    meas_keys: dict[str, int] | None = None,
+) -> None:
+    asyncio.run(
+        _build_shard(
+            shard=shard,
+            circuit=circuit,
+            window_size=window_size,
+            config=config,
+            columnar=columnar,
+            compact=compact,
+            meas_keys=meas_keys,
+        )
+    )
+
+
+async def _build_shard(
+    shard: int,
+    circuit: Any,
+    window_size: int,
+    config: dict,
+    columnar: bool = False,
+    compact: bool = False,
+    meas_keys: dict[str, int] | None = None,
+) -> None:
+    """
+    Build one piece of split_circuit() into linked_circuit and record its In/Out gates
+    in shard_boundary, so that stitch_shards() can connect it to its neighbours.
+    meas_keys are the measurement_keys() of the whole circuit.
+    """
+    db = PandoraDB(config, max_size=2)
+    await db.connect()
+
+    try:
+        repo = GateRepository(db, compact=compact)
+
+        if columnar:
+            builder = PandoraColumnarBuilder(window_size=window_size)
+            insert = repo.insert_binary
+        else:
+            builder = PandoraWindowedBuilder(window_size=window_size)
+            insert = repo.insert_copy
+
+        builder.meas_key_dict.update(meas_keys or {})
+
+        id_allocator = IdBlockAllocator(db, owner=f"shard {shard}")
+        await id_allocator.top_up(builder)
+
+        for window in builder.consume(circuit):
+            await insert(window)
+            await id_allocator.top_up(builder)
+
+        final = builder.finalize()
+        if len(final) > 0:
+            await insert(final)
+
+        await repo.insert_boundary(shard=shard, boundary=builder.qubit_boundary())
+    finally:
+        await db.close()
@@ -3,7 +3,9 @@ import time
 from typing import Optional
 
 from pandora.db.core import PandoraDB
+from pandora.db.id_blocks import IdBlockAllocator
 from pandora.db.repository import GateRepository
+from pandora.multithreading.ingestion_pipeline import IngestionPipeline
 from pandora.translation.circuit_to_dag import PandoraWindowedBuilder
 from pandora.pyLIQTR.utils.circuit_decomposition import circuit_decompose_multi
 
@@ -18,6 +20,7 @@ def worker_entry(
     window_size: int,
     N: Optional[int],
     config_file: str = None,
+    n_writers: int = 0,
 ) -> None:
     asyncio.run(
         _worker_main(
@@ -28,6 +31,7 @@ def worker_entry(
             config_file=config_file,
             window_size=window_size,
             N=N,
+            n_writers=n_writers,
         )
     )
 
@@ -40,7 +44,15 @@ async def _worker_main(
     window_size: int,
     N: Optional[int],
     config_file: str = None,
+    n_writers: int = 0,
 ) -> None:
+    """
+    With n_writers > 0 the shard is ingested through an IngestionPipeline,
+    so that decomposition overlaps with n_writers concurrent COPY connections.
+
+    The In/Out gates of the shard are recorded in shard_boundary under the global
+    shard index, see PandoraService.stitch_shards().
+    """
     proc_circuit = get_RSA(n=N)
     circuit_decomposed_shallow = circuit_decompose_multi(proc_circuit, N=2)
 
@@ -54,6 +66,7 @@ async def _worker_main(
     container_op_count = len(container_op_list)
     proc_start = (container_op_count * worker_id) // nprocs
     proc_end = (container_op_count * (worker_id + 1)) // nprocs
+    shard = container_id * nprocs + worker_id
 
     db = PandoraDB(config_file)
     await db.connect()
@@ -61,6 +74,22 @@ async def _worker_main(
     try:
         repo = GateRepository(db)
         builder = PandoraWindowedBuilder(window_size=window_size, label=str(worker_id))
+        id_allocator = IdBlockAllocator(db, owner=f"container {container_id} worker {worker_id}")
+
+        if n_writers > 0:
+            ops = (
+                op
+                for high_level_op in container_op_list[proc_start:proc_end]
+                for batch, _ in get_RSA_batch(circuit=high_level_op, window_size=window_size)
+                for op in batch
+            )
+
+            pipeline = IngestionPipeline(repo=repo, n_writers=n_writers, id_allocator=id_allocator)
+            stats = await pipeline.run(builder, ops)
+            print(worker_id, stats)
+
+            await repo.insert_boundary(shard=shard, boundary=builder.qubit_boundary())
+            return
 
         for i, high_level_op in enumerate(container_op_list):
             if not (proc_start <= i < proc_end):
@@ -70,12 +99,18 @@ async def _worker_main(
                 circuit=high_level_op,
                 window_size=window_size,
             ):
+                await id_allocator.top_up(builder)
+
                 for out in builder.consume(batch):
                     await repo.insert_copy(out)
+                    await id_allocator.top_up(builder)
 
+        await id_allocator.top_up(builder)
         final = builder.finalize()
         if final:
             await repo.insert_copy(final)
+
+        await repo.insert_boundary(shard=shard, boundary=builder.qubit_boundary())
     finally:
         await db.close()
 
@@ -146,6 +181,7 @@ async def _worker_main_verbose(
             window_size=window_size,
             label=worker_label,
         )
+        id_allocator = IdBlockAllocator(db, owner=f"container {container_id} worker {worker_id}")
 
         for op_idx, high_level_op in enumerate(worker_op_list):
             gen = get_RSA_batch(
@@ -170,6 +206,7 @@ async def _worker_main_verbose(
                 windows = 0
                 insert_time = 0.0
 
+                await id_allocator.top_up(builder)
                 t_builder = time.perf_counter()
 
                 for out in builder.consume(batch):
@@ -178,6 +215,7 @@ async def _worker_main_verbose(
 
                     t_insert = time.perf_counter()
                     await repo.insert_copy(out)
+                    await id_allocator.top_up(builder)
                     insert_time += time.perf_counter() - t_insert
 
                 builder_total = time.perf_counter() - t_builder
@@ -203,6 +241,7 @@ async def _worker_main_verbose(
                     "time_builder_plus_insert:", builder_total,
                 )
 
+        await id_allocator.top_up(builder)
         t_finalize = time.perf_counter()
         final = builder.finalize()
         finalize_time = time.perf_counter() - t_finalize
@@ -215,6 +254,11 @@ async def _worker_main_verbose(
             await repo.insert_copy(final)
             final_insert_time = time.perf_counter() - t_insert
 
+        await repo.insert_boundary(
+            shard=container_id * nprocs + worker_id,
+            boundary=builder.qubit_boundary(),
+        )
+
         total_insert_time += final_insert_time
         total_produced_gates += final_len
 
@@ -1,8 +1,10 @@
 import asyncio
 import csv
+import time
 from pathlib import Path
 
 from pandora.db.core import PandoraDB
+from pandora.optimisation.rewrite_compiler import RewriteTemplate
 from pandora.translation.translator import PandoraGateTranslator
 
 
@@ -12,7 +14,6 @@ class PandoraOptimiser:
     """
 
     LARGE_RUN_NR = int(1e9)
-    RESET_ID = int(5e6)
     LOG_SLEEP_FOR = 1
 
     def __init__(
@@ -28,13 +29,31 @@ class PandoraOptimiser:
         self.pass_count = pass_count
         self.logger_id = logger_id
         self.max_concurrency = max_concurrency or 32
+        # seconds from the start of the last start() to the end of its last pass that
+        # rewrote something, None if nothing was rewritten
+        self.rewrite_time: float | None = None
+        # workers per rule of the last start_adaptive(), the first allocation and one per interval
+        self.allocation_history: list[dict[str, int]] = []
 
         self._thread_proc: list[str] = []
+        # run after _thread_proc, see _call_rule()
+        self._boundary_proc: list[str] = []
+        # run next to the workers of every phase, see add_stopper()
+        self._stopper_proc: list[str] = []
+        # the queued rules, one call each, and the worker calls queued for them, see start_adaptive()
+        self._rules: list[str] = []
+        self._rule_proc: set[str] = set()
+        # the partitioned rules and their number of workers, see _check_partitions()
+        self._partitioned: list[tuple[str, int]] = []
 
     async def _execute(self, query: str) -> None:
         async with self.db.pool.acquire() as conn:
             await conn.execute(query)
 
+    async def _fetchval(self, query: str):
+        async with self.db.pool.acquire() as conn:
+            return await conn.fetchval(query)
+
     async def _execute_many(self, queries: list[str]) -> None:
         sem = asyncio.Semaphore(self.max_concurrency)
 
@@ -48,36 +67,302 @@ class PandoraOptimiser:
     def _call_thread_proc(self, thread_proc: str) -> None:
         self._thread_proc.append(thread_proc)
 
-    async def _reset_table_id(self) -> None:
-        async with self.db.pool.acquire() as conn:
-            await conn.execute(
-                """
-                SELECT setval(
-                    pg_get_serial_sequence($1, 'id'),
-                    $2,
-                    false
-                )
-                """,
-                "linked_circuit",
-                self.RESET_ID,
-            )
+    def _call_rule(
+        self,
+        procedure: str,
+        args: str,
+        dedicated_nproc: int | None,
+        partitioned: bool = False,
+    ) -> None:
+        """
+        Queue dedicated_nproc workers of a rewrite procedure.
+
+        With partitioned=True worker i only rewrites matches that lie entirely in
+        partition i of linked_circuit (see PandoraService.partition_circuit()), so the
+        workers never wait for each other's rows. The candidates of the matches that
+        cross a partition boundary are deferred to boundary_gates, a single unpinned
+        worker starts from them afterwards instead of scanning the whole table again,
+        and it ends once it ran idle (see next_candidates()). start() checks that there
+        is one worker per partition.
+        """
+        self._rules.append(f"call {procedure}({args})")
+
+        for i in range(dedicated_nproc or 0):
+            if partitioned:
+                worker = f"call {procedure}({args}, {i})"
+            else:
+                worker = f"call {procedure}({args})"
+
+            self._call_thread_proc(worker)
+            self._rule_proc.add(worker)
+
+        if partitioned and dedicated_nproc:
+            self._boundary_proc.append(f"call {procedure}({args})")
+            self._partitioned.append((f"call {procedure}({args})", dedicated_nproc))
+
+    @staticmethod
+    def _batched(
+        procedure: str,
+        args: str,
+        batch_size: int | None,
+        sample_rows: int | None = None,
+    ) -> tuple[str, str]:
+        """
+        The batched variant of a rewrite procedure, it takes batch_size and sample_rows
+        after the arguments of the per-match procedure. Sampling needs the batched
+        variant, without a batch_size a batch is the whole sample.
+        """
+        if batch_size is None and sample_rows is None:
+            return procedure, args
+
+        if sample_rows is not None and sample_rows < 1:
+            raise ValueError("sample_rows must be >= 1")
+
+        if batch_size is None:
+            batch_size = sample_rows
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+
+        sample = "null" if sample_rows is None else sample_rows
+        return f"{procedure}_batched", f"{args}, {batch_size}, {sample}"
 
     async def start(self) -> None:
         """
         Execute all queued stored procedures concurrently.
+
+        Afterwards rewrite_time leaves out the passes that only found the circuit
+        saturated, the run itself takes idle_rounds passes longer with add_stopper().
         """
         assert len(self._thread_proc) > 0
 
-        await self._reset_table_id()
-        await self._execute_many(self._thread_proc)
+        await self._check_partitions()
+        # the workers plan their candidate queries once per connection, a circuit built
+        # without bulk_load has no statistics yet
+        await self._execute("analyze linked_circuit")
+        started = await self._fetchval("select clock_timestamp()::timestamp")
+
+        if self._boundary_proc:
+            await self._execute("delete from boundary_gates")
+
+        last_rewrite = await self._run_phase(self._thread_proc)
+
+        if self._boundary_proc:
+            last_rewrite = await self._run_phase(self._boundary_proc, boundary=True) or last_rewrite
+
+        self.rewrite_time = (last_rewrite - started).total_seconds() if last_rewrite else None
         self.clear()
 
+    async def _check_partitions(self) -> None:
+        """
+        A worker pinned to a partition that does not exist finds no gates, and a partition
+        without a worker is left to the boundary pass.
+        """
+        if not self._partitioned:
+            return
+
+        async with self.db.pool.acquire() as conn:
+            is_partitioned = await conn.fetchval(
+                "SELECT relkind = 'p' FROM pg_class WHERE oid = 'linked_circuit'::regclass"
+            )
+            n_partitions = await conn.fetchval("SELECT count(*) FROM linked_circuit_partitions")
+
+        if not is_partitioned:
+            raise ValueError("linked_circuit is not partitioned, see PandoraService.partition_circuit()")
+
+        for rule, n_workers in self._partitioned:
+            if n_workers != n_partitions:
+                raise ValueError(
+                    f"{rule} has {n_workers} partitioned workers, linked_circuit has {n_partitions} partitions"
+                )
+
+    async def _run_phase(self, queries: list[str], boundary: bool = False):
+        """
+        Returns the time of the last rewrite of the phase, None if there was none.
+        """
+        await self._execute("call reset_convergence()")
+        if boundary:
+            await self._execute("update stop_condition set boundary = true")
+
+        # outside of the semaphore, the stoppers must not wait for a worker to finish
+        stoppers = asyncio.gather(*(self._execute(q) for q in self._stopper_proc))
+        try:
+            await self._execute_many(queries)
+        finally:
+            # a stopper that did not see the workers converge would wait for the timeout
+            await self._execute("update stop_condition set stop = true")
+            await stoppers
+            last_rewrite = await self._fetchval("select last_rewrite_any()")
+            await self._execute("call reset_convergence()")
+
+        return last_rewrite
+
+    async def start_adaptive(self, interval: float = 1.0) -> None:
+        """
+        Execute the queued rules with a number of workers per rule that follows their
+        rewrite rates, instead of the dedicated_nproc they were queued with.
+
+        Every interval seconds the per worker rewrite counts in rewrite_count give the
+        rewrites per worker and second of every rule. The workers of a rule with more
+        workers than its share are released (they exit after their current pass, see
+        report_pass()) and their connections go to the rules below their share. Every
+        rule keeps at least one worker, so that its rate stays known, and the rules never
+        hold more than max_concurrency connections together. The run ends after timeout
+        seconds, once a stopper sees the circuit saturated, or once the workers of all
+        rules ran their pass_count passes.
+
+        The other queued procedures (the logger) and the stoppers run next to the rules.
+        Partitioned rules run unpinned.
+        """
+        rules = list(dict.fromkeys(self._rules))
+        assert len(rules) > 0
+
+        others = [query for query in self._thread_proc if query not in self._rule_proc]
+
+        # one connection is left to the scheduler itself
+        budget = min(self.max_concurrency, self.db.max_size - len(others) - len(self._stopper_proc) - 1)
+        if budget < len(rules):
+            raise ValueError(
+                f"{len(rules)} rules need at least {len(rules)} connections, {budget} are left"
+            )
+
+        # see start()
+        await self._execute("analyze linked_circuit")
+        await self._execute("call reset_convergence()")
+        side = asyncio.gather(*(self._execute(q) for q in others + self._stopper_proc))
+
+        workers: dict[asyncio.Task, str] = {}
+        pids: dict[asyncio.Task, int] = {}
+        released: set[int] = set()
+        finished: set[str] = set()
+
+        rates = {rule: 0.0 for rule in rules}
+        allocation = self._allocate(rates, budget)
+        self.allocation_history = [allocation]
+        last_counts: dict[int, int] = {}
+        deadline = time.monotonic() + self.timeout
+
+        async def _run_worker(rule: str) -> None:
+            async with self.db.pool.acquire() as conn:
+                pids[asyncio.current_task()] = await conn.fetchval("select pg_backend_pid()")
+                await conn.execute(rule)
+
+        try:
+            while True:
+                running = [rule for task, rule in workers.items() if pids.get(task) not in released]
+                for rule, n in allocation.items():
+                    for _ in range(min(n - running.count(rule), budget - len(workers))):
+                        workers[asyncio.create_task(_run_worker(rule))] = rule
+
+                tick_start = time.monotonic()
+                if workers:
+                    done, _ = await asyncio.wait(workers, timeout=interval)
+                else:
+                    done = set()
+
+                for task in done:
+                    rule = workers.pop(task)
+                    task.result()
+
+                    # the pool hands the connection, and so the pid, to the next worker
+                    pid = pids.pop(task, None)
+                    last_counts.pop(pid, None)
+                    if pid in released:
+                        released.discard(pid)
+                    else:
+                        # a worker that was not released is out of passes, or out of time
+                        finished.add(rule)
+
+                async with self.db.pool.acquire() as conn:
+                    stop = await conn.fetchval("select stop_requested()")
+                    counts = await conn.fetch("select proc_id, count from rewrite_count")
+
+                if stop or time.monotonic() > deadline or (not workers and finished.issuperset(rules)):
+                    break
+
+                elapsed = max(time.monotonic() - tick_start, 1e-3)
+                rule_of = {pid: workers[task] for task, pid in pids.items() if task in workers}
+                rewrites = {rule: 0 for rule in rules}
+                for row in counts:
+                    if row["proc_id"] in rule_of:
+                        rewrites[rule_of[row["proc_id"]]] += max(row["count"] - last_counts.get(row["proc_id"], 0), 0)
+                last_counts = {row["proc_id"]: row["count"] for row in counts}
+
+                for rule in rules:
+                    n_workers = sum(1 for r in rule_of.values() if r == rule)
+                    if n_workers > 0:
+                        # rewrites per worker and second, smoothed over the last intervals
+                        rates[rule] = 0.5 * rates[rule] + 0.5 * rewrites[rule] / (n_workers * elapsed)
+
+                allocation = self._allocate({rule: rates[rule] for rule in rules if rule not in finished}, budget)
+                self.allocation_history.append(allocation)
+
+                release = []
+                for rule, n in allocation.items():
+                    registered = [
+                        pid for pid, r in rule_of.items()
+                        if r == rule and pid not in released and pid in last_counts
+                    ]
+                    release += registered[:max(len(registered) - n, 0)]
+
+                if release:
+                    released.update(release)
+                    await self._execute(
+                        "update rewrite_count set release = true "
+                        f"where proc_id = any(array[{', '.join(map(str, release))}])"
+                    )
+        finally:
+            await self._execute("update stop_condition set stop = true")
+            await asyncio.gather(*workers, return_exceptions=True)
+            await side
+            await self._execute("call reset_convergence()")
+
+        self.clear()
+
+    @staticmethod
+    def _allocate(rates: dict[str, float], budget: int) -> dict[str, int]:
+        """
+        Split budget workers over the rules: one each, the rest in proportion to their
+        rates (evenly while no rule rewrites anything), rounded by largest remainder.
+        """
+        if not rates:
+            return {}
+
+        spare = budget - len(rates)
+        total = sum(rates.values())
+
+        if total > 0:
+            shares = {rule: spare * rate / total for rule, rate in rates.items()}
+        else:
+            shares = {rule: spare / len(rates) for rule in rates}
+
+        allocation = {rule: 1 + int(share) for rule, share in shares.items()}
+
+        left = budget - sum(allocation.values())
+        for rule in sorted(shares, key=lambda r: shares[r] - int(shares[r]), reverse=True)[:left]:
+            allocation[rule] += 1
+
+        return allocation
+
     def clear(self) -> None:
         self._thread_proc.clear()
+        self._boundary_proc.clear()
+        self._stopper_proc.clear()
+        self._rules.clear()
+        self._rule_proc.clear()
+        self._partitioned.clear()
+
+    def add_stopper(self, idle_rounds: int = 2) -> None:
+        """
+        Stop all workers as soon as the circuit is saturated, instead of after pass_count
+        passes or timeout seconds: once every worker ran idle_rounds passes without a
+        rewrite that all started after the last rewrite of any worker.
+        Workers that wait for a free connection (see max_concurrency) are not accounted for,
+        sampling workers never count as idle (see cancel_single_qubit_gates()).
+        """
+        if idle_rounds < 1:
+            raise ValueError("idle_rounds must be >= 1")
 
-    def add_stopper(self) -> None:
-        stopper = f"call stopper({self.timeout})"
-        self._call_thread_proc(stopper)
+        self._stopper_proc.append(f"call stopper({self.timeout}, {idle_rounds})")
 
     def log(self) -> None:
         logger_proc = (
@@ -127,35 +412,54 @@ class PandoraOptimiser:
         gate_types: tuple[PandoraGateTranslator, PandoraGateTranslator],
         gate_params: tuple[float, float] = (1.0, 1.0),
         dedicated_nproc: int | None = None,
+        partitioned: bool = False,
+        batch_size: int | None = None,
+        sample_rows: int | None = None,
     ) -> None:
+        """
+        With batch_size set, every transaction of a worker rewrites up to batch_size
+        non-overlapping matches instead of one (cancel_single_qubit_batched.sql).
+
+        With sample_rows set, every pass of a worker looks for matches in sample_rows
+        gates drawn at random places of linked_circuit (tablesample system_rows) instead
+        of scanning it. A sampling pass without matches does not mean that the circuit is
+        saturated, so add_stopper() never stops a run with sampling workers, it ends after
+        pass_count passes or timeout seconds.
+        """
         type_left, type_right = gate_types
         param_left, param_right = gate_params
 
-        for _ in range(dedicated_nproc or 0):
-            stored_procedure = (
-                f"call cancel_single_qubit("
-                f"{type_left.value}, {type_right.value}, "
-                f"{param_left}, {param_right}, "
-                f"{self.pass_count}, {self.timeout})"
-            )
-            self._call_thread_proc(stored_procedure)
+        args = (
+            f"{type_left.value}, {type_right.value}, "
+            f"{param_left}, {param_right}, "
+            f"{self.pass_count}, {self.timeout}"
+        )
+        self._call_rule(
+            *self._batched("cancel_single_qubit", args, batch_size, sample_rows), dedicated_nproc, partitioned
+        )
 
     def cancel_two_qubit_gates(
         self,
         gate_types: tuple[PandoraGateTranslator, PandoraGateTranslator],
         gate_param: float = 1.0,
         dedicated_nproc: int | None = None,
+        partitioned: bool = False,
+        batch_size: int | None = None,
+        sample_rows: int | None = None,
     ) -> None:
+        """
+        batch_size and sample_rows as in cancel_single_qubit_gates().
+        """
         type_left, type_right = gate_types
 
-        for _ in range(dedicated_nproc or 0):
-            stored_procedure = (
-                f"call cancel_two_qubit("
-                f"{type_left.value}, {type_right.value}, "
-                f"{gate_param}, {gate_param}, "
-                f"{self.pass_count}, {self.timeout})"
-            )
-            self._call_thread_proc(stored_procedure)
+        args = (
+            f"{type_left.value}, {type_right.value}, "
+            f"{gate_param}, {gate_param}, "
+            f"{self.pass_count}, {self.timeout}"
+        )
+        self._call_rule(
+            *self._batched("cancel_two_qubit", args, batch_size, sample_rows), dedicated_nproc, partitioned
+        )
 
     def cancel_two_qubit_gates_equiv(
         self,
@@ -175,27 +479,21 @@ class PandoraOptimiser:
             )
             self._call_thread_proc(stored_procedure)
 
-    def hhcxhh_to_cx(self, 
-                     dedicated_nproc: int | None = None, 
-                     run_multiple: bool | None = False) -> None:
-        
-        for i in range(dedicated_nproc or 0):
-            if run_multiple:
-                stored_procedure = (
-                    f"call linked_hhcxhh_to_cx({i}, {self.pass_count}, {self.timeout})"
-                )
-            else:
-                stored_procedure = (
-                    f"call linked_hhcxhh_to_cx({self.pass_count}, {self.timeout})"
-                )   
-            self._call_thread_proc(stored_procedure)
+    def hhcxhh_to_cx(
+        self,
+        dedicated_nproc: int | None = None,
+        partitioned: bool = False,
+    ) -> None:
+        args = f"{self.pass_count}, {self.timeout}"
+        self._call_rule("linked_hhcxhh_to_cx", args, dedicated_nproc, partitioned)
 
-    def cx_to_hhcxhh(self, dedicated_nproc: int | None = None) -> None:
-        for _ in range(dedicated_nproc or 0):
-            stored_procedure = (
-                f"call linked_cx_to_hhcxhh({self.pass_count}, {self.timeout})"
-            )
-            self._call_thread_proc(stored_procedure)
+    def cx_to_hhcxhh(
+        self,
+        dedicated_nproc: int | None = None,
+        partitioned: bool = False,
+    ) -> None:
+        args = f"{self.pass_count}, {self.timeout}"
+        self._call_rule("linked_cx_to_hhcxhh", args, dedicated_nproc, partitioned)
 
     def fuse_single_qubit_gates(
         self,
@@ -206,29 +504,56 @@ class PandoraOptimiser:
         ],
         gate_params: tuple[float, float, float] = (1.0, 1.0, 1.0),
         dedicated_nproc: int | None = None,
+        partitioned: bool = False,
     ) -> None:
         type_left, type_right, type_result = gate_types
         param_left, param_right, param_result = gate_params
 
-        for _ in range(dedicated_nproc or 0):
-            stored_procedure = (
-                f"call fuse_single_qubit("
-                f"{type_left.value}, {type_right.value}, {type_result.value}, "
-                f"{param_left}, {param_right}, {param_result}, "
-                f"{self.pass_count}, {self.timeout})"
-            )
-            self._call_thread_proc(stored_procedure)
+        args = (
+            f"{type_left.value}, {type_right.value}, {type_result.value}, "
+            f"{param_left}, {param_right}, {param_result}, "
+            f"{self.pass_count}, {self.timeout}"
+        )
+        self._call_rule("fuse_single_qubit", args, dedicated_nproc, partitioned)
 
     def commute_rotation_with_control_left(
         self,
         gate_type: PandoraGateTranslator,
         gate_param: float = 1.0,
         dedicated_nproc: int | None = None,
+        partitioned: bool = False,
     ) -> None:
-        for _ in range(dedicated_nproc or 0):
-            stored_procedure = (
-                f"call commute_single_control_left("
-                f"{gate_type.value}, {gate_param}, "
-                f"{self.pass_count}, {self.timeout})"
-            )
-            self._call_thread_proc(stored_procedure)
+        args = (
+            f"{gate_type.value}, {gate_param}, "
+            f"{self.pass_count}, {self.timeout}"
+        )
+        self._call_rule("commute_single_control_left", args, dedicated_nproc, partitioned)
+
+    def decompose_toffolis(
+        self,
+        dedicated_nproc: int | None = None,
+        partitioned: bool = False,
+        batch_size: int = 1000,
+    ) -> None:
+        """
+        Queue workers that replace the Toffolis by their Clifford+T decomposition,
+        batch_size Toffolis per transaction (toffoli_decomposition.sql).
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+
+        args = f"{self.pass_count}, {self.timeout}, {batch_size}"
+        self._call_rule("linked_toffoli_decomp", args, dedicated_nproc, partitioned)
+
+    def apply_rewrite(
+        self,
+        template: RewriteTemplate,
+        dedicated_nproc: int | None = None,
+        partitioned: bool = False,
+    ) -> None:
+        """
+        Queue workers of a compiled rewrite template, it has to be installed first
+        (PandoraService(rewrites=...) or PandoraService.install_rewrite()).
+        """
+        args = f"{self.pass_count}, {self.timeout}"
+        self._call_rule(template.name, args, dedicated_nproc, partitioned)
@@ -0,0 +1,482 @@
+"""
+Compiler from declarative rewrite templates to plpgsql rewrite procedures.
+
+A template is a small circuit on n_qubits wires (the left-hand side), and the circuit it is
+replaced with (the right-hand side) on the same wires. Port i of a template gate is the i-th
+wire in its qubits, as in the link format of linked_circuit. For example
+
+    RewriteTemplate(
+        name="hhcxhh_to_xc",
+        n_qubits=2,
+        lhs=[
+            TemplateGate(H, (0,)), TemplateGate(H, (1,)),
+            TemplateGate(CX, (0, 1)),
+            TemplateGate(H, (0,)), TemplateGate(H, (1,)),
+        ],
+        rhs=[TemplateGate(CX, (1, 0))],
+    )
+
+compile_rewrite() emits a procedure with the same interface as the hand-written rules
+(pass_count, timeout, my_partition) that takes part in the fixed-point detection of
+convergence.sql and in the dirty_gates queue. For every candidate it
+
+    1. follows the links from the anchor gate to read the match without locking it,
+    2. locks the match and its neighbours with one query in id order, skipping locked rows,
+    3. reads the match again and checks every gate and internal link,
+    4. reuses the matched rows for right-hand side gates of the same arity, deletes or
+       inserts the rest and relinks the neighbours with set_next_link()/set_prev_link().
+
+The anchor is the left-hand side gate whose type, parameter and neighbour types select the
+fewest rows, the compiled partial index covers exactly the candidate query.
+"""
+import re
+from collections import deque
+from dataclasses import dataclass
+
+from pandora.translation.translator import PandoraGateTranslator, MAX_QUBITS_PER_GATE
+
+# columns with decoded link types, see _sql_generate_table.sql
+DECODED_PORTS = 2
+
+
+@dataclass(frozen=True)
+class TemplateGate:
+    type: PandoraGateTranslator
+    qubits: tuple[int, ...]
+    param: float = 1.0
+
+
+@dataclass
+class RewriteTemplate:
+    name: str
+    n_qubits: int
+    lhs: list[TemplateGate]
+    rhs: list[TemplateGate]
+
+    def __post_init__(self):
+        if not re.fullmatch(r"[a-z_][a-z0-9_]*", self.name):
+            raise ValueError("name must be a lower case identifier")
+        if not self.lhs:
+            raise ValueError("the left-hand side has no gates")
+
+        for gate in self.lhs + self.rhs:
+            if gate.type in (PandoraGateTranslator.In, PandoraGateTranslator.Out):
+                raise ValueError("templates cannot contain In or Out gates")
+            if not 1 <= len(gate.qubits) <= MAX_QUBITS_PER_GATE:
+                raise ValueError(f"gates act on 1 to {MAX_QUBITS_PER_GATE} qubits")
+            if len(set(gate.qubits)) != len(gate.qubits):
+                raise ValueError("a gate acts on the same qubit twice")
+            if not all(0 <= q < self.n_qubits for q in gate.qubits):
+                raise ValueError("qubit out of range")
+
+        lhs_wires = {q for gate in self.lhs for q in gate.qubits}
+        if lhs_wires != set(range(self.n_qubits)):
+            raise ValueError("the left-hand side has to act on every qubit")
+
+        if len(_components(self.lhs)) != 1:
+            raise ValueError("the left-hand side has to be connected")
+
+
+@dataclass
+class CompiledRewrite:
+    name: str
+    procedure: str
+    index: str
+    # the candidate gate is at most this many links away from any gate of a match
+    radius: int
+
+
+# (gate, port) on every wire, in circuit order
+Chains = dict[int, list[tuple[int, int]]]
+
+
+def _chains(gates: list[TemplateGate]) -> Chains:
+    chains: Chains = {}
+    for i, gate in enumerate(gates):
+        for port, q in enumerate(gate.qubits):
+            chains.setdefault(q, []).append((i, port))
+    return chains
+
+
+def _neighbours(gates: list[TemplateGate]) -> tuple[dict, dict]:
+    """
+    (gate, port) -> (gate, port) of the previous and of the next gate on the same wire,
+    for the links inside the template.
+    """
+    prev, next_ = {}, {}
+    for chain in _chains(gates).values():
+        for left, right in zip(chain, chain[1:]):
+            next_[left] = right
+            prev[right] = left
+    return prev, next_
+
+
+def _components(gates: list[TemplateGate]) -> list[set[int]]:
+    prev, _ = _neighbours(gates)
+    parent = list(range(len(gates)))
+
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for (i, _), (j, _) in prev.items():
+        parent[find(i)] = find(j)
+
+    components: dict[int, set[int]] = {}
+    for i in range(len(gates)):
+        components.setdefault(find(i), set()).add(i)
+    return list(components.values())
+
+
+def _sql_float(value: float) -> str:
+    return f"{float(value)!r}::real"
+
+
+def _candidate_predicates(template: RewriteTemplate, anchor: int) -> list[str]:
+    gates = template.lhs
+    prev, next_ = _neighbours(gates)
+    gate = gates[anchor]
+
+    predicates = [f"type = {gate.type.value}", f"param = {_sql_float(gate.param)}"]
+
+    for port in range(min(len(gate.qubits), DECODED_PORTS)):
+        if (anchor, port) in prev:
+            j, _ = prev[(anchor, port)]
+            predicates.append(f"prev_q{port + 1}_type = {gates[j].type.value}")
+        if (anchor, port) in next_:
+            j, _ = next_[(anchor, port)]
+            predicates.append(f"next_q{port + 1}_type = {gates[j].type.value}")
+
+    # e.g. two CX in a row
+    if all((anchor, port) in next_ for port in range(DECODED_PORTS)) \
+            and next_[(anchor, 0)][0] == next_[(anchor, 1)][0]:
+        predicates.append("next_q1_id = next_q2_id")
+
+    return predicates
+
+
+def _choose_anchor(template: RewriteTemplate) -> int:
+    # more predicates select fewer rows, the earliest gate on ties
+    return max(range(len(template.lhs)), key=lambda i: (len(_candidate_predicates(template, i)), -i))
+
+
+def _discovery_order(template: RewriteTemplate, anchor: int) -> tuple[list[str], int]:
+    """
+    Statements that read the left-hand side gates g0, g1, ... starting from the anchor,
+    following the links of the template, and the largest distance from the anchor.
+    """
+    prev, next_ = _neighbours(template.lhs)
+
+    statements = []
+    distance = {anchor: 0}
+    queue = deque([anchor])
+
+    while queue:
+        i = queue.popleft()
+        for port in range(len(template.lhs[i].qubits)):
+            for links, column in ((next_, "next"), (prev, "prev")):
+                if (i, port) not in links:
+                    continue
+                j, _ = links[(i, port)]
+                if j in distance:
+                    continue
+
+                distance[j] = distance[i] + 1
+                queue.append(j)
+                statements.append(
+                    f"select * into g{j} from linked_circuit "
+                    f"where id = get_id_from_link(g{i}.{column}_q{port + 1});"
+                )
+
+    return statements, max(distance.values())
+
+
+def _match_checks(template: RewriteTemplate) -> list[str]:
+    gates = template.lhs
+    prev, next_ = _neighbours(gates)
+
+    checks = []
+    for i, gate in enumerate(gates):
+        checks.append(f"g{i}.type = {gate.type.value}")
+        checks.append(f"g{i}.param = {_sql_float(gate.param)}")
+
+        for port in range(len(gate.qubits)):
+            for links, column in ((next_, "next"), (prev, "prev")):
+                if (i, port) in links:
+                    j, port_j = links[(i, port)]
+                    checks.append(f"g{i}.{column}_q{port + 1} = create_link(g{j}.id, {port_j}, g{j}.type)")
+
+    return checks
+
+
+def _boundary(template: RewriteTemplate) -> tuple[dict[int, str], dict[int, str]]:
+    """
+    Per wire, the expressions of the links from the left-hand side to the gates before and
+    after it.
+    """
+    before, after = {}, {}
+    for q, chain in _chains(template.lhs).items():
+        first, first_port = chain[0]
+        last, last_port = chain[-1]
+        before[q] = f"g{first}.prev_q{first_port + 1}"
+        after[q] = f"g{last}.next_q{last_port + 1}"
+    return before, after
+
+
+def _reuse(template: RewriteTemplate) -> dict[int, int]:
+    """
+    Right-hand side gate -> left-hand side gate whose row it takes over. Rows are only
+    reused for gates of the same arity, first for the same type on the same wires.
+    """
+    reused: dict[int, int] = {}
+    free = list(range(len(template.lhs)))
+
+    preferences = [
+        lambda l, r: l.type == r.type and l.qubits == r.qubits,
+        lambda l, r: l.type == r.type and len(l.qubits) == len(r.qubits),
+        lambda l, r: len(l.qubits) == len(r.qubits),
+    ]
+    for same in preferences:
+        for j, gate in enumerate(template.rhs):
+            if j in reused:
+                continue
+            for i in free:
+                if same(template.lhs[i], gate):
+                    reused[j] = i
+                    free.remove(i)
+                    break
+
+    return reused
+
+
+def _rewrite_statements(template: RewriteTemplate, anchor: int) -> tuple[list[str], list[str]]:
+    """
+    The statements that replace the match with the right-hand side, and the expressions of
+    the ids whose links change (for the dirty_gates queue).
+    """
+    lhs, rhs = template.lhs, template.rhs
+    before, after = _boundary(template)
+    reused = _reuse(template)
+    rhs_chains = _chains(rhs)
+
+    statements = []
+
+    for j in range(len(rhs)):
+        if j in reused:
+            statements.append(f"r{j}_id := g{reused[j]}.id;")
+        else:
+            statements.append(f"r{j}_id := next_gate_id();")
+
+    def link_to(j: int, port: int) -> str:
+        return f"create_link(r{j}_id, {port}, {rhs[j].type.value}::smallint)"
+
+    # links of the right-hand side gates, per port
+    prev_links: dict[tuple[int, int], str] = {}
+    next_links: dict[tuple[int, int], str] = {}
+    for q in range(template.n_qubits):
+        chain = rhs_chains.get(q, [])
+        for k, (j, port) in enumerate(chain):
+            prev_links[(j, port)] = before[q] if k == 0 else link_to(*chain[k - 1])
+            next_links[(j, port)] = after[q] if k == len(chain) - 1 else link_to(*chain[k + 1])
+
+    deleted = [f"g{i}.id" for i in range(len(lhs)) if i not in reused.values()]
+    if deleted:
+        statements.append(f"delete from linked_circuit where id in ({', '.join(deleted)});")
+
+    for j, gate in enumerate(rhs):
+        ports = range(MAX_QUBITS_PER_GATE)
+        prevs = [prev_links.get((j, port), "null") for port in ports]
+        nexts = [next_links.get((j, port), "null") for port in ports]
+        values = ", ".join([str(gate.type.value), _sql_float(gate.param), *prevs, *nexts])
+
+        if j in reused:
+            statements.append(
+                "update linked_circuit set (type, param, prev_q1, prev_q2, prev_q3, next_q1, next_q2, next_q3)\n"
+                f"    = ({values}) where id = r{j}_id;"
+            )
+        else:
+            statements.append(
+                "insert into linked_circuit (id, type, param, prev_q1, prev_q2, prev_q3, next_q1, next_q2, next_q3, switch, label)\n"
+                f"    values (r{j}_id, {values}, false, g{anchor}.label);"
+            )
+
+    # the gates around the match point into the right-hand side, or to each other if a wire is left empty
+    for q in range(template.n_qubits):
+        chain = rhs_chains.get(q, [])
+        into_first = link_to(*chain[0]) if chain else after[q]
+        into_last = link_to(*chain[-1]) if chain else before[q]
+
+        statements.append(
+            f"perform set_next_link(get_id_from_link({before[q]}), get_port_from_link({before[q]})::int, {into_first});"
+        )
+        statements.append(
+            f"perform set_prev_link(get_id_from_link({after[q]}), get_port_from_link({after[q]})::int, {into_last});"
+        )
+
+    dirty = [f"get_id_from_link({link})" for q in range(template.n_qubits) for link in (before[q], after[q])]
+    dirty += [f"r{j}_id" for j in range(len(rhs))]
+
+    return statements, dirty
+
+
+def _indent(lines: list[str], depth: int) -> str:
+    pad = "    " * depth
+    return "\n".join(
+        pad + line.replace("\n", "\n" + pad) if line else ""
+        for line in lines
+    )
+
+
+def compile_rewrite(template: RewriteTemplate) -> CompiledRewrite:
+    lhs, rhs = template.lhs, template.rhs
+    name = template.name
+
+    anchor = _choose_anchor(template)
+    predicates = _candidate_predicates(template, anchor)
+    discovery, depth = _discovery_order(template, anchor)
+    checks = _match_checks(template)
+    before, after = _boundary(template)
+    rewrite, dirty = _rewrite_statements(template, anchor)
+
+    lhs_ids = ", ".join(f"g{i}.id" for i in range(len(lhs)))
+    outside_ids = ", ".join(
+        f"get_id_from_link({link})" for q in range(template.n_qubits) for link in (before[q], after[q])
+    )
+
+    declarations = [f"g{i} record;" for i in range(len(lhs))]
+    declarations += [f"r{j}_id bigint;" for j in range(len(rhs))]
+
+    read_match = [
+        f"select * into g{anchor} from linked_circuit where id = gate.id;",
+        *discovery,
+        "",
+        f"match_ids := array[{lhs_ids}];",
+        f"outside_ids := array[{outside_ids}];",
+        "",
+        "if not coalesce(",
+        "    " + "\n    and ".join(checks),
+        "    -- the gates around the match are not part of it",
+        "    and not (match_ids && outside_ids),",
+        "    false)",
+        "then",
+        "    commit;",
+        "    continue;",
+        "end if;",
+        "",
+        "if not ids_in_range(match_ids || outside_ids, part_lo, part_hi) then",
+        "    perform defer_to_boundary(array[gate.id]);",
+        "    commit;",
+        "    continue;",
+        "end if;",
+    ]
+
+    predicate_sql = "\n                and ".join(predicates)
+
+    procedure = f"""drop procedure if exists {name}(int, int, int);
+
+-- compiled by pandora.optimisation.rewrite_compiler, do not edit
+create or replace procedure {name}(pass_count int, timeout int, my_partition int default null)
+    language plpgsql
+as
+$$
+declare
+    gate record;
+{_indent(declarations, 1)}
+
+    match_ids bigint[];
+    outside_ids bigint[];
+    locked_ids bigint[];
+
+    start_time timestamp;
+    pass_start timestamp;
+    rewrites int;
+    stop boolean := false;
+
+    queue text;
+    candidates bigint[];
+    last_full_scan timestamp;
+
+    part_lo bigint;
+    part_hi bigint;
+
+begin
+    start_time := clock_timestamp();
+    queue := format('{name}(%s)', my_partition);
+    call start_passes(queue);
+
+    select lo, hi into part_lo, part_hi from partition_bounds(my_partition);
+
+    while pass_count > 0 loop
+        pass_start := clock_timestamp();
+        rewrites := 0;
+
+        candidates := next_candidates(queue, last_full_scan, {depth});
+        if candidates is null then
+            last_full_scan := pass_start;
+        end if;
+
+        for gate in
+            select id from linked_circuit
+            where {predicate_sql}
+                and id >= part_lo and id < part_hi
+                and candidates is null
+            union all
+            select id from linked_circuit
+            where {predicate_sql}
+                and id >= part_lo and id < part_hi
+                and id = any(candidates)
+        loop
+            -- read without locks
+{_indent(read_match, 3)}
+
+            -- lock in id order, so that concurrent workers never wait on each other in a cycle
+            select array_agg(l.id) into locked_ids from (
+                select id from linked_circuit
+                where id = any(match_ids || outside_ids)
+                order by id
+                for update skip locked
+            ) l;
+
+            if not coalesce((match_ids || outside_ids) <@ locked_ids, false) then
+                commit;
+                continue;
+            end if;
+
+            -- the match may have changed before it was locked
+{_indent(read_match, 3)}
+
+            if not coalesce((match_ids || outside_ids) <@ locked_ids, false) then
+                commit;
+                continue;
+            end if;
+
+{_indent(rewrite, 3)}
+
+            perform enqueue_dirty_gates(array[{", ".join(dirty)}]);
+            rewrites := rewrites + 1;
+            commit;
+
+        end loop; -- end gate loop
+
+        call report_pass(pass_start, rewrites, stop);
+        exit when stop; -- saturated, see stopper()
+
+        if extract(epoch from (clock_timestamp() - start_time)) > timeout then
+            exit;
+        end if;
+
+        pass_count = pass_count - 1;
+
+    end loop; -- end pass loop
+
+    call finish_passes();
+end;$$;
+"""
+
+    index = (
+        f"CREATE INDEX IF NOT EXISTS {name}_candidates_idx on linked_circuit(id)\n"
+        f"where {' and '.join(predicates)}"
+    )
+
+    return CompiledRewrite(name=name, procedure=procedure, index=index, radius=depth)
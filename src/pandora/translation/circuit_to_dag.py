@@ -1,23 +1,31 @@
+from collections import deque
 from typing import Iterator, Union, Iterable
 
 import cirq
+import numpy as np
 import qiskit
 
 from pandora.exceptions.exceptions import (
+    GateIdsExhausted,
     WindowSizeError,
     WrongPandoraBuilderInput,
 )
 from pandora.translation.cirq_translator import CirqToPandoraTranslator
 from pandora.translation.qiskit_translator import QiskitToPandoraTranslator
+from pandora.translation.named_op import NamedOpTranslator
+from pandora.translation.qasm_reader import QasmReader
+from pandora.translation.quipper_reader import QuipperReader
 
 from pandora.translation.translator import (
     PandoraGateTranslator,
     MAX_QUBITS_PER_GATE,
-    SINGLE_QUBIT_GATES,
-    TWO_QUBIT_GATES,
 )
 
-from pandora.translation.gates import PandoraGate
+from pandora.translation.gates import (
+    PandoraGate,
+    PANDORA_GATE_DTYPE,
+    NULL_LINK,
+)
 from pandora.translation.link import LinkID
 
 
@@ -29,6 +37,13 @@ class PandoraWindowedBuilder:
         - streaming batches
 
     It maintains state across calls and can emit gates in windows.
+
+    Only the live frontier is kept in memory: a gate is dropped from
+    self.gates as soon as all its next_q* links are set and it is emitted,
+    so memory is O(qubits + window) regardless of the circuit size.
+
+    Gate ids count from 0 unless id blocks are added with add_id_block()
+    (see IdBlockAllocator), in which case ids are taken from the blocks only.
     """
 
     def __init__(self, label=None, window_size: int = 1000):
@@ -39,18 +54,27 @@ class PandoraWindowedBuilder:
         self.window_size = window_size
 
         self.last_id = 0
+        # end of the current id block, None while counting freely from 0
+        self.id_limit: int | None = None
+        self.id_blocks: deque[range] = deque()
+        # gates that are still missing outgoing links
         self.gates: dict[int, PandoraGate] = {}
+        # number of next_q* links each of them is still waiting for, one per qubit of its op
+        # (the gate type does not tell, a measurement can act on several qubits)
+        self.missing_links: dict[int, int] = {}
         self.latest = {}
+        # In and Out gate id of every qubit, used to stitch shards built by separate builders
+        self.inputs = {}
+        self.outputs = {}
 
         self.buffer: list[PandoraGate] = []
-        self.emitted_ids: set[int] = set()
 
         self.meas_key_dict = {}
         self.translator = None
 
     def consume(
         self,
-        data: Union[qiskit.QuantumCircuit, cirq.Circuit, Iterable],
+        data: Union[qiskit.QuantumCircuit, cirq.Circuit, QuipperReader, QasmReader, Iterable],
     ) -> Iterator[list[PandoraGate]]:
         ops = self._normalize_input(data)
 
@@ -66,21 +90,23 @@ class PandoraWindowedBuilder:
 
     def _normalize_input(
         self,
-        data: Union[qiskit.QuantumCircuit, cirq.Circuit, Iterable],
+        data: Union[qiskit.QuantumCircuit, cirq.Circuit, QuipperReader, QasmReader, Iterable],
     ) -> Iterable:
         if isinstance(data, cirq.Circuit):
-            self.translator = CirqToPandoraTranslator()
-            return data.all_operations()
-
-        if isinstance(data, qiskit.QuantumCircuit):
-            self.translator = QiskitToPandoraTranslator()
-            return data.data
-
-        if isinstance(data, Iterable):
-            self.translator = CirqToPandoraTranslator()
-            return data
-
-        raise WrongPandoraBuilderInput
+            self.translator, ops = CirqToPandoraTranslator(), data.all_operations()
+        elif isinstance(data, qiskit.QuantumCircuit):
+            self.translator, ops = QiskitToPandoraTranslator(), data.data
+        elif isinstance(data, (QuipperReader, QasmReader)):
+            self.translator, ops = NamedOpTranslator(), data
+        elif isinstance(data, Iterable):
+            self.translator, ops = CirqToPandoraTranslator(), data
+        else:
+            raise WrongPandoraBuilderInput
+
+        # the measurement keys are numbered in the dict of the builder, which keeps them across
+        # consume() calls and can be seeded with the numbers of a whole circuit (see parallel_build)
+        self.translator.meas_key_dict = self.meas_key_dict
+        return ops
 
     @staticmethod
     def _get_qubits(op) -> tuple:
@@ -95,10 +121,15 @@ class PandoraWindowedBuilder:
 
         self._set_prev(gate, op)
         completed = self._set_next(gate, op, gate_id)
-
-        self.gates[gate_id] = gate
         self.buffer.extend(completed)
 
+        n_qubits = len(self._get_qubits(op))
+        if n_qubits == 0:
+            self.buffer.append(gate)
+        else:
+            self.gates[gate_id] = gate
+            self.missing_links[gate_id] = n_qubits
+
     def _ensure_inputs(self, op) -> None:
         for q in self._get_qubits(op):
             if q in self.latest:
@@ -112,17 +143,20 @@ class PandoraWindowedBuilder:
                 gate_code=in_type,
                 label=self.label,
             )
+            self.missing_links[gid] = 1
 
             self.latest[q] = LinkID.encode(gid, 0, in_type)
+            self.inputs[q] = gid
 
-    @staticmethod
-    def _is_complete(g: PandoraGate):
-        if g.type in SINGLE_QUBIT_GATES:
-            return g.next_q1 is not None
-
-        if g.type in TWO_QUBIT_GATES:
-            return g.next_q1 is not None and g.next_q2 is not None
+    def _link_set(self, gate_id: int) -> bool:
+        """
+        Count a next_q* link of a live gate as set, True once all of them are.
+        """
+        self.missing_links[gate_id] -= 1
+        if self.missing_links[gate_id] > 0:
+            return False
 
+        del self.missing_links[gate_id]
         return True
 
     def _set_prev(self, gate: PandoraGate, op) -> None:
@@ -133,10 +167,10 @@ class PandoraWindowedBuilder:
 
         gate.prev_q1, gate.prev_q2, gate.prev_q3 = prev
 
-    def _emit_once(self, gate: PandoraGate) -> None:
-        if gate.id not in self.emitted_ids:
-            self.buffer.append(gate)
-            self.emitted_ids.add(gate.id)
+    def _emit(self, gate: PandoraGate) -> None:
+        self.buffer.append(gate)
+        self.gates.pop(gate.id, None)
+        self.missing_links.pop(gate.id, None)
 
     def _set_next(self, gate: PandoraGate, op, gate_id: int):
         completed = []
@@ -151,17 +185,18 @@ class PandoraWindowedBuilder:
             new_link = LinkID.encode(gate_id, idx, gate.type)
             setattr(prev_gate, f"next_q{prev_port + 1}", new_link)
 
-            if self._is_complete(prev_gate) and prev_gate.id not in self.emitted_ids:
+            if self._link_set(prev_id):
                 completed.append(prev_gate)
-                self.emitted_ids.add(prev_gate.id)
+                del self.gates[prev_id]
 
             self.latest[q] = new_link
 
         return completed
 
     def _append_out_gates(self) -> None:
-        for _, last_link in self.latest.items():
+        for q, last_link in self.latest.items():
             gid = self._new_id()
+            self.outputs[q] = gid
             out_type = PandoraGateTranslator.Out.value
 
             out_gate = PandoraGate(
@@ -178,19 +213,253 @@ class PandoraWindowedBuilder:
             setattr(prev_gate, f"next_q{prev_port + 1}", next_link)
 
             out_gate.prev_q1 = last_link
-            self.gates[gid] = out_gate
 
-            if self._is_complete(prev_gate):
-                self._emit_once(prev_gate)
+            if self._link_set(prev_id):
+                self._emit(prev_gate)
 
-            self._emit_once(out_gate)
+            self._emit(out_gate)
 
     def _flush(self) -> list[PandoraGate]:
         out = self.buffer
         self.buffer = []
         return out
 
+    def qubit_boundary(self) -> list[tuple[str, int, int]]:
+        """
+        (qubit, In gate id, Out gate id) for every qubit, available after finalize().
+        """
+        return [(str(q), gid, self.outputs[q]) for q, gid in self.inputs.items()]
+
+    def add_id_block(self, block: range) -> None:
+        """
+        Queue a block of reserved ids, blocks have to be added in increasing order.
+        The first block replaces the default ids from 0, so it has to be added before
+        any gate is built.
+        """
+        if self.id_limit is None:
+            assert self.last_id == 0, "id blocks have to be added before the first gate"
+            # the first _new_id() switches to the block
+            self.id_limit = 0
+
+        self.id_blocks.append(block)
+
+    def ids_left(self) -> int:
+        if self.id_limit is None:
+            return 0
+        return self.id_limit - self.last_id + sum(len(b) for b in self.id_blocks)
+
     def _new_id(self) -> int:
+        if self.id_limit is not None and self.last_id >= self.id_limit:
+            self._next_id_block()
+
         gid = self.last_id
         self.last_id += 1
         return gid
+
+    def _next_id_block(self) -> None:
+        if not self.id_blocks:
+            raise GateIdsExhausted
+
+        block = self.id_blocks.popleft()
+        self.last_id = block.start
+        self.id_limit = block.stop
+
+
+class PandoraColumnarBuilder(PandoraWindowedBuilder):
+    """
+    Columnar variant of PandoraWindowedBuilder.
+
+    Gates are written in place into a preallocated PANDORA_GATE_DTYPE array
+    instead of being allocated as PandoraGate objects, and every window is
+    emitted as a structured NumPy array ready for GateRepository.insert_columns().
+
+    Gates that still wait for a next_q* link when a window is flushed
+    (at most one per qubit) are carried over to the front of the next window.
+    """
+
+    def __init__(self, label=None, window_size: int = 1000):
+        super().__init__(label=label, window_size=window_size)
+
+        self.rows = np.empty(window_size, dtype=PANDORA_GATE_DTYPE)
+        # number of next_q* links each row is still waiting for
+        self.missing = bytearray(window_size)
+        self.n_rows = 0
+        self.n_complete = 0
+
+        # rows carried over from the previous window, by gate id
+        self.carried: dict[int, int] = {}
+        # gates created in the current window have contiguous rows starting at this id
+        self.base_id = 0
+
+        self._label = "" if label is None else str(label)
+        self._bind_columns()
+
+    def consume(
+        self,
+        data: Union[qiskit.QuantumCircuit, cirq.Circuit, QuipperReader, QasmReader, Iterable],
+    ) -> Iterator[np.ndarray]:
+        ops = self._normalize_input(data)
+
+        for op in ops:
+            self._process(op)
+
+            if self.n_complete >= self.window_size:
+                yield self._flush()
+
+    def finalize(self) -> np.ndarray:
+        self._append_out_gates()
+        return self._flush()
+
+    def _process(self, op) -> None:
+        self._ensure_inputs(op)
+        code, param, global_shift, switch, cl_ctrl, meas_key = self.translator.to_fields(op)
+
+        qubits = self._get_qubits(op)
+        prev = [self.latest[q] for q in qubits]
+
+        gate_id = self._new_id()
+        self._append_row(
+            gate_id,
+            prev + [NULL_LINK] * (MAX_QUBITS_PER_GATE - len(prev)),
+            code,
+            param,
+            global_shift,
+            switch,
+            cl_ctrl,
+            NULL_LINK if meas_key is None else meas_key,
+            n_ports=len(qubits),
+        )
+
+        for idx, q in enumerate(qubits):
+            new_link = LinkID.encode(gate_id, idx, code)
+            self._set_next_link(prev[idx], new_link)
+            self.latest[q] = new_link
+
+    def _ensure_inputs(self, op) -> None:
+        in_type = PandoraGateTranslator.In.value
+
+        for q in self._get_qubits(op):
+            if q in self.latest:
+                continue
+
+            gid = self._new_id()
+            self._append_row(
+                gid,
+                (NULL_LINK, NULL_LINK, NULL_LINK),
+                in_type,
+                0.0,
+                0.0,
+                False,
+                False,
+                NULL_LINK,
+                n_ports=1,
+            )
+
+            self.latest[q] = LinkID.encode(gid, 0, in_type)
+            self.inputs[q] = gid
+
+    def _append_out_gates(self) -> None:
+        out_type = PandoraGateTranslator.Out.value
+
+        for q, last_link in self.latest.items():
+            gid = self._new_id()
+            self.outputs[q] = gid
+            self._append_row(
+                gid,
+                (last_link, NULL_LINK, NULL_LINK),
+                out_type,
+                0.0,
+                0.0,
+                False,
+                False,
+                NULL_LINK,
+                n_ports=0,
+            )
+
+            self._set_next_link(last_link, LinkID.encode(gid, 0, out_type))
+
+    def _append_row(
+        self,
+        gate_id: int,
+        prev,
+        code: int,
+        param: float,
+        global_shift: float,
+        switch: bool,
+        cl_ctrl: bool,
+        meas_key: int,
+        n_ports: int,
+    ) -> None:
+        if self.n_rows == len(self.rows):
+            self._grow()
+
+        row = self.n_rows
+        self.rows[row] = (
+            gate_id, prev[0], prev[1], prev[2],
+            code, param, global_shift, switch,
+            NULL_LINK, NULL_LINK, NULL_LINK,
+            -1, self._label, cl_ctrl, meas_key,
+        )
+        self.missing[row] = n_ports
+
+        if n_ports == 0:
+            self.n_complete += 1
+
+        self.n_rows += 1
+
+    def _row_of(self, gate_id: int) -> int:
+        if gate_id < self.base_id:
+            return self.carried[gate_id]
+        return gate_id - self.base_id + len(self.carried)
+
+    def _next_id_block(self) -> None:
+        super()._next_id_block()
+
+        # ids stop being contiguous here, look up the rows created so far through self.carried
+        self.carried = dict(zip(self.rows["id"][:self.n_rows].tolist(), range(self.n_rows)))
+        self.base_id = self.last_id
+
+    def _set_next_link(self, prev_link: int, new_link: int) -> None:
+        row = self._row_of(LinkID.gate_id(prev_link))
+        self._next_columns[LinkID.port(prev_link)][row] = new_link
+
+        self.missing[row] -= 1
+        if self.missing[row] == 0:
+            self.n_complete += 1
+
+    def _flush(self) -> np.ndarray:
+        n = self.n_rows
+        missing = np.frombuffer(self.missing, dtype=np.uint8, count=n)
+        done = missing == 0
+
+        out = self.rows[:n][done]
+
+        pending = np.flatnonzero(~done)
+        k = len(pending)
+        self.rows[:k] = self.rows[pending]
+        self.missing[:k] = missing[pending].tobytes()
+
+        self.carried = dict(zip(self.rows["id"][:k].tolist(), range(k)))
+        self.base_id = self.last_id
+        self.n_rows = k
+        self.n_complete = 0
+
+        return out
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self.rows)
+
+        rows = np.empty(capacity, dtype=PANDORA_GATE_DTYPE)
+        rows[:self.n_rows] = self.rows[:self.n_rows]
+        self.rows = rows
+
+        self.missing.extend(bytes(capacity - len(self.missing)))
+
+        self._bind_columns()
+
+    def _bind_columns(self) -> None:
+        self._next_columns = (
+            self.rows["next_q1"],
+            self.rows["next_q2"],
+            self.rows["next_q3"],
+        )
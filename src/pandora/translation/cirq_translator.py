@@ -1,3 +1,5 @@
+from typing import Callable
+
 import cirq
 
 from pandora.exceptions.exceptions import CirqGateHasNoPandoraEquivalent
@@ -13,33 +15,63 @@ from pandora.translation.translator import (
 class CirqToPandoraTranslator:
     """
     Translator for Cirq operations -> PandoraGate.
+
+    The gate class is resolved only once: the first operation of a class builds
+    a translation function that is cached in self._dispatch, and every following
+    operation of that class costs one dict lookup plus the function call.
+    The cache is keyed by class and not by gate instance, because Cirq gates compare
+    equal across classes (e.g. cirq.X == cirq.XPowGate()) while Pandora gives them
+    different types.
     """
 
     def __init__(self):
         self.meas_key_dict: dict[str, int] = {}
+        self._dispatch: dict[type, Callable[[cirq.Gate], tuple[int, float, float, int | None]]] = {}
 
     def translate(self, op: cirq.Operation, label: str | None = None) -> PandoraGate:
-        gate, code, meas_key = self._resolve_gate(op)
+        code, parameter, global_shift, switch, cl_ctrl, meas_key = self.to_fields(op)
 
         return PandoraGate(
             gate_code=code,
-            gate_parameter=self._get_parameter(op, code),
-            switch=self._is_switched(op),
-            global_shift=self._get_global_shift(op, code),
-            is_classically_controlled=self._is_classically_controlled(op),
+            gate_parameter=parameter,
+            switch=switch,
+            global_shift=global_shift,
+            is_classically_controlled=cl_ctrl,
             measurement_key=meas_key,
             label=label,
         )
 
-    def _resolve_gate(self, op):
-        gate = op.without_classical_controls().gate
+    def to_fields(self, op: cirq.Operation) -> tuple[int, float, float, bool, bool, int | None]:
+        """
+        Same as translate(), but returns the raw column values
+        (type, param, global_shift, switch, cl_ctrl, meas_key) without building a PandoraGate.
+        """
+        cl_ctrl = self._is_classically_controlled(op)
+        gate = op.without_classical_controls().gate if cl_ctrl else op.gate
+
+        code, parameter, global_shift, meas_key = self._resolve_gate(gate)
+
+        return (
+            code,
+            parameter,
+            global_shift,
+            self._is_switched(op),
+            cl_ctrl,
+            meas_key,
+        )
+
+    def _resolve_gate(self, gate: cirq.Gate) -> tuple[int, float, float, int | None]:
+        translate = self._dispatch.get(gate.__class__)
 
-        if isinstance(gate, cirq.MeasurementGate):
-            key = gate.key
-            if key not in self.meas_key_dict:
-                self.meas_key_dict[key] = len(self.meas_key_dict)
+        if translate is None:
+            translate = self._build_translation(gate)
+            self._dispatch[gate.__class__] = translate
+
+        return translate(gate)
 
-            return gate, PandoraGateTranslator.M.value, self.meas_key_dict[key]
+    def _build_translation(self, gate: cirq.Gate):
+        if isinstance(gate, cirq.MeasurementGate):
+            return self._translate_measurement
 
         name = gate.__class__.__name__
 
@@ -49,8 +81,22 @@ class CirqToPandoraTranslator:
         if name not in PandoraGateTranslator.__members__:
             raise CirqGateHasNoPandoraEquivalent(f"Unsupported gate: {name}")
 
-        enum_value = getattr(PandoraGateTranslator, name).value
-        return gate, enum_value, None
+        code = getattr(PandoraGateTranslator, name).value
+
+        if code in REQUIRES_ROTATION:
+            return lambda g: (code, getattr(g, "_rads", 0), 0, None)
+
+        if code in REQUIRES_EXPONENT:
+            return lambda g: (code, g.exponent, getattr(g, "global_shift", 0), None)
+
+        return lambda g: (code, 0, 0, None)
+
+    def _translate_measurement(self, gate: cirq.MeasurementGate) -> tuple[int, float, float, int]:
+        key = gate.key
+        if key not in self.meas_key_dict:
+            self.meas_key_dict[key] = len(self.meas_key_dict)
+
+        return PandoraGateTranslator.M.value, 0, 0, self.meas_key_dict[key]
 
     @staticmethod
     def _is_switched(op):
@@ -59,20 +105,3 @@ class CirqToPandoraTranslator:
     @staticmethod
     def _is_classically_controlled(op):
         return len(op.classical_controls) > 0
-
-    @staticmethod
-    def _get_parameter(op, code):
-        gate = op.gate
-        if code in REQUIRES_ROTATION:
-            return getattr(gate, "_rads", 0)
-
-        if code in REQUIRES_EXPONENT:
-            return gate.exponent
-
-        return 0
-
-    @staticmethod
-    def _get_global_shift(op, code):
-        if code in REQUIRES_EXPONENT:
-            return getattr(op.gate, "global_shift", 0)
-        return 0
\ No newline at end of file
@@ -17,6 +17,30 @@ from pandora.translation.translator import (
 )
 from pandora.translation.link import LinkID
 
+# Integer columns cannot hold None in NumPy, so missing links and measurement keys are stored as -1.
+NULL_LINK = -1
+
+# Row layout of linked_circuit used by the columnar builder.
+PANDORA_GATE_DTYPE = np.dtype([
+    ("id", np.int64),
+    ("prev_q1", np.int64),
+    ("prev_q2", np.int64),
+    ("prev_q3", np.int64),
+    ("type", np.int16),
+    ("param", np.float32),
+    ("global_shift", np.float32),
+    ("switch", np.bool_),
+    ("next_q1", np.int64),
+    ("next_q2", np.int64),
+    ("next_q3", np.int64),
+    ("visited", np.int32),
+    ("label", "U16"),
+    ("cl_ctrl", np.bool_),
+    ("meas_key", np.int16),
+])
+
+NULLABLE_COLUMNS = ("prev_q1", "prev_q2", "prev_q3", "next_q1", "next_q2", "next_q3", "meas_key")
+
 
 @dataclass
 class PandoraGate:
@@ -102,6 +126,33 @@ class PandoraGate:
             qubit_name=row[15] if len(row) > 15 else None,
         )
 
+    @classmethod
+    def from_record(cls, record):
+        """
+        Build a gate from one row of a PANDORA_GATE_DTYPE array.
+        """
+        def _nullable(value):
+            value = int(value)
+            return None if value == NULL_LINK else value
+
+        return cls(
+            gate_id=int(record["id"]),
+            prev_q1=_nullable(record["prev_q1"]),
+            prev_q2=_nullable(record["prev_q2"]),
+            prev_q3=_nullable(record["prev_q3"]),
+            gate_code=int(record["type"]),
+            gate_parameter=float(record["param"]),
+            global_shift=float(record["global_shift"]),
+            switch=bool(record["switch"]),
+            next_q1=_nullable(record["next_q1"]),
+            next_q2=_nullable(record["next_q2"]),
+            next_q3=_nullable(record["next_q3"]),
+            visited=int(record["visited"]),
+            label=str(record["label"]) or None,
+            is_classically_controlled=bool(record["cl_ctrl"]),
+            measurement_key=_nullable(record["meas_key"]),
+        )
+
     def with_stripped_links(self):
         return PandoraGate(
             gate_id=self.id,
@@ -0,0 +1,71 @@
+import math
+from typing import NamedTuple, Optional
+
+from pandora.translation.gates import PandoraGate
+from pandora.translation.translator import (
+    PandoraGateTranslator,
+    QISKIT_TO_PANDORA,
+    REQUIRES_EXPONENT,
+)
+
+
+class NamedOp(NamedTuple):
+    """
+    A gate read from a text circuit format (Quipper, OpenQASM), named like the equivalent
+    Qiskit gate. Qubits are global qubit indices, rotation angles are in radians.
+    """
+    name: str
+    qubits: tuple[int, ...]
+    params: tuple[float, ...] = ()
+
+
+class NamedOpTranslator:
+    """
+    Translator NamedOp -> PandoraGate.
+
+    Produces the same rows as QiskitToPandoraTranslator for the equivalent Qiskit gates,
+    so streamed circuits and circuits built with Qiskit are interchangeable.
+    """
+
+    def __init__(self):
+        self.meas_key_dict: dict[str, int] = {}
+        self._fields = {
+            name: (code, 1.0 if code in REQUIRES_EXPONENT else 0.0, 0.0)
+            for name, code in QISKIT_TO_PANDORA.items()
+        }
+
+    def translate(self, op: NamedOp, label: Optional[str] = None) -> PandoraGate:
+        gate_code, parameter, global_shift, switch, cl_ctrl, measurement_key = self.to_fields(op)
+
+        return PandoraGate(
+            gate_code=gate_code,
+            gate_parameter=parameter,
+            switch=switch,
+            global_shift=global_shift,
+            is_classically_controlled=cl_ctrl,
+            measurement_key=measurement_key,
+            label=label,
+        )
+
+    def to_fields(self, op: NamedOp) -> tuple[int, float, float, bool, bool, Optional[int]]:
+        fields = self._fields.get(op.name)
+        if fields is None:
+            raise ValueError(f"Unsupported gate: {op.name}")
+
+        code, parameter, global_shift = fields
+        measurement_key = None
+
+        if op.params:
+            # angles are in radians, while Pandora takes them in multiples of pi
+            parameter = float(op.params[0] / math.pi)
+
+        if code == PandoraGateTranslator.M.value:
+            key = f"m_{op.qubits[0]}"
+            if key not in self.meas_key_dict:
+                self.meas_key_dict[key] = len(self.meas_key_dict)
+            measurement_key = self.meas_key_dict[key]
+
+        qubits = op.qubits
+        switch = len(qubits) == 2 and qubits[0] < qubits[1]
+
+        return code, parameter, global_shift, switch, False, measurement_key
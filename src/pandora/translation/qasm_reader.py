@@ -0,0 +1,179 @@
+import ast
+import math
+import operator
+import re
+from pathlib import Path
+from typing import Iterator
+
+from pandora.translation.named_op import NamedOp
+
+QREG_2 = re.compile(r'qreg\s+(\w+)\s*\[\s*(\d+)\s*\]$')
+QREG_3 = re.compile(r'qubit\s*(?:\[\s*(\d+)\s*\])?\s+(\w+)$')
+MEASURE_2 = re.compile(r'measure\s+(.+?)\s*->\s*.+$')
+MEASURE_3 = re.compile(r'(?:.+?=\s*)?measure\s+(.+)$')
+GATE = re.compile(r'([A-Za-z_]\w*)\s*(?:\((.*)\))?\s+(.+)$')
+ARGUMENT = re.compile(r'(\w+)\s*(?:\[\s*(\d+)\s*\])?$')
+
+SKIPPED = ("OPENQASM", "include", "creg", "bit", "barrier")
+
+CONSTANTS = {"pi": math.pi, "π": math.pi, "tau": 2 * math.pi, "τ": 2 * math.pi, "e": math.e}
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+class QasmReader:
+    """
+    Streams the gates of an OpenQASM 2 or 3 file statement by statement, without loading
+    the whole file or building a QuantumCircuit. Can be passed directly to
+    PandoraWindowedBuilder.consume() (or PandoraService.build_circuit()), so memory stays
+    constant for arbitrarily large dumps.
+
+    Supported are register declarations, the Qiskit standard gates (with constant angle
+    expressions), register broadcasting and measurements. Barriers are skipped.
+    Gate definitions, control flow and gate modifiers raise a ValueError.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+
+        # first global qubit index and size of every quantum register
+        self.registers: dict[str, tuple[int, int]] = {}
+        self.n_qubits = 0
+
+        # global index of every indexed qubit argument (e.g. "q[3]") seen so far
+        self._qubit_index: dict[str, int] = {}
+
+    def __iter__(self) -> Iterator[NamedOp]:
+        self.registers = {}
+        self.n_qubits = 0
+        self._qubit_index = {}
+
+        for statement in self._statements():
+            yield from self._parse(statement)
+
+    def _statements(self) -> Iterator[str]:
+        pending = ""
+        in_block_comment = False
+
+        with self.path.open("r") as f:
+            for line in f:
+                if in_block_comment:
+                    end = line.find("*/")
+                    if end < 0:
+                        continue
+                    line = line[end + 2:]
+                    in_block_comment = False
+
+                line = line.split("//", 1)[0]
+
+                start = line.find("/*")
+                if start >= 0:
+                    end = line.find("*/", start + 2)
+                    if end < 0:
+                        in_block_comment = True
+                        line = line[:start]
+                    else:
+                        line = line[:start] + " " + line[end + 2:]
+
+                *statements, pending = (pending + " " + line).split(";")
+
+                for statement in statements:
+                    statement = statement.strip()
+                    if statement:
+                        yield statement
+
+        if pending.strip():
+            raise ValueError(f"Unterminated QASM statement: {pending.strip()}")
+
+    def _parse(self, statement: str) -> Iterator[NamedOp]:
+        if statement.startswith(SKIPPED):
+            return
+
+        if statement.startswith(("qreg", "qubit")):
+            self._declare(statement)
+            return
+
+        if "measure" in statement:
+            match = MEASURE_2.match(statement) or MEASURE_3.match(statement)
+            if match is not None:
+                for (qubit,) in self._broadcast([match.group(1)]):
+                    yield NamedOp("measure", (qubit,))
+                return
+
+        match = GATE.match(statement)
+        if match is None or match.group(1) in ("gate", "def", "if", "for", "while", "ctrl", "inv", "pow"):
+            raise ValueError(f"Unsupported QASM statement: {statement}")
+
+        name, params, arguments = match.groups()
+        params = tuple(self._eval(p) for p in params.split(",")) if params else ()
+
+        for qubits in self._broadcast(arguments.split(",")):
+            yield NamedOp(name.lower(), qubits, params)
+
+    def _declare(self, statement: str) -> None:
+        match = QREG_2.match(statement)
+        if match is not None:
+            name, size = match.group(1), int(match.group(2))
+        else:
+            match = QREG_3.match(statement)
+            if match is None:
+                raise ValueError(f"Unsupported QASM statement: {statement}")
+            name, size = match.group(2), int(match.group(1) or 1)
+
+        self.registers[name] = (self.n_qubits, size)
+        self.n_qubits += size
+
+    def _broadcast(self, arguments: list[str]) -> Iterator[tuple[int, ...]]:
+        """
+        Global qubit indices for every application of the gate, a whole register
+        as argument applies the gate once per qubit of the register.
+        """
+        qubits = [self._qubit_index.get(argument) for argument in arguments]
+        if None not in qubits:
+            yield tuple(qubits)
+            return
+
+        resolved = []
+        size = 1
+
+        for argument in arguments:
+            match = ARGUMENT.match(argument.strip())
+            if match is None or match.group(1) not in self.registers:
+                raise ValueError(f"Unknown QASM qubit: {argument.strip()}")
+
+            offset, register_size = self.registers[match.group(1)]
+
+            if match.group(2) is None:
+                resolved.append(range(offset, offset + register_size))
+                size = register_size
+            else:
+                resolved.append(offset + int(match.group(2)))
+                self._qubit_index[argument] = resolved[-1]
+
+        for i in range(size):
+            yield tuple(r if isinstance(r, int) else r[i] for r in resolved)
+
+    def _eval(self, expression: str) -> float:
+        return self._eval_node(ast.parse(expression.strip(), mode="eval").body)
+
+    def _eval_node(self, node: ast.AST) -> float:
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+
+        if isinstance(node, ast.Name) and node.id in CONSTANTS:
+            return CONSTANTS[node.id]
+
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](self._eval_node(node.left), self._eval_node(node.right))
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](self._eval_node(node.operand))
+
+        raise ValueError(f"Unsupported QASM expression: {ast.unparse(node)}")
@@ -1,7 +1,7 @@
 import math
-from typing import Optional
+from typing import Callable, Optional
 
-from qiskit.circuit import CircuitInstruction, Measure
+from qiskit.circuit import CircuitInstruction, Instruction, Measure
 
 from pandora.translation.gates import PandoraGate
 from pandora.translation.translator import (
@@ -14,65 +14,101 @@ from pandora.translation.translator import (
 class QiskitToPandoraTranslator:
     """
     Translator Qiskit CircuitInstruction -> PandoraGate.
+
+    The translation function for a gate name is built the first time the name is seen
+    and cached in self._dispatch, so every following instruction costs one dict lookup.
     """
 
     def __init__(self):
         self.meas_key_dict: dict[str, int] = {}
+        self._dispatch: dict[str, Callable[[CircuitInstruction, Instruction], tuple]] = {}
 
     def translate(
         self,
         instr: CircuitInstruction,
         label: Optional[str] = None,
     ) -> PandoraGate:
-        gate_code, parameter, global_shift, measurement_key = self._resolve_gate(instr)
+        gate_code, parameter, global_shift, switch, cl_ctrl, measurement_key = self.to_fields(instr)
 
         return PandoraGate(
             gate_code=gate_code,
             gate_parameter=parameter,
-            switch=self._is_switched(instr),
+            switch=switch,
             global_shift=global_shift,
-            is_classically_controlled=self._is_classically_controlled(instr),
+            is_classically_controlled=cl_ctrl,
             measurement_key=measurement_key,
             label=label,
         )
 
+    def to_fields(
+        self,
+        instr: CircuitInstruction,
+    ) -> tuple[int, float, float, bool, bool, Optional[int]]:
+        """
+        Same as translate(), but returns the raw column values
+        (type, param, global_shift, switch, cl_ctrl, meas_key) without building a PandoraGate.
+        """
+        op = instr.operation
+        gate_code, parameter, global_shift, measurement_key = self._resolve_gate(instr, op)
+
+        return (
+            gate_code,
+            parameter,
+            global_shift,
+            self._is_switched(instr),
+            self._is_classically_controlled(op),
+            measurement_key,
+        )
+
     def _resolve_gate(
         self,
         instr: CircuitInstruction,
+        op: Instruction,
     ) -> tuple[int, float, float, Optional[int]]:
-        op = instr.operation
+        translate = self._dispatch.get(op.name)
 
-        if isinstance(op, Measure):
-            qubit_index = instr.qubits[0]._index
-            key = f"m_{qubit_index}"
+        if translate is None:
+            translate = self._build_translation(op)
+            self._dispatch[op.name] = translate
 
-            if key not in self.meas_key_dict:
-                self.meas_key_dict[key] = len(self.meas_key_dict)
+        return translate(instr, op)
 
-            return (
-                PandoraGateTranslator.M.value,
-                0.0,
-                0.0,
-                self.meas_key_dict[key],
-            )
+    def _build_translation(self, op: Instruction):
+        if isinstance(op, Measure):
+            return self._translate_measurement
 
         qiskit_name = op.name
         if qiskit_name not in QISKIT_TO_PANDORA:
             raise ValueError(f"Unsupported gate: {qiskit_name}")
 
         gate_code = QISKIT_TO_PANDORA[qiskit_name]
+
         if op.params:
             # Qiskit rotation gates take angles in radians, while Pandora takes them in multiples of pi, so we convert here.
-            parameter = float(op.params[0] / math.pi)
-        elif gate_code in REQUIRES_EXPONENT:
-            parameter = 1.0
-        else:
-            parameter = 0.0
+            return lambda instr, o: (gate_code, float(o.params[0] / math.pi), 0.0, None)
 
-        global_shift = 0.0
-        measurement_key = None
+        parameter = 1.0 if gate_code in REQUIRES_EXPONENT else 0.0
+        resolved = (gate_code, parameter, 0.0, None)
 
-        return gate_code, parameter, global_shift, measurement_key
+        return lambda instr, o: resolved
+
+    def _translate_measurement(
+        self,
+        instr: CircuitInstruction,
+        op: Instruction,
+    ) -> tuple[int, float, float, int]:
+        qubit_index = instr.qubits[0]._index
+        key = f"m_{qubit_index}"
+
+        if key not in self.meas_key_dict:
+            self.meas_key_dict[key] = len(self.meas_key_dict)
+
+        return (
+            PandoraGateTranslator.M.value,
+            0.0,
+            0.0,
+            self.meas_key_dict[key],
+        )
 
     @staticmethod
     def _is_switched(instr: CircuitInstruction) -> bool:
@@ -82,6 +118,5 @@ class QiskitToPandoraTranslator:
         return qargs[0]._index < qargs[1]._index
 
     @staticmethod
-    def _is_classically_controlled(instr: CircuitInstruction) -> bool:
-        op = instr.operation
+    def _is_classically_controlled(op: Instruction) -> bool:
         return bool(getattr(op, "condition", None))
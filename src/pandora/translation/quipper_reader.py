@@ -0,0 +1,76 @@
+import re
+from pathlib import Path
+from typing import Iterator
+
+from pandora.translation.named_op import NamedOp
+
+NOT_GATE = re.compile(r'QGate\["not"\]\((\d+)\)(?: with controls=\[([^\]]*)\])?')
+CONTROL = re.compile(r'([+-])(\d+)')
+
+
+class QuipperReader:
+    """
+    Streams the gates of a Quipper ASCII circuit file (e.g. benchmarking/adders/Adder*.txt)
+    line by line, without building a circuit object first. Can be passed directly
+    to PandoraWindowedBuilder.consume().
+
+    Only QGate["not"] with up to two controls is supported. Hollow (-) controls are
+    conjugated with X gates and, with decompose_toffoli=True, every Toffoli is expanded
+    into Clifford+T exactly as benchmark_adders.decompose_toffoli_qiskit() does.
+    Qubit initialisation and termination (QInit/QTerm) lines are skipped.
+    """
+
+    def __init__(self, path: str | Path, decompose_toffoli: bool = True):
+        self.path = Path(path)
+        self.decompose_toffoli = decompose_toffoli
+
+    def __iter__(self) -> Iterator[NamedOp]:
+        with self.path.open("r") as f:
+            for line in f:
+                match = NOT_GATE.match(line)
+                if match is None:
+                    continue
+
+                target = int(match.group(1))
+                controls = [
+                    (int(idx), polarity == "+")
+                    for polarity, idx in CONTROL.findall(match.group(2) or "")
+                ]
+
+                yield from self._expand_not(target, controls)
+
+    def _expand_not(self, target: int, controls: list[tuple[int, bool]]) -> Iterator[NamedOp]:
+        if len(controls) > 2:
+            raise ValueError(f"Not gate on {target} has more than two controls.")
+
+        hollow = [NamedOp("x", (c,)) for c, polarity in controls if not polarity]
+        yield from hollow
+
+        if not controls:
+            yield NamedOp("x", (target,))
+        elif len(controls) == 1:
+            yield NamedOp("cx", (controls[0][0], target))
+        elif self.decompose_toffoli:
+            yield from self._toffoli(controls[0][0], controls[1][0], target)
+        else:
+            yield NamedOp("ccx", (controls[0][0], controls[1][0], target))
+
+        yield from hollow
+
+    @staticmethod
+    def _toffoli(c0: int, c1: int, t: int) -> Iterator[NamedOp]:
+        yield NamedOp("h", (t,))
+        yield NamedOp("cx", (c1, t))
+        yield NamedOp("tdg", (t,))
+        yield NamedOp("cx", (c0, t))
+        yield NamedOp("t", (t,))
+        yield NamedOp("cx", (c1, t))
+        yield NamedOp("tdg", (t,))
+        yield NamedOp("cx", (c0, t))
+        yield NamedOp("cx", (c0, c1))
+        yield NamedOp("tdg", (c1,))
+        yield NamedOp("cx", (c0, c1))
+        yield NamedOp("t", (c0,))
+        yield NamedOp("t", (c1,))
+        yield NamedOp("t", (t,))
+        yield NamedOp("h", (t,))
@@ -1,13 +1,18 @@
 import pytest
 import cirq
+import numpy as np
 
 from benchmarking import cirq_util
-from pandora.translation.circuit_to_dag import PandoraWindowedBuilder
+from pandora.translation.circuit_to_dag import PandoraWindowedBuilder, PandoraColumnarBuilder
+from pandora.translation.cirq_translator import CirqToPandoraTranslator
 from pandora.db.core import PandoraDB
+from pandora.db.id_blocks import IdBlockAllocator
 from pandora.db.repository import GateRepository
 from pandora.db.service import PandoraService
 
 from pandora.translation.dag_to_circuit import pandora_to_circuit
+from pandora.translation.gates import PandoraGate
+from pandora.translation.translator import PandoraGateTranslator
 from pandora.util.circuit_util import (
     get_adder_as_cirq_circuit,
     remove_io_gates,
@@ -71,6 +76,83 @@ def test_random_reconstruction(n_circuits=100):
         print("Test passed!")
 
 
+def test_builder_keeps_only_frontier():
+    q = cirq.LineQubit.range(3)
+    ops = [cirq.H(q[0]), cirq.CX(q[0], q[1]), cirq.CCX(q[0], q[1], q[2]), cirq.T(q[2])] * 100
+
+    builder = PandoraWindowedBuilder(window_size=WINDOW_SIZE, label=LABEL)
+
+    gates = []
+    for batch in builder.consume(ops):
+        gates.extend(batch)
+        assert len(builder.gates) <= len(q)
+
+    gates.extend(builder.finalize())
+
+    assert len(builder.gates) == 0
+    assert len(gates) == len(ops) + 2 * len(q)
+    assert len({g.id for g in gates}) == len(gates)
+
+    for g in gates:
+        n_ports = len([link for link in g.links_prev() if link is not None]) or 1
+        if g.type != PandoraGateTranslator.Out.value:
+            assert all(link is not None for link in g.links_next()[:n_ports])
+
+
+def test_builders_keep_multi_qubit_measurement_until_complete():
+    # the measurement type is a single qubit type, it still waits for a next link on each qubit
+    q = cirq.LineQubit.range(2)
+    circuit = cirq.Circuit([cirq.H(q[0]), cirq.measure(q[0], q[1]), cirq.H(q[0]), cirq.H(q[1])])
+
+    builder = PandoraWindowedBuilder(window_size=WINDOW_SIZE, label=str(LABEL))
+    gates = []
+    for batch in builder.consume(circuit):
+        gates.extend(batch)
+    gates.extend(builder.finalize())
+
+    columnar_builder = PandoraColumnarBuilder(window_size=WINDOW_SIZE, label=str(LABEL))
+    columnar_gates = []
+    for window in columnar_builder.consume(circuit):
+        columnar_gates.extend(PandoraGate.from_record(row) for row in window)
+    columnar_gates.extend(PandoraGate.from_record(row) for row in columnar_builder.finalize())
+
+    assert len(builder.gates) == 0
+    assert len(gates) == 4 + 2 * len(q)
+    assert sorted(g.to_tuple() for g in columnar_gates) == sorted(g.to_tuple() for g in gates)
+
+    measurement = next(g for g in gates if g.type == PandoraGateTranslator.M.value)
+    assert all(link is not None for link in measurement.links_next()[:2])
+
+
+def test_columnar_builder_matches_windowed_builder(n_circuits=20):
+    templates = ['add_two_hadamards', 'add_two_cnots', 'add_base_change', 'add_t_t_dag', 'add_t_cx', 'add_cx_t']
+
+    for i in range(n_circuits):
+        rand = cirq_util.create_random_circuit(
+            n_qubits=4,
+            n_templates=15,
+            templates=templates
+        )
+
+        builder = PandoraWindowedBuilder(window_size=WINDOW_SIZE, label=str(LABEL))
+        gates = []
+        for batch in builder.consume(rand):
+            gates.extend(batch)
+        gates.extend(builder.finalize())
+
+        columnar_builder = PandoraColumnarBuilder(window_size=WINDOW_SIZE, label=str(LABEL))
+        columnar_gates = []
+        for window in columnar_builder.consume(rand):
+            assert len(window) >= WINDOW_SIZE
+            columnar_gates.extend(PandoraGate.from_record(row) for row in window)
+        columnar_gates.extend(PandoraGate.from_record(row) for row in columnar_builder.finalize())
+
+        assert sorted(g.to_tuple() for g in columnar_gates) == sorted(g.to_tuple() for g in gates)
+
+        recon = remove_io_gates(pandora_to_circuit(pandora_gates=columnar_gates))
+        assert_same_up_to_qubit_permutation(expected=rand, actual=recon)
+
+
 @pytest.mark.asyncio
 async def test_qualtran_adder_reconstruction():
     for n_bits in range(2, 4):
@@ -102,3 +184,446 @@ async def test_qualtran_adder_reconstruction():
 
         assert_same_up_to_qubit_permutation(expected=full_adder_circuit, actual=extracted_circuit)
         print(f'Passed adder({n_bits})!')
+
+
+@pytest.mark.asyncio
+async def test_qualtran_adder_reconstruction_columnar():
+    full_adder_circuit = get_adder_as_cirq_circuit(n_bits=3)
+
+    full_adder_circuit = remove_measurements(
+        remove_classically_controlled_ops(full_adder_circuit)
+    )
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo, decomposition_window_size=16)
+
+        await service.build_circuit(
+            circuit=full_adder_circuit,
+            columnar=True,
+        )
+
+        extracted_circuit = await service.load_circuit(circuit_type='cirq')
+    finally:
+        await db.close()
+
+    extracted_circuit = remove_io_gates(extracted_circuit)
+
+    assert_same_up_to_qubit_permutation(expected=full_adder_circuit, actual=extracted_circuit)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("columnar", [False, True])
+async def test_qualtran_adder_reconstruction_pipelined(columnar):
+    full_adder_circuit = get_adder_as_cirq_circuit(n_bits=3)
+
+    full_adder_circuit = remove_measurements(
+        remove_classically_controlled_ops(full_adder_circuit)
+    )
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo, decomposition_window_size=16)
+
+        stats = await service.build_circuit_pipelined(
+            circuit=full_adder_circuit,
+            n_writers=3,
+            queue_size=2,
+            columnar=columnar,
+        )
+
+        extracted_circuit = await service.load_circuit(circuit_type='cirq')
+    finally:
+        await db.close()
+
+    assert stats.build.gates == stats.insert.gates
+    assert stats.build.windows == stats.insert.windows
+
+    extracted_circuit = remove_io_gates(extracted_circuit)
+
+    assert_same_up_to_qubit_permutation(expected=full_adder_circuit, actual=extracted_circuit)
+
+
+@pytest.mark.asyncio
+async def test_binary_copy_matches_record_copy():
+    q = cirq.LineQubit.range(3)
+    circuit = cirq.Circuit(
+        [cirq.H(q[0]), cirq.CX(q[0], q[1]), cirq.CCX(q[0], q[1], q[2]), cirq.T(q[2]) ** -1] * 10
+    )
+
+    builder = PandoraWindowedBuilder(window_size=WINDOW_SIZE, label='7')
+    gates = []
+    for batch in builder.consume(circuit):
+        gates.extend(batch)
+    gates.extend(builder.finalize())
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo)
+
+        await service.build_pandora()
+        await repo.insert_copy(gates)
+        expected = sorted(g.to_tuple() for g in await repo.fetch_all())
+
+        await service.build_pandora()
+        await repo.insert_binary(gates)
+        actual = sorted(g.to_tuple() for g in await repo.fetch_all())
+    finally:
+        await db.close()
+
+    assert actual == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("compact", [False, True])
+async def test_stream_columns_matches_record_copy(compact):
+    q = cirq.LineQubit.range(3)
+    circuit = cirq.Circuit([
+        cirq.H(q[0]),
+        cirq.CX(q[0], q[1]),
+        cirq.rz(0.3).on(q[2]),
+        cirq.CCX(q[0], q[1], q[2]),
+        cirq.measure(q[0], key="m"),
+        cirq.X(q[1]).with_classical_controls("m"),
+    ] * 5)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db, compact=compact)
+        service = PandoraService(db=db, repo=repo)
+
+        await service.build_circuit(circuit=circuit)
+        expected = sorted(g.to_tuple() for g in await repo.fetch_all())
+
+        windows = [window async for window in repo.stream_columns(chunk_rows=4)]
+    finally:
+        await db.close()
+
+    # every row has to be decoded at the right offset, not only the first one
+    actual = sorted(PandoraGate.from_record(record).to_tuple() for window in windows for record in window)
+    assert actual == expected
+
+
+def test_cirq_dispatch_cache_is_keyed_by_gate_class():
+    q = cirq.LineQubit(0)
+    translator = CirqToPandoraTranslator()
+
+    # cirq.X == cirq.XPowGate(exponent=1) and cirq.Rz(pi) equals a ZPowGate, they must not share a translation
+    ops = [cirq.X(q), cirq.XPowGate(exponent=1)(q), cirq.Z(q), cirq.Rz(rads=np.pi)(q), cirq.Z(q) ** 0.5]
+    types = [translator.to_fields(op)[0] for op in ops]
+
+    assert types == [
+        PandoraGateTranslator._PauliX.value,
+        PandoraGateTranslator.XPowGate.value,
+        PandoraGateTranslator._PauliZ.value,
+        PandoraGateTranslator.Rz.value,
+        PandoraGateTranslator.ZPowGate.value,
+    ]
+    assert translator.to_fields(ops[-1])[1] == 0.5
+
+
+def test_builders_take_ids_from_id_blocks():
+    q = cirq.LineQubit.range(3)
+    circuit = cirq.Circuit([cirq.H(q[0]), cirq.CX(q[0], q[1]), cirq.CX(q[1], q[2]), cirq.T(q[2])] * 5)
+    blocks = [range(100 * i, 100 * i + 7) for i in range(1, 10)]
+
+    results = []
+    for builder_class in [PandoraWindowedBuilder, PandoraColumnarBuilder]:
+        builder = builder_class(window_size=4, label=str(LABEL))
+        for block in blocks:
+            builder.add_id_block(block)
+
+        gates = []
+        for window in builder.consume(circuit):
+            gates.extend(window)
+        gates.extend(builder.finalize())
+
+        if builder_class is PandoraColumnarBuilder:
+            gates = [PandoraGate.from_record(row) for row in gates]
+        results.append(sorted(g.to_tuple() for g in gates))
+
+        assert all(any(g.id in block for block in blocks) for g in gates)
+        recon = remove_io_gates(pandora_to_circuit(pandora_gates=gates))
+        assert_same_up_to_qubit_permutation(expected=circuit, actual=recon)
+
+    assert results[0] == results[1]
+
+
+@pytest.mark.asyncio
+async def test_id_blocks_do_not_overlap():
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_pandora()
+
+        blocks = await IdBlockAllocator(db, owner="a").reserve(2) + await IdBlockAllocator(db, owner="b").reserve(1)
+
+        async with db.pool.acquire() as conn:
+            procedure_id = await conn.fetchval("insert into linked_circuit(type) values (8) returning id")
+            n_blocks = await conn.fetchval("select count(*) from id_blocks")
+    finally:
+        await db.close()
+
+    assert n_blocks == 4
+    # block 0 stays free for builders without an allocator
+    assert all(block.start >= len(block) for block in blocks)
+    assert all(procedure_id not in block for block in blocks)
+    assert len({block.start for block in blocks}) == 3
+
+
+@pytest.mark.asyncio
+async def test_stitch_shards_reconnects_circuit():
+    q = cirq.LineQubit.range(4)
+    circuit = cirq.Circuit([
+        cirq.H(q[0]), cirq.CX(q[0], q[1]), cirq.T(q[1]),
+        cirq.CX(q[2], q[3]), cirq.CX(q[1], q[0]), cirq.S(q[3]),
+        cirq.H(q[2]), cirq.CX(q[3], q[0]), cirq.T(q[1]) ** -1,
+    ])
+    ops = list(circuit.all_operations())
+    # q[2] does not appear in the middle shard
+    shards = [ops[:4], ops[4:6], ops[6:]]
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo)
+        await service.build_pandora()
+
+        for shard, shard_ops in enumerate(shards):
+            builder = PandoraWindowedBuilder(window_size=WINDOW_SIZE, label=str(shard))
+            id_allocator = IdBlockAllocator(db)
+            await id_allocator.top_up(builder)
+
+            for batch in builder.consume(shard_ops):
+                await repo.insert_copy(batch)
+            await repo.insert_copy(builder.finalize())
+            await repo.insert_boundary(shard=shard, boundary=builder.qubit_boundary())
+
+        await service.stitch_shards()
+        gates = await repo.fetch_all()
+    finally:
+        await db.close()
+
+    assert len([g for g in gates if g.type == PandoraGateTranslator.In.value]) == 4
+    assert len([g for g in gates if g.type == PandoraGateTranslator.Out.value]) == 4
+    assert len(gates) == len(ops) + 8
+
+    recon = remove_io_gates(pandora_to_circuit(pandora_gates=gates))
+    assert_same_up_to_qubit_permutation(expected=cirq.Circuit(ops), actual=recon)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("nprocs", [1, 3])
+async def test_build_circuit_parallel(nprocs):
+    templates = ['add_two_hadamards', 'add_two_cnots', 'add_base_change', 'add_t_t_dag', 'add_t_cx', 'add_cx_t']
+    circuit = cirq_util.create_random_circuit(n_qubits=5, n_templates=40, templates=templates)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo, decomposition_window_size=WINDOW_SIZE)
+
+        await service.build_circuit_parallel(circuit=circuit, nprocs=nprocs)
+        gates = await repo.fetch_all()
+    finally:
+        await db.close()
+
+    n_qubits = len(circuit.all_qubits())
+    assert len([g for g in gates if g.type == PandoraGateTranslator.In.value]) == n_qubits
+    assert len(gates) == len(list(circuit.all_operations())) + 2 * n_qubits
+
+    recon = remove_io_gates(pandora_to_circuit(pandora_gates=gates))
+    assert_same_up_to_qubit_permutation(expected=circuit, actual=recon)
+
+
+@pytest.mark.asyncio
+async def test_build_circuit_parallel_numbers_keys_over_whole_circuit():
+    q = cirq.LineQubit.range(2)
+    circuit = cirq.Circuit(
+        [cirq.H(q[0]), cirq.measure(q[0], key="a"), cirq.CX(q[0], q[1])] * 3
+        + [cirq.measure(q[1], key="b"), cirq.H(q[1])] * 3
+        + [cirq.measure(q[0], key="c"), cirq.measure(q[1], key="a")] * 3
+    )
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo, decomposition_window_size=WINDOW_SIZE)
+
+        await service.build_circuit(circuit=circuit)
+        expected = await service.load_circuit(circuit_type='cirq')
+
+        await service.build_circuit_parallel(circuit=circuit, nprocs=3)
+        actual = await service.load_circuit(circuit_type='cirq')
+    finally:
+        await db.close()
+
+    def keys(c):
+        return [cirq.measurement_key_name(op) for op in c.all_operations() if cirq.is_measurement(op)]
+
+    assert keys(actual) == keys(expected)
+    assert sorted(set(keys(actual))) == ["0", "1", "2"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("unlogged", [False, True])
+async def test_bulk_load_builds_indexes_afterwards(unlogged):
+    q = cirq.LineQubit.range(3)
+    circuit = cirq.Circuit([cirq.H(q[0]), cirq.CX(q[0], q[1]), cirq.CX(q[1], q[2]), cirq.T(q[2])] * 10)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo)
+
+        await service.build_circuit(circuit=circuit, bulk_load=True, unlogged=unlogged)
+        gates = await repo.fetch_all()
+
+        async with db.pool.acquire() as conn:
+            indexes = await conn.fetch("select indexname from pg_indexes where tablename = 'linked_circuit'")
+            persistence = await conn.fetchval("select relpersistence::text from pg_class where relname = 'linked_circuit'")
+            primary_key = await conn.fetchval(
+                "select count(*) from pg_constraint where conrelid = 'linked_circuit'::regclass and contype = 'p'"
+            )
+    finally:
+        await db.close()
+
+    assert {r["indexname"] for r in indexes} == {
+        "linked_circuit_pkey",
+        "linked_circuit_neighbour_types_idx",
+        "linked_circuit_next_type_idx",
+        "linked_circuit_next_ids_equal_idx",
+        "linked_circuit_toffoli_idx",
+    }
+    assert persistence == "p"
+    assert primary_key == 1
+
+    recon = remove_io_gates(pandora_to_circuit(pandora_gates=gates))
+    assert_same_up_to_qubit_permutation(expected=circuit, actual=recon)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("columnar", [False, True])
+async def test_compact_layout_matches_default_layout(columnar):
+    q = cirq.LineQubit.range(3)
+    circuit = cirq.Circuit([
+        cirq.H(q[0]),
+        cirq.CX(q[0], q[1]),
+        cirq.rz(0.3).on(q[2]),
+        cirq.CCX(q[0], q[1], q[2]),
+        cirq.measure(q[0], key="m"),
+        cirq.X(q[1]).with_classical_controls("m"),
+    ] * 3)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        layouts = {}
+        for compact in [False, True]:
+            repo = GateRepository(db, compact=compact)
+            service = PandoraService(db=db, repo=repo)
+
+            await service.build_circuit(circuit=circuit, columnar=columnar)
+            layouts[compact] = sorted(g.to_tuple() for g in await repo.fetch_all())
+
+        async with db.pool.acquire() as conn:
+            n_attributes = await conn.fetchval("select count(*) from linked_circuit_attributes")
+    finally:
+        await db.close()
+
+    assert layouts[True] == layouts[False]
+    # only the rotations, measurements and classically controlled gates have attributes
+    assert 0 < n_attributes < len(layouts[True])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("n_partitions", [None, 2])
+async def test_compact_attributes_are_deleted_with_their_gates(n_partitions):
+    q = cirq.LineQubit.range(2)
+    circuit = cirq.Circuit([
+        cirq.rz(0.3).on(q[1]),
+        cirq.measure(q[0], key="m"),
+        cirq.X(q[1]).with_classical_controls("m"),
+    ] * 3)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db, compact=True)
+        service = PandoraService(db=db, repo=repo)
+
+        await service.build_circuit(circuit=circuit)
+        if n_partitions:
+            await service.partition_circuit(n_partitions=n_partitions)
+
+        async with db.pool.acquire() as conn:
+            before = await conn.fetchval("select count(*) from linked_circuit_attributes")
+            await conn.execute(
+                "delete from linked_circuit where type not in (select id from gate_types where name in ('in', 'out'))"
+            )
+            after = await conn.fetchval("select count(*) from linked_circuit_attributes")
+    finally:
+        await db.close()
+
+    # the measurements and the classically controlled gates
+    assert before == 6
+    assert after == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("compact", [False, True])
+async def test_snapshot_round_trip(compact, tmp_path):
+    q = cirq.LineQubit.range(3)
+    circuit = cirq.Circuit([
+        cirq.H(q[0]),
+        cirq.CX(q[0], q[1]),
+        cirq.rz(0.3).on(q[2]),
+        cirq.CCX(q[0], q[1], q[2]),
+        cirq.measure(q[0], key="m"),
+        cirq.X(q[1]).with_classical_controls("m"),
+    ] * 3)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db, compact=compact)
+        service = PandoraService(db=db, repo=repo)
+
+        await service.build_circuit(circuit=circuit)
+        before = sorted(g.to_tuple() for g in await repo.fetch_all())
+
+        n_exported = await service.export_snapshot(tmp_path / "circuit.npz", chunk_rows=5)
+        n_imported = await service.import_snapshot(tmp_path / "circuit.npz")
+        after = sorted(g.to_tuple() for g in await repo.fetch_all())
+
+        blocks = await IdBlockAllocator(db).reserve()
+    finally:
+        await db.close()
+
+    assert n_exported == n_imported == len(before)
+    assert after == before
+    assert blocks[0].start > max(g[0] for g in after)
@@ -1,4 +1,6 @@
+import asyncio
 import random
+import time
 
 import cirq
 import pytest
@@ -8,6 +10,7 @@ from pandora.db.core import PandoraDB
 from pandora.db.repository import GateRepository
 from pandora.db.service import PandoraService
 from pandora.optimisation.optimiser import PandoraOptimiser
+from pandora.optimisation.rewrite_compiler import RewriteTemplate, TemplateGate
 from pandora.translation.translator import PandoraGateTranslator
 from pandora.util.circuit_util import remove_io_gates
 from pandora.util.test_util import assert_same_up_to_qubit_permutation, count_t_gates, \
@@ -1139,3 +1142,674 @@ async def test_race_condition(pass_count, timeout, stop_after, trials):
 
         finally:
             await db.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("n_partitions", [1, 3])
+async def test_partitioned_hhcxhh_to_cx(n_partitions):
+    """
+    Every partition is rewritten by its own worker, the templates that straddle a
+    partition boundary are left to the boundary pass.
+    """
+    q1, q2 = cirq.NamedQubit("q1"), cirq.NamedQubit("q2")
+    template = [cirq.H.on(q1), cirq.H.on(q2), cirq.CX.on(q1, q2), cirq.H.on(q1), cirq.H.on(q2)]
+
+    initial_circuit = cirq.Circuit(template * 20)
+    expected_circuit = cirq.Circuit([cirq.CX.on(q2, q1)] * 20)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo)
+
+        await service.build_circuit(circuit=initial_circuit)
+        await service.partition_circuit(n_partitions=n_partitions)
+
+        async with db.pool.acquire() as conn:
+            partitions = await conn.fetchval("select count(*) from linked_circuit_partitions")
+            kind = await conn.fetchval("select relkind::text from pg_class where relname = 'linked_circuit'")
+
+        optimiser = PandoraOptimiser(db=db, pass_count=1, timeout=10, logger_id=1)
+        optimiser.hhcxhh_to_cx(dedicated_nproc=n_partitions, partitioned=True)
+        await optimiser.start()
+
+        extracted_circuit = remove_io_gates(await service.load_circuit(circuit_type='cirq'))
+    finally:
+        await db.close()
+
+    assert partitions == n_partitions
+    assert kind == "p"
+    assert_same_up_to_qubit_permutation(expected=expected_circuit, actual=extracted_circuit)
+
+
+@pytest.mark.asyncio
+async def test_boundary_pass_starts_from_deferred_candidates():
+    """
+    The partition-pinned workers defer the templates that straddle a boundary, the
+    boundary worker rewrites them without a full scan and ends without a stopper.
+    """
+    q1, q2 = cirq.NamedQubit("q1"), cirq.NamedQubit("q2")
+    template = [cirq.H.on(q1), cirq.H.on(q2), cirq.CX.on(q1, q2), cirq.H.on(q1), cirq.H.on(q2)]
+
+    initial_circuit = cirq.Circuit(template * 20)
+    expected_circuit = cirq.Circuit([cirq.CX.on(q2, q1)] * 20)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=initial_circuit)
+        await service.partition_circuit(n_partitions=3)
+
+        async with db.pool.acquire() as conn:
+            await conn.execute("call reset_convergence()")
+            for i in range(3):
+                await conn.execute(f"call linked_hhcxhh_to_cx(2, 10, {i})")
+            deferred = await conn.fetchval("select count(distinct id) from boundary_gates")
+
+            await conn.execute("call reset_convergence()")
+            await conn.execute("update stop_condition set boundary = true")
+            # many more passes than the time allows, the worker has to end by itself
+            await asyncio.wait_for(conn.execute("call linked_hhcxhh_to_cx(1000000, 60)"), timeout=30)
+            full_scans, queue_passes = await conn.fetchrow("select full_scans, queue_passes from finished_passes")
+
+        extracted_circuit = remove_io_gates(await service.load_circuit(circuit_type='cirq'))
+    finally:
+        await db.close()
+
+    assert deferred > 0
+    assert full_scans == 0
+    assert queue_passes > 0
+    assert_same_up_to_qubit_permutation(expected=expected_circuit, actual=extracted_circuit)
+
+
+@pytest.mark.asyncio
+async def test_partitioned_workers_have_to_match_partitions():
+    q1, q2 = cirq.NamedQubit("q1"), cirq.NamedQubit("q2")
+    initial_circuit = cirq.Circuit([cirq.H.on(q1), cirq.H.on(q2), cirq.CX.on(q1, q2), cirq.H.on(q1), cirq.H.on(q2)] * 4)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=initial_circuit)
+
+        optimiser = PandoraOptimiser(db=db, pass_count=1, timeout=10, logger_id=1)
+        optimiser.hhcxhh_to_cx(dedicated_nproc=2, partitioned=True)
+        with pytest.raises(ValueError, match="not partitioned"):
+            await optimiser.start()
+
+        await service.partition_circuit(n_partitions=3)
+        with pytest.raises(ValueError, match="3 partitions"):
+            await optimiser.start()
+    finally:
+        await db.close()
+
+
+async def _expected_edges(db: PandoraDB) -> list[tuple[int, int]]:
+    async with db.pool.acquire() as conn:
+        gates = await conn.fetch("select id, type, next_q1, next_q2, next_q3 from linked_circuit")
+
+    edges = []
+    for gate in gates:
+        if gate['type'] == PandoraGateTranslator.In.value:
+            edges.append((-1, gate['id']))
+        if gate['type'] == PandoraGateTranslator.Out.value:
+            edges.append((gate['id'], -2))
+        for link in (gate['next_q1'], gate['next_q2'], gate['next_q3']):
+            if link is not None:
+                edges.append((gate['id'], link // 1000))
+
+    return sorted(edges)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("nprocs", [1, 3])
+async def test_build_edge_list(nprocs):
+    """
+    The edge list is the same whether it is built in one go, in id ranges, or updated
+    with the edges of the gates a rewrite touched.
+    """
+    q1, q2, q3 = cirq.LineQubit.range(3)
+    initial_circuit = cirq.Circuit(
+        [cirq.H.on(q1), cirq.H.on(q1), cirq.CX.on(q1, q2), cirq.CX.on(q1, q2), cirq.TOFFOLI.on(q1, q2, q3)] * 5
+    )
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        repo = GateRepository(db)
+        service = PandoraService(db=db, repo=repo)
+
+        await service.build_circuit(circuit=initial_circuit)
+        await service.build_edge_list(nprocs=nprocs)
+
+        built = sorted(tuple(edge) for edge in await service.get_edge_list())
+        assert built == await _expected_edges(db)
+
+        optimiser = PandoraOptimiser(db=db, pass_count=1, timeout=1, logger_id=1)
+        optimiser.cancel_single_qubit_gates(gate_types=(H, H), gate_params=(1, 1), dedicated_nproc=1)
+        optimiser.cancel_two_qubit_gates(gate_types=(CX, CX), gate_param=1, dedicated_nproc=1)
+        await optimiser.start()
+
+        await service.build_edge_list(incremental=True)
+
+        updated = sorted(tuple(edge) for edge in await service.get_edge_list())
+        expected = await _expected_edges(db)
+    finally:
+        await db.close()
+
+    assert updated == expected
+    assert len(updated) < len(built)
+
+
+@pytest.mark.asyncio
+async def test_namespaces_hold_separate_circuits():
+    """
+    Two circuits are built at the same time in their own namespaces, rewriting one
+    leaves the other alone.
+    """
+    q = cirq.NamedQubit('q')
+    circuits = {
+        "pandora_test_a": cirq.Circuit([cirq.H.on(q)] * 4),
+        "pandora_test_b": cirq.Circuit([cirq.H.on(q), cirq.T.on(q), cirq.H.on(q)]),
+    }
+    dbs = {namespace: PandoraDB(namespace=namespace) for namespace in circuits}
+
+    async def _build(namespace: str) -> PandoraService:
+        db = dbs[namespace]
+        await db.connect()
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=circuits[namespace])
+        return service
+
+    try:
+        service_a, service_b = await asyncio.gather(*(_build(namespace) for namespace in circuits))
+
+        optimiser = PandoraOptimiser(db=dbs["pandora_test_a"], pass_count=10, timeout=1, logger_id=1)
+        optimiser.cancel_single_qubit_gates(gate_types=(H, H), gate_params=(1, 1), dedicated_nproc=1)
+        await optimiser.start()
+
+        circuit_a = remove_io_gates(await service_a.load_circuit(circuit_type='cirq'))
+        circuit_b = remove_io_gates(await service_b.load_circuit(circuit_type='cirq'))
+    finally:
+        for namespace, db in dbs.items():
+            if db.pool is not None:
+                async with db.pool.acquire() as conn:
+                    await conn.execute(f"DROP SCHEMA IF EXISTS {namespace} CASCADE")
+            await db.close()
+
+    assert len(list(circuit_a.all_operations())) == 0
+    assert_same_up_to_qubit_permutation(expected=circuits["pandora_test_b"], actual=circuit_b)
+
+
+@pytest.mark.asyncio
+async def test_logger_counts_match_table():
+    """
+    The stats logger reads the gate histogram, its last sample has to agree with
+    counting the rewritten table.
+    """
+    q = cirq.LineQubit.range(2)
+    circuit = cirq.Circuit([cirq.H(q[0]), cirq.H(q[0]), cirq.T(q[1]), cirq.CX(q[0], q[1])] * 10)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=circuit)
+
+        optimiser = PandoraOptimiser(db=db, pass_count=10, timeout=2, logger_id=1)
+        optimiser.cancel_single_qubit_gates(gate_types=(H, H), gate_params=(1, 1), dedicated_nproc=2)
+        optimiser.log()
+        await optimiser.start()
+
+        async with db.pool.acquire() as conn:
+            samples = await conn.fetch("select * from optimization_results where logger_id = 1 order by id")
+            total = await conn.fetchval("select count(*) from linked_circuit")
+            h_count = await conn.fetchval(f"select count(*) from linked_circuit where type = {H.value}")
+            triggers = await conn.fetchval("select count(*) from pg_trigger where tgname like 'gate_histogram%'")
+    finally:
+        await db.close()
+
+    # one sample per second, not a busy loop
+    assert 1 <= len(samples) <= 4
+    assert samples[-1]["total_count"] == total
+    assert samples[-1]["h_count"] == h_count == 0
+    assert samples[-1]["t_count"] == 10
+    assert triggers == 0
+
+
+@pytest.mark.asyncio
+async def test_run_drops_triggers_of_dead_logger():
+    """
+    A logger that errored or was cancelled leaves the gate histogram triggers on
+    linked_circuit, the next run drops them.
+    """
+    q = cirq.LineQubit.range(1)
+    circuit = cirq.Circuit([cirq.H(q[0]), cirq.H(q[0]), cirq.T(q[0])] * 10)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=circuit)
+
+        async with db.pool.acquire() as conn:
+            await conn.execute("call start_gate_histogram()")
+            left_over = await conn.fetchval("select count(*) from pg_trigger where tgname like 'gate_histogram%'")
+
+        optimiser = PandoraOptimiser(db=db, pass_count=10, timeout=1)
+        optimiser.cancel_single_qubit_gates(gate_types=(H, H), gate_params=(1, 1), dedicated_nproc=1)
+        await optimiser.start()
+
+        async with db.pool.acquire() as conn:
+            triggers = await conn.fetchval("select count(*) from pg_trigger where tgname like 'gate_histogram%'")
+    finally:
+        await db.close()
+
+    assert left_over == 2
+    assert triggers == 0
+
+
+@pytest.mark.asyncio
+async def test_stopper_ends_run_once_saturated():
+    """
+    With a stopper the workers exit as soon as nothing is left to rewrite,
+    long before the timeout.
+    """
+    q = cirq.NamedQubit('q')
+    circuit = cirq.Circuit([cirq.H.on(q)] * 20)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=circuit)
+
+        optimiser = PandoraOptimiser(db=db, pass_count=PandoraOptimiser.LARGE_RUN_NR, timeout=60, logger_id=1)
+        optimiser.cancel_single_qubit_gates(gate_types=(H, H), gate_params=(1, 1), dedicated_nproc=2)
+        optimiser.add_stopper()
+
+        start = time.time()
+        await optimiser.start()
+        elapsed = time.time() - start
+
+        circuit_out = remove_io_gates(await service.load_circuit(circuit_type='cirq'))
+    finally:
+        await db.close()
+
+    assert elapsed < 10
+    # the passes after the last rewrite, that only found the circuit saturated, do not count
+    assert 0 < optimiser.rewrite_time < elapsed
+    assert len(list(circuit_out.all_operations())) == 0
+
+
+async def _run_workers(db: PandoraDB, queries: list[str], stopper: bool = True):
+    """
+    Runs the worker calls like PandoraOptimiser.start(), without its reset_convergence() at
+    the end, and returns the pass counts in finished_passes and the number of queued gates.
+    """
+    async def _execute(query):
+        async with db.pool.acquire() as conn:
+            await conn.execute(query)
+
+    await _execute("call reset_convergence()")
+    await asyncio.gather(*(_execute(query) for query in queries + (["call stopper(20)"] if stopper else [])))
+
+    async with db.pool.acquire() as conn:
+        passes = await conn.fetchrow("select full_scans, queue_passes from finished_passes")
+        queued = await conn.fetchval("select count(*) from dirty_gates")
+
+    return passes, queued
+
+
+@pytest.mark.asyncio
+async def test_nested_cancellations_through_dirty_queue():
+    """
+    Every cancellation makes the next pair of the nest adjacent, so after the first pass
+    the workers find the matches among the gates the other rules put in their queues.
+    """
+    q = cirq.NamedQubit('q')
+    nest = [cirq.H, cirq.X, cirq.Z] * 5
+    circuit = cirq.Circuit([gate.on(q) for gate in nest + nest[::-1]] * 4)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=circuit)
+
+        # the Pauli gates are stored with param 0
+        passes, queued = await _run_workers(db, [
+            f"call cancel_single_qubit({gate_type.value}, {gate_type.value}, {param}, {param}, "
+            f"{PandoraOptimiser.LARGE_RUN_NR}, 20)"
+            for gate_type, param in ((H, 1), (PauliX, 0), (PauliZ, 0))
+        ])
+
+        circuit_out = remove_io_gates(await service.load_circuit(circuit_type='cirq'))
+    finally:
+        await db.close()
+
+    assert len(list(circuit_out.all_operations())) == 0
+    assert passes["full_scans"] >= 3
+    assert passes["queue_passes"] > 0
+    # the last passes found the queues empty
+    assert queued == 0
+
+
+@pytest.mark.asyncio
+async def test_dirty_queue_sees_rewrites_of_exited_workers():
+    """
+    A worker that rewrote and exited leaves its gates in the queues of the running workers,
+    and their next pass after the queue ran empty is a full scan.
+    """
+    q1, q2 = cirq.NamedQubit('q1'), cirq.NamedQubit('q2')
+    circuit = cirq.Circuit([cirq.CX.on(q1, q2)])
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=circuit)
+
+        async with db.pool.acquire() as listener, db.pool.acquire() as worker:
+            await listener.execute("call reset_convergence()")
+            await listener.execute("call start_passes('listener')")
+            before = await listener.fetchval("select clock_timestamp()::timestamp")
+
+            await worker.execute("call linked_cx_to_hhcxhh(1, 10)")
+
+            queued = await listener.fetchval("select count(*) from dirty_gates where queue = 'listener'")
+            await listener.fetchval("select pop_dirty_gates('listener')")
+            candidates = await listener.fetchval("select next_candidates('listener', $1)", before)
+            workers_left = await listener.fetchval("select count(*) from rewrite_count")
+    finally:
+        await db.close()
+
+    assert queued == 9
+    assert workers_left == 1
+    assert candidates is None
+
+
+HHCXHH_TO_CX = RewriteTemplate(
+    name="compiled_hhcxhh_to_cx",
+    n_qubits=2,
+    lhs=[
+        TemplateGate(H, (0,)), TemplateGate(H, (1,)),
+        TemplateGate(CX, (0, 1)),
+        TemplateGate(H, (0,)), TemplateGate(H, (1,)),
+    ],
+    rhs=[TemplateGate(CX, (1, 0))],
+)
+
+CANCEL_HH = RewriteTemplate(
+    name="compiled_cancel_hh",
+    n_qubits=1,
+    lhs=[TemplateGate(H, (0,)), TemplateGate(H, (0,))],
+    rhs=[],
+)
+
+
+@pytest.mark.asyncio
+async def test_compiled_rewrites():
+    """
+    The compiled templates reproduce the hand-written hhcxhh_to_cx and H cancellation, including
+    the matches that only appear after another rewrite.
+    """
+    q1, q2 = cirq.NamedQubit('q1'), cirq.NamedQubit('q2')
+    initial_circuit = cirq.Circuit([
+        cirq.H.on(q1), cirq.H.on(q1), cirq.H.on(q1),
+        cirq.H.on(q2),
+        cirq.CX.on(q1, q2),
+        cirq.H.on(q1), cirq.H.on(q2),
+        cirq.T.on(q1),
+    ])
+    expected_circuit = cirq.Circuit([cirq.CX.on(q2, q1), cirq.T.on(q1)])
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db), rewrites=[HHCXHH_TO_CX])
+        await service.build_circuit(circuit=initial_circuit)
+        await service.install_rewrite(CANCEL_HH)
+
+        optimiser = PandoraOptimiser(db=db, pass_count=PandoraOptimiser.LARGE_RUN_NR, timeout=10, logger_id=1)
+        optimiser.apply_rewrite(HHCXHH_TO_CX, dedicated_nproc=1)
+        optimiser.apply_rewrite(CANCEL_HH, dedicated_nproc=1)
+        optimiser.add_stopper()
+        await optimiser.start()
+
+        extracted_circuit = remove_io_gates(await service.load_circuit(circuit_type='cirq'))
+
+        async with db.pool.acquire() as conn:
+            indexes = await conn.fetch("select indexname from pg_indexes where indexname like 'compiled_%'")
+    finally:
+        await db.close()
+
+    assert_same_up_to_qubit_permutation(expected=expected_circuit, actual=extracted_circuit)
+    assert {r["indexname"] for r in indexes} == {
+        "compiled_hhcxhh_to_cx_candidates_idx",
+        "compiled_cancel_hh_candidates_idx",
+    }
+
+
+def test_template_has_to_be_connected():
+    with pytest.raises(ValueError):
+        RewriteTemplate(
+            name="disconnected",
+            n_qubits=2,
+            lhs=[TemplateGate(H, (0,)), TemplateGate(H, (1,))],
+            rhs=[],
+        )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("batch_size", [1, 3, 64])
+async def test_batched_cancellations(batch_size):
+    """
+    The batched procedures leave the same circuit as the per-match ones, also when the
+    matches of a batch share neighbours (a CX between two cancelling pairs).
+    """
+    q1, q2, q3 = cirq.NamedQubit('q1'), cirq.NamedQubit('q2'), cirq.NamedQubit('q3')
+    block = [
+        cirq.H.on(q1), cirq.H.on(q1),
+        cirq.CX.on(q1, q2), cirq.CX.on(q1, q2),
+        cirq.H.on(q2), cirq.H.on(q2),
+        cirq.CX.on(q2, q3), cirq.CX.on(q2, q3),
+        cirq.T.on(q1), cirq.CX.on(q3, q1),
+        cirq.H.on(q3), cirq.H.on(q3),
+    ]
+    initial_circuit = cirq.Circuit(block * 20)
+    expected_circuit = cirq.Circuit([cirq.T.on(q1), cirq.CX.on(q3, q1)] * 20)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=initial_circuit)
+
+        optimiser = PandoraOptimiser(db=db, pass_count=PandoraOptimiser.LARGE_RUN_NR, timeout=20, logger_id=1)
+        optimiser.cancel_single_qubit_gates(gate_types=(H, H), gate_params=(1, 1), dedicated_nproc=2,
+                                            batch_size=batch_size)
+        optimiser.cancel_two_qubit_gates(gate_types=(CX, CX), gate_param=1, dedicated_nproc=2,
+                                         batch_size=batch_size)
+        optimiser.add_stopper()
+        await optimiser.start()
+
+        extracted_circuit = remove_io_gates(await service.load_circuit(circuit_type='cirq'))
+    finally:
+        await db.close()
+
+    assert_same_up_to_qubit_permutation(expected=expected_circuit, actual=extracted_circuit)
+
+
+def test_batch_size_has_to_be_positive():
+    optimiser = PandoraOptimiser(db=PandoraDB())
+    with pytest.raises(ValueError):
+        optimiser.cancel_single_qubit_gates(gate_types=(H, H), batch_size=0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("batch_size", [1, 4, 1000])
+@pytest.mark.parametrize("compact", [False, True])
+async def test_decompose_toffolis(batch_size, compact):
+    """
+    Adjacent Toffolis and Toffolis that share a neighbour are all decomposed, by two workers,
+    in both layouts of linked_circuit.
+    """
+    q1, q2, q3, q4 = cirq.LineQubit.range(4)
+    initial_circuit = cirq.Circuit([
+        cirq.H.on(q1),
+        cirq.CCX.on(q1, q2, q3),
+        cirq.CCX.on(q1, q2, q3),
+        cirq.CCX.on(q3, q1, q2),
+        cirq.CX.on(q2, q4),
+        cirq.CCX.on(q4, q3, q1),
+        cirq.CCX.on(q2, q4, q3),
+        cirq.T.on(q4),
+        cirq.CCX.on(q1, q2, q4),
+    ])
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db, compact=compact))
+        await service.build_circuit(circuit=initial_circuit)
+
+        optimiser = PandoraOptimiser(db=db, pass_count=PandoraOptimiser.LARGE_RUN_NR, timeout=10, logger_id=1)
+        optimiser.decompose_toffolis(dedicated_nproc=2, batch_size=batch_size)
+        optimiser.add_stopper()
+        await optimiser.start()
+
+        extracted_circuit = remove_io_gates(await service.load_circuit(circuit_type='cirq'))
+    finally:
+        await db.close()
+
+    assert not any(isinstance(op.gate, cirq.CCXPowGate) for op in extracted_circuit.all_operations())
+    assert len(list(extracted_circuit.all_operations())) == 6 * 15 + 3
+    assert_logically_equivalent_up_to_qubit_permutation(expected=initial_circuit, actual=extracted_circuit)
+
+
+def test_adaptive_allocation():
+    allocation = PandoraOptimiser._allocate({"a": 30.0, "b": 10.0, "c": 0.0}, budget=11)
+    assert allocation == {"a": 7, "b": 3, "c": 1}
+
+    assert PandoraOptimiser._allocate({"a": 0.0, "b": 0.0}, budget=5) in ({"a": 3, "b": 2}, {"a": 2, "b": 3})
+
+
+@pytest.mark.asyncio
+async def test_adaptive_workers():
+    """
+    Only the H cancellations find matches, the scheduler moves the connections of the
+    other rules to them. The H workers sample the circuit, so that every pass is short and
+    the rates are known while there is still a lot to rewrite; the run ends at the timeout.
+    """
+    qubits = cirq.LineQubit.range(4)
+    circuit = cirq.Circuit([cirq.H.on(q) for q in qubits] * 1000)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=circuit)
+
+        optimiser = PandoraOptimiser(db=db, pass_count=PandoraOptimiser.LARGE_RUN_NR, timeout=5, logger_id=1,
+                                     max_concurrency=6)
+        optimiser.cancel_single_qubit_gates(gate_types=(H, H), gate_params=(1, 1), dedicated_nproc=1, sample_rows=20)
+        optimiser.cancel_single_qubit_gates(gate_types=(PauliX, PauliX), gate_params=(0, 0), dedicated_nproc=1)
+        optimiser.cancel_two_qubit_gates(gate_types=(CX, CX), gate_param=1, dedicated_nproc=1)
+
+        start = time.time()
+        await optimiser.start_adaptive(interval=0.2)
+        elapsed = time.time() - start
+
+        circuit_out = remove_io_gates(await service.load_circuit(circuit_type='cirq'))
+    finally:
+        await db.close()
+
+    history = optimiser.allocation_history
+    h_rule = next(rule for rule in history[0] if rule.startswith(f"call cancel_single_qubit_batched({H.value}, {H.value},"))
+
+    assert elapsed < 10
+    assert len(list(circuit_out.all_operations())) < len(list(circuit.all_operations()))
+    # 6 connections, 2 per rule until the first rates are known, then all spare ones go to H
+    assert history[0] == {rule: 2 for rule in history[0]}
+    assert history[-1] == {rule: 4 if rule == h_rule else 1 for rule in history[0]}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sampled", [False, True])
+async def test_sampling_workers_never_converge(sampled):
+    """
+    An idle sampling pass only means that the sample had no matches, the stopper must
+    not stop the run after idle_rounds of them.
+    """
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=cirq.Circuit(cirq.H.on(cirq.LineQubit(0))))
+
+        async with db.pool.acquire() as conn:
+            await conn.execute("call reset_convergence()")
+            await conn.execute(f"call start_passes(null, {sampled})")
+            for _ in range(3):
+                await conn.execute("call report_pass(clock_timestamp()::timestamp, 0, false)")
+            converged = await conn.fetchval("select rewrites_converged(2)")
+            await conn.execute("call finish_passes()")
+    finally:
+        await db.close()
+
+    assert converged is not sampled
+
+
+@pytest.mark.asyncio
+async def test_sampled_cancellations():
+    """
+    Sampling workers cancel gates without scanning the table or using the dirty_gates queue.
+    Which pairs a run finds depends on the samples, so it ends after pass_count passes and
+    only the gate counts and the unitary are checked.
+    """
+    qubits = cirq.LineQubit.range(4)
+    initial_circuit = cirq.Circuit([[cirq.H.on(q), cirq.H.on(q), cirq.T.on(q)] for q in qubits] * 50)
+
+    db = PandoraDB()
+    await db.connect()
+
+    try:
+        service = PandoraService(db=db, repo=GateRepository(db))
+        await service.build_circuit(circuit=initial_circuit)
+
+        passes, queued = await _run_workers(db, [
+            f"call cancel_single_qubit_batched({H.value}, {H.value}, 1, 1, 20, 20, 50, 50)"
+        ] * 2, stopper=False)
+
+        extracted_circuit = remove_io_gates(await service.load_circuit(circuit_type='cirq'))
+    finally:
+        await db.close()
+
+    ops = list(extracted_circuit.all_operations())
+    n_h = len([op for op in ops if op.gate == cirq.H])
+
+    assert count_t_gates(extracted_circuit) == 200
+    assert len(ops) == 200 + n_h
+    assert n_h < 400
+    assert_logically_equivalent_up_to_qubit_permutation(expected=initial_circuit, actual=extracted_circuit)
+
+    assert passes["full_scans"] == passes["queue_passes"] == 0
+    assert queued == 0
@@ -1,6 +1,12 @@
 import math
+import qiskit.qasm2
+import qiskit.qasm3
 from qiskit import QuantumCircuit
 
+from benchmarking.benchmark_adders import get_adder, replace_all_toffolis_qiskit, stream_adder
+from pandora.translation.circuit_to_dag import PandoraWindowedBuilder
+from pandora.translation.qasm_reader import QasmReader
+
 from pandora.translation.gates import PandoraGate, PandoraGateWrapper
 from pandora.translation.qiskit_translator import QiskitToPandoraTranslator
 from pandora.translation.translator import PandoraGateTranslator
@@ -87,3 +93,60 @@ def test_pandora_to_qiskit_extra_gates():
         "swap",
         "cx",
     ]
+
+
+def test_qiskit_dispatch_cache_keeps_parameters_per_instruction():
+    circuit = QuantumCircuit(2, 2)
+    circuit.rz(math.pi / 2, 0)
+    circuit.rz(math.pi / 4, 1)
+    circuit.measure([0, 1], [0, 1])
+
+    translator = QiskitToPandoraTranslator()
+    fields = [translator.to_fields(instruction) for instruction in circuit.data]
+
+    assert fields[0][1] == 0.5
+    assert fields[1][1] == 0.25
+    # the cached measurement translation still assigns one key per qubit
+    meas_keys = [f[5] for f in fields if f[0] == PandoraGateTranslator.M.value]
+    assert meas_keys == [0, 1]
+
+
+def test_quipper_reader_matches_qiskit_adder():
+    def build(data):
+        builder = PandoraWindowedBuilder(window_size=100)
+        gates = [g for window in builder.consume(data) for g in window]
+        return [g.to_tuple() for g in gates + builder.finalize()]
+
+    for n_bits in [8, 16]:
+        expected = build(replace_all_toffolis_qiskit(get_adder(n_bits=n_bits)))
+        assert build(stream_adder(n_bits=n_bits)) == expected
+
+
+def test_qasm_reader_matches_qiskit_circuit(tmp_path):
+    circuit = QuantumCircuit(4, 4)
+    for i in range(20):
+        circuit.h(i % 4)
+        circuit.cx(i % 4, (i + 1) % 4)
+        circuit.rz(0.1 * i, (i + 2) % 4)
+        circuit.tdg((i + 3) % 4)
+        circuit.ccx(i % 4, (i + 2) % 4, (i + 1) % 4)
+        circuit.rx(math.pi / 4, i % 4)
+    circuit.measure(range(4), range(4))
+
+    def build(data):
+        builder = PandoraWindowedBuilder(window_size=10)
+        gates = [g for window in builder.consume(data) for g in window]
+        return [g.to_tuple() for g in gates + builder.finalize()]
+
+    expected = build(circuit)
+
+    for version, dumps in [(2, qiskit.qasm2.dumps), (3, qiskit.qasm3.dumps)]:
+        path = tmp_path / f"circuit{version}.qasm"
+        path.write_text(dumps(circuit))
+
+        actual = build(QasmReader(path))
+
+        assert len(actual) == len(expected)
+        for a, e in zip(actual, expected):
+            assert a[:5] == e[:5] and a[6:] == e[6:]
+            assert math.isclose(a[5], e[5], abs_tol=1e-9)